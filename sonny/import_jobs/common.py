@@ -1,4 +1,5 @@
 import re
+from operator import itemgetter
 from abc import ABCMeta, abstractmethod, abstractproperty
 
 from sonny.infrastructure.context import helpers
@@ -23,6 +24,21 @@ class BaseImporter(Importer):
     pre_insert_queries = []
     post_insert_queries = []
 
+    pipelined_insert = False
+    """
+    Load and transform the data in a background thread, while inserting it, so
+    that parsing and inserting overlap. Only for a single insert query
+    """
+
+    columnar = False
+    """
+    Load the data as `columnar.RecordBatch`es, with a NumPy array per column,
+    instead of a dict per row, and save them as such. `transform_data` then
+    gets record batches, and should use the transformers in `columnar`, ending
+    with `columnar.dicts_to_tuples` for queries with positional placeholders.
+    Needs numpy
+    """
+
     @abstractproperty # noqa
     def insert_queries(self): pass # noqa
 
@@ -43,21 +59,30 @@ class BaseImporter(Importer):
     @helpers.step
     def insert_data(self, data):
         for insert_query in self.insert_queries:
-            self.saver(insert_query).save(data)
+            saver = self.saver(insert_query)
+            if self.columnar:
+                saver.save_record_batches(data)
+            else:
+                saver.save(data)
 
     @helpers.step
     def process_data(self, local_filenames):
         self.pre_insert()
         for local_filename in local_filenames:
-            data = self._loader().get_all_data_with_headers(local_filename)
+            if self.columnar:
+                data = self._loader().get_record_batches(local_filename)
+            else:
+                data = self._loader().get_all_data_with_headers(local_filename)
             data = self.transform_data(data)
 
             if len(self.insert_queries) > 1:
-                # TODO: Perhaps we should be loading the file twice,
-                # instead of creating a potentionally big tuple in-memory?
-                data = transformers.generator_to_tuples()(data)
-
-            self.insert_data(data)
+                # Buffer the data on disk, so that each query can replay it
+                with transformers.generator_to_replayable()(data) as data:
+                    self.insert_data(data)
+            else:
+                if self.pipelined_insert:
+                    data = transformers.in_background_thread()(data)
+                self.insert_data(data)
         self.post_insert()
         
     def get_files_to_fetch(self):
@@ -78,6 +103,13 @@ class FtpDbImporter(BaseImporter):
 
     fetcher = fetchers.FtpFetcher
 
+    streaming_fetch = False
+    """
+    Read the files straight from the FTP data connection while loading them,
+    instead of downloading them first. Only for loaders that read a stream,
+    like `CsvLoader`
+    """
+
     def __init__(self, files_to_fetch=None, **kwargs):
         super(FtpDbImporter, self).__init__(
             files_to_fetch=files_to_fetch, **kwargs)
@@ -95,7 +127,8 @@ class FtpDbImporter(BaseImporter):
         with fetchers.LocalFileContextManager(
                 self.get_files_list(),
                 self.fetcher(self.ftp_server),
-                self.deleter()) as local_filenames:
+                self.deleter(),
+                streaming=self.streaming_fetch) as local_filenames:
             if not local_filenames:
                 return False
 
@@ -106,15 +139,33 @@ class FtpDbImporter(BaseImporter):
         return [self.get_latest_file()]
 
     def version_from_filename(self, filename):
-        version = re.match(self.file_regex, filename).groups()[1]
-        return float(version)
+        return self._version_from_match(
+            self._get_compiled_file_regex().match(filename))
 
     def get_files_to_fetch(self):
         fetcher = self.fetcher(self.ftp_server)
-        all_remote_filenames = fetcher.search_regex_files('', self.file_regex)
-        filenames = sorted(all_remote_filenames, key=self.version_from_filename, reverse=True)
+        compiled_regex = self._get_compiled_file_regex()
+        # Match each name once, both to filter it and to get it's version
+        versioned_filenames = []
+        for filename in fetcher.search_files(''):
+            match = compiled_regex.match(filename)
+            if match:
+                versioned_filenames.append(
+                    (self._version_from_match(match), filename))
+        versioned_filenames.sort(key=itemgetter(0), reverse=True)
+        filenames = [filename for _, filename in versioned_filenames]
         return filenames
 
+    def _get_compiled_file_regex(self):
+        if getattr(self, '_compiled_file_regex', None) is None:
+            self._compiled_file_regex = re.compile(self.file_regex)
+
+        return self._compiled_file_regex
+
+    def _version_from_match(self, match):
+        version = match.groups()[1]
+        return float(version)
+
     def get_latest_file(self):
         filenames = self.files_to_fetch
         return filenames[0]
@@ -149,12 +200,15 @@ class EmailLoadTransformInsertDeleteImporter(BaseImporter):
     @helpers.step
     def do_run(self):
         search_kwargs = self.get_search_kwargs()
-        local_filenames = self.fetcher(self.email_source, self.file_pattern)\
-            .fetch_from_search('INBOX', **search_kwargs)
+        fetcher = self.fetcher(self.email_source, self.file_pattern)
+        local_filenames = fetcher.fetch_from_search('INBOX', **search_kwargs)
         if not local_filenames:
+            fetcher.save_sync_state()
             return False
         try:
             self.process_data(local_filenames)
+            # Only mark the mail as seen once it has been imported
+            fetcher.save_sync_state()
         finally:
             self.deleter().delete_files(local_filenames)
             return True
@@ -1,4 +1,5 @@
 import sys
+import threading
 
 
 class Context(object):
@@ -11,6 +12,7 @@ class Context(object):
     def __init__(self):
         self.facility_classes = {}
         self._jobs = []
+        self._thread_state = threading.local()
 
     @property
     def current_job(self):
@@ -19,6 +21,21 @@ class Context(object):
         """
         return self._jobs[-1]
 
+    @property
+    def are_steps_disabled(self):
+        """
+        Whether steps run as plain calls in the current thread
+        """
+        return getattr(self._thread_state, 'are_steps_disabled', False)
+
+    def disable_steps_in_thread(self):
+        """
+        Run steps as plain calls in the current thread, eg in a background
+        thread, as the jobs' steps are a single stack, that only the thread
+        running the job can push to
+        """
+        self._thread_state.are_steps_disabled = True
+
     def register_facility(self, name, klass):
         """
         Register a facility to be created every time a job is created
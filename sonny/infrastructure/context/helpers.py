@@ -58,6 +58,9 @@ def step(func):
     """
     @wraps(func)
     def decorated(*args, **kwargs):
+        if context.are_steps_disabled:
+            return func(*args, **kwargs)
+
         name = get_callable_name(func)
         with with_step(name=name) as step:
             wrapped = step.wrap_step_function(func)
@@ -66,6 +69,13 @@ def step(func):
     return decorated
 
 
+def disable_steps_in_thread():
+    """
+    Run steps as plain calls in the current thread, for background threads
+    """
+    context.disable_steps_in_thread()
+
+
 def ignore_exceptions(classes=(Exception,), returning=None):
     """
     Ignore any exceptions raised from the function call
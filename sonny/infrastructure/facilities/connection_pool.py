@@ -0,0 +1,152 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class ConnectionPoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of connections per key, for facilities that hand out
+    connections to operations.
+
+    Idle connections are reused, and are checked that they are alive when
+    checked out, and at most `max_size` connections are open per key
+    """
+
+    def __init__(self, create_connection, close_connection,
+                 is_connection_alive=None, reset_connection=None,
+                 max_size=None, timeout=None, check_after_idle=0):
+        """
+        :param create_connection: Create a new connection for a key
+        :param close_connection: Close a key's connection
+        :param is_connection_alive: Check if a key's idle connection is still
+            usable
+        :param reset_connection: Clean up a key's connection before it
+            becomes idle
+        :param max_size: Maximum open connections per key, or `None`
+        :param timeout: Seconds to wait for a connection, when `max_size`
+            connections are already checked out, or `None` to wait forever
+        :param check_after_idle: Only check connections that have been idle
+            for longer than that many seconds
+        """
+        self.create_connection = create_connection
+        self.close_connection = close_connection
+        self.is_connection_alive = is_connection_alive
+        self.reset_connection = reset_connection
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_after_idle = check_after_idle
+
+        self.condition = threading.Condition()
+        self.idle_connections = {}
+        self.open_counts = {}
+
+    @contextmanager
+    def connection(self, key):
+        """
+        Check out a connection for the duration of the `with` block. If the
+        block raises, the connection is discarded instead of being reused
+        """
+        connection = self.checkout(key)
+        succeeded = False
+        try:
+            yield connection
+            succeeded = True
+        finally:
+            if succeeded:
+                self.checkin(key, connection)
+            else:
+                self.discard(key, connection)
+
+    def checkout(self, key):
+        connection, idle_since = self._checkout_idle_or_reserve(key)
+        if connection is not None:
+            if time.time() - idle_since < self.check_after_idle:
+                return connection
+            if self._is_connection_alive(key, connection):
+                return connection
+            self._close_connection(key, connection)
+
+        # Create a connection in the reserved (or dead connection's) place
+        try:
+            return self.create_connection(key)
+        except Exception:
+            self._release(key)
+            raise
+
+    def checkin(self, key, connection):
+        if self.reset_connection:
+            try:
+                self.reset_connection(key, connection)
+            except Exception:
+                self.discard(key, connection)
+                return
+
+        with self.condition:
+            self.idle_connections.setdefault(key, [])\
+                .append((connection, time.time()))
+            self.condition.notify()
+
+    def discard(self, key, connection):
+        self._close_connection(key, connection)
+        self._release(key)
+
+    def close_all(self):
+        with self.condition:
+            idle_connections, self.idle_connections = \
+                self.idle_connections, {}
+            for key, connections in idle_connections.iteritems():
+                self.open_counts[key] -= len(connections)
+
+        for key, connections in idle_connections.iteritems():
+            for connection, _ in connections:
+                self._close_connection(key, connection)
+
+    def _checkout_idle_or_reserve(self, key):
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+
+        with self.condition:
+            while True:
+                idle_connections = self.idle_connections.get(key)
+                if idle_connections:
+                    return idle_connections.pop()
+
+                open_count = self.open_counts.get(key, 0)
+                if self.max_size is None or open_count < self.max_size:
+                    self.open_counts[key] = open_count + 1
+                    return None, None
+
+                if deadline is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise ConnectionPoolExhausted(
+                            "All %s connections for %s are in use"
+                            % (self.max_size, key))
+                    self.condition.wait(remaining)
+
+    def _release(self, key):
+        with self.condition:
+            self.open_counts[key] -= 1
+            self.condition.notify()
+
+    def _is_connection_alive(self, key, connection):
+        if not self.is_connection_alive:
+            return True
+
+        try:
+            return self.is_connection_alive(key, connection)
+        except Exception:
+            return False
+
+    def _close_connection(self, key, connection):
+        try:
+            self.close_connection(key, connection)
+        except Exception:
+            pass
@@ -1,4 +1,5 @@
 from sonny.infrastructure.facilities.generic_config_registry import GenericConfigRegistry
+from sonny.infrastructure.facilities.connection_pool import ConnectionPool
 
 from sonny.infrastructure.operations.database import DatabaseAccess
 
@@ -7,17 +8,86 @@ from sonny.infrastructure.context import helpers
 
 @helpers.register_facility("db_registry")
 class DbRegistry(GenericConfigRegistry):
+    class FacilitySettings(GenericConfigRegistry.FacilitySettings):
+        pool_max_size = 4
+        """
+        Maximum open connections per database alias
+        """
+        pool_timeout = 60
+        """
+        Seconds to wait for a connection to be returned to the pool, when all
+        of them are in use
+        """
+        pool_check_after_idle = 10
+        """
+        Check that a pooled connection is alive before reusing it, if it has
+        been idle for longer than that many seconds
+        """
+
     registry_config_name = "db_registry"
 
+    def enter_job(self, job, facility_settings):
+        super(DbRegistry, self).enter_job(job, facility_settings)
+
+        self.pool = ConnectionPool(
+            self._create_pooled_connection,
+            self._close_pooled_connection,
+            is_connection_alive=self._is_pooled_connection_alive,
+            reset_connection=self._reset_pooled_connection,
+            max_size=self.facility_settings.pool_max_size,
+            timeout=self.facility_settings.pool_timeout,
+            check_after_idle=self.facility_settings.pool_check_after_idle,
+        )
+
+    def exit_job(self, job, exc_type, exc_value, traceback):
+        self.pool.close_all()
+
     def get_database(self, alias):
         """
         Get all the database info for a database alias
         """
         return self[alias]
 
-    def create_connection_to_database(self, alias):
+    def get_database_connector(self, alias):
         """
-        Helper function to create a connection to a database by alias
+        Get the connector for a database alias
         """
         database = self.get_database(alias)
-        return DatabaseAccess().create_connection_from_info(database)
+        return DatabaseAccess().get_connector_from_info(database)
+
+    def create_connection_to_database(self, alias, **kwargs):
+        """
+        Helper function to create a connection to a database by alias, with
+        any extra driver-specific arguments
+        """
+        database = self.get_database(alias)
+        return DatabaseAccess().create_connection_from_info(database, **kwargs)
+
+    def connection(self, alias, **kwargs):
+        """
+        Context manager to check out a connection to a database by alias, with
+        any extra driver-specific arguments, from the job's pool:
+
+        with job.db_registry.connection(alias) as connection:
+            connection.cursor().execute(query)
+
+        Connections are reused across operations, and closed when the job
+        exits
+        """
+        key = (alias, tuple(sorted(kwargs.iteritems())))
+        return self.pool.connection(key)
+
+    def _create_pooled_connection(self, key):
+        alias, kwargs = key
+        return self.create_connection_to_database(alias, **dict(kwargs))
+
+    def _close_pooled_connection(self, key, connection):
+        connection.close()
+
+    def _is_pooled_connection_alive(self, key, connection):
+        alias, _ = key
+        connector = self.get_database_connector(alias)
+        return connector.is_connection_alive(connection)
+
+    def _reset_pooled_connection(self, key, connection):
+        connection.rollback()
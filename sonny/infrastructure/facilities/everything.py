@@ -16,5 +16,7 @@ from sonny.infrastructure.facilities import (  # noqa
     ftp_registry,
     email_registry,
     temporary_db,
+    fetch_cache,
+    job_state,
     dashboard,
 )
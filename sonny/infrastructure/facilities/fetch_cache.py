@@ -0,0 +1,167 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from sonny.infrastructure.context import helpers
+
+from sonny.infrastructure.facilities.base import Facility
+
+
+@helpers.register_facility("fetch_cache")
+class FetchCache(Facility):
+    """
+    A local cache of fetched remote files, so that re-runs don't download them
+    again.
+
+    Files are keyed by a JSON-serialisable tuple identifying a remote file's
+    contents (eg FTP server, path, size and modification time), and the least
+    recently used ones are evicted when the cache grows over `max_bytes`
+    """
+    class FacilitySettings(Facility.FacilitySettings):
+        enabled = False
+        """
+        Should fetchers use the cache
+        """
+        directory = os.path.join(tempfile.gettempdir(), 'sonny-fetch-cache')
+        """
+        Where to keep the cached files
+        """
+        max_bytes = 10 * 1024 ** 3
+        """
+        The maximum total size of the cached files
+        """
+
+    def enter_job(self, job, facility_settings):
+        super(FetchCache, self).enter_job(job, facility_settings)
+
+        self.evict_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.facility_settings.enabled
+
+    def get(self, key, suffix='', count=True):
+        """
+        Get a new local copy of a cached file, or `None` if it is not cached.
+        The copy can be deleted without affecting the cache.
+
+        The lookup is counted as a hit or a miss on the profiler, unless
+        `count` is false, eg for files listed by an index, whose lookup was
+        already counted
+        """
+        cached_filename = self._get_cached_filename(key)
+        if not os.path.isfile(cached_filename):
+            if count:
+                self.job.profiler.count('fetch_cache_misses')
+            return None
+
+        # Mark as recently used
+        os.utime(cached_filename, None)
+        _, local_filename = tempfile.mkstemp(suffix=suffix)
+        self._link_or_copy(cached_filename, local_filename)
+        if count:
+            self.job.profiler.count('fetch_cache_hits')
+
+        return local_filename
+
+    def put(self, key, local_filename):
+        """
+        Cache a fetched file. The local file is left as is
+        """
+        self._ensure_directory()
+        cached_filename = self._get_cached_filename(key)
+        _, temporary_filename = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        self._link_or_copy(local_filename, temporary_filename)
+        os.rename(temporary_filename, cached_filename)
+        self._evict()
+
+    def get_index(self, key):
+        """
+        Get a cached JSON-serialisable value, eg the list of files fetched
+        with a key, or `None`
+        """
+        cached_filename = self._get_cached_filename(key, suffix='.json')
+        if not os.path.isfile(cached_filename):
+            self.job.profiler.count('fetch_cache_misses')
+            return None
+
+        os.utime(cached_filename, None)
+        with open(cached_filename, 'rb') as _file:
+            value = json.load(_file)
+        self.job.profiler.count('fetch_cache_hits')
+
+        return value
+
+    def put_index(self, key, value):
+        """
+        Cache a JSON-serialisable value
+        """
+        self._ensure_directory()
+        cached_filename = self._get_cached_filename(key, suffix='.json')
+        _, temporary_filename = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        with open(temporary_filename, 'wb') as _file:
+            json.dump(value, _file)
+        os.rename(temporary_filename, cached_filename)
+
+    @property
+    def directory(self):
+        return self.facility_settings.directory
+
+    def _get_cached_filename(self, key, suffix=''):
+        # JSON, so that keys read back from an index hash the same
+        digest = hashlib.sha1(json.dumps(key)).hexdigest()
+        return os.path.join(self.directory, digest + suffix)
+
+    def _ensure_directory(self):
+        try:
+            os.makedirs(self.directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def _link_or_copy(self, source_filename, destination_filename):
+        """
+        Hard-link a file, to avoid copying it's contents, or copy it if that's
+        not possible (eg across file systems)
+        """
+        os.remove(destination_filename)
+        try:
+            os.link(source_filename, destination_filename)
+        except OSError:
+            shutil.copyfile(source_filename, destination_filename)
+
+    def _evict(self):
+        """
+        Delete the least recently used files, until the cache fits in
+        `max_bytes`. Temporary files are skipped, as other threads or
+        processes are still writing them
+        """
+        with self.evict_lock:
+            self._evict_least_recently_used()
+
+    def _evict_least_recently_used(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.facility_settings.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total_bytes -= size
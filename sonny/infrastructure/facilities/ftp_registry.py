@@ -1,14 +1,104 @@
+from ftplib import FTP
+
 from sonny.infrastructure.facilities.generic_config_registry import GenericConfigRegistry
+from sonny.infrastructure.facilities.connection_pool import ConnectionPool
 
 from sonny.infrastructure.context import helpers
 
 
 @helpers.register_facility("ftp_registry")
 class FtpRegistry(GenericConfigRegistry):
+    class FacilitySettings(GenericConfigRegistry.FacilitySettings):
+        sessions_max_size = None
+        """
+        Maximum open sessions per FTP server alias, or `None` for no limit
+        """
+        sessions_timeout = 60
+        """
+        Seconds to wait for a session to be returned, when all of them are in
+        use
+        """
+        keepalive_after_idle = 10
+        """
+        Send a NOOP to a session before reusing it, if it has been idle for
+        longer than that many seconds, and reconnect if it was dropped
+        """
+
     registry_config_name = "ftp_registry"
 
+    def enter_job(self, job, facility_settings):
+        super(FtpRegistry, self).enter_job(job, facility_settings)
+
+        self.sessions = ConnectionPool(
+            self._create_session,
+            self._close_session,
+            is_connection_alive=self._is_session_alive,
+            reset_connection=self._reset_session,
+            max_size=self.facility_settings.sessions_max_size,
+            timeout=self.facility_settings.sessions_timeout,
+            check_after_idle=self.facility_settings.keepalive_after_idle,
+        )
+
+    def exit_job(self, job, exc_type, exc_value, traceback):
+        self.sessions.close_all()
+
     def get_ftp_server(self, alias):
         """
         Get all the FTP server info for an FTP server alias
         """
         return self[alias]
+
+    def checkout_session(self, alias):
+        """
+        Get a logged in FTP session to a server by alias, reusing one from
+        earlier steps of the job, if possible
+        """
+        return self.sessions.checkout(alias)
+
+    def checkin_session(self, alias, ftp):
+        """
+        Return an FTP session, to be reused by later steps of the job
+        """
+        self.sessions.checkin(alias, ftp)
+
+    def discard_session(self, alias, ftp):
+        """
+        Close an FTP session that shouldn't be reused, eg after an error
+        """
+        self.sessions.discard(alias, ftp)
+
+    def reconnect_session(self, alias, ftp):
+        """
+        Log an FTP session in again, in place, eg after it's connection was
+        dropped mid-transfer
+        """
+        source = self.get_ftp_server(alias)
+        ftp.close()
+        ftp.connect(source["server"])
+        ftp.login(source['username'], source['password'])
+
+    def _create_session(self, alias):
+        source = self.get_ftp_server(alias)
+        ftp = FTP(source["server"])
+        try:
+            ftp.login(source['username'], source['password'])
+            ftp.home_directory = ftp.pwd()
+        except Exception:
+            ftp.close()
+            raise
+
+        return ftp
+
+    def _close_session(self, alias, ftp):
+        try:
+            ftp.quit()
+        finally:
+            ftp.close()
+
+    def _is_session_alive(self, alias, ftp):
+        ftp.voidcmd('NOOP')
+
+        return True
+
+    def _reset_session(self, alias, ftp):
+        ftp.cwd(ftp.home_directory)
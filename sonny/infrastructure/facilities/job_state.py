@@ -0,0 +1,91 @@
+import os
+import json
+import errno
+import hashlib
+import tempfile
+
+from sonny.infrastructure.context import helpers
+
+from sonny.infrastructure.facilities.base import Facility
+
+
+class JobStateNotConfigured(Exception):
+    pass
+
+
+@helpers.register_facility("job_state")
+class JobState(Facility):
+    """
+    Small JSON-serialisable values that a job keeps between runs, eg what it
+    has already seen on a remote server.
+
+    Values are keyed per job UUID, by a JSON-serialisable tuple. Test jobs
+    only keep them in memory, so that they don't affect real runs
+    """
+    class FacilitySettings(Facility.FacilitySettings):
+        directory = None
+        """
+        Where to keep the values, in a directory per job, or `None` for the
+        config's `job_state_directory`. Required for jobs that keep values,
+        apart from test ones. It should be durable, and shared by all the hosts
+        that run the job, eg not under `/tmp`, as jobs redo their work when
+        values are lost, eg incremental email fetching searches all the mail
+        """
+
+    def enter_job(self, job, facility_settings):
+        super(JobState, self).enter_job(job, facility_settings)
+
+        self.test_values = {}
+
+    def get(self, key, default=None):
+        """
+        Get a value kept by an earlier run, or `default`
+        """
+        if self.job.test:
+            return self.test_values.get(self._get_digest(key), default)
+
+        filename = self._get_filename(key)
+        if not os.path.isfile(filename):
+            return default
+
+        with open(filename, 'rb') as _file:
+            return json.load(_file)
+
+    def set(self, key, value):
+        """
+        Keep a value for later runs
+        """
+        if self.job.test:
+            self.test_values[self._get_digest(key)] = value
+            return
+
+        directory = self._get_job_directory()
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        _, temporary_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with open(temporary_filename, 'wb') as _file:
+            json.dump(value, _file)
+        os.rename(temporary_filename, self._get_filename(key))
+
+    def _get_job_directory(self):
+        directory = self.facility_settings.directory
+        if directory is None:
+            directory = getattr(self.job.config, 'job_state_directory', None)
+        if directory is None:
+            raise JobStateNotConfigured(
+                "Set `job_state_directory` in the config, or "
+                "JobStateFacilitySettings.directory, to a durable directory "
+                "for keeping values between runs")
+
+        return os.path.join(directory, str(self.job.uuid or 'default'))
+
+    def _get_digest(self, key):
+        return hashlib.sha1(json.dumps(key)).hexdigest()
+
+    def _get_filename(self, key):
+        return os.path.join(self._get_job_directory(),
+                            self._get_digest(key) + '.json')
@@ -1,5 +1,6 @@
 import time
 import resource
+import threading
 from abc import ABCMeta, abstractmethod
 
 from sonny.utils import pretty_bytes
@@ -12,7 +13,14 @@ from sonny.infrastructure.facilities.base import Facility
 class BaseProfiler(Facility):
     __metaclass__ = ABCMeta
 
+    def enter_job(self, job, facility_settings):
+        super(BaseProfiler, self).enter_job(job, facility_settings)
+
+        self.pending_reports = []
+        self.pending_reports_lock = threading.Lock()
+
     def exit_job(self, job, exc_type, exc_value, traceback):
+        self._call_pending_reports()
         if job.test:
             print '********* PROFILING: *********'
             print self
@@ -22,12 +30,32 @@ class BaseProfiler(Facility):
         job_step.__enter__()
 
     def exit_step(self, step, exc_type, exc_value, traceback):
+        self._call_pending_reports()
         self.profiling_section.__exit__(exc_type, exc_value, traceback)
 
+    def report_later(self, report):
+        """
+        Call `report` when the current step, or the job, exits, for operations
+        that count in batches, so that they can add the counts of their last,
+        partial, batch
+        """
+        with self.pending_reports_lock:
+            self.pending_reports.append(report)
+
+    def _call_pending_reports(self):
+        with self.pending_reports_lock:
+            pending_reports, self.pending_reports = self.pending_reports, []
+        for report in pending_reports:
+            report()
+
     @abstractmethod
     def job_step(self, name):
         pass
 
+    @abstractmethod
+    def count(self, name, value=1):
+        pass
+
 
 class ProfilingSection(object):
     def __init__(self, profiler, job_step, name, parent, duration=None):
@@ -39,6 +67,7 @@ class ProfilingSection(object):
         self.name = name
         self.duration = duration
         self.memory_created = None
+        self.counters = {}
 
         self.profiling_sections = []
 
@@ -68,19 +97,30 @@ class ProfilingSection(object):
 
     def __str__(self, indent=""):
         return ''.join(
-            "\n%s[%s] %s: %.3fs, %s%s" %
+            "\n%s[%s] %s: %.3fs, %s%s%s" %
             (indent, profiling_section.job_step.name,
              profiling_section.name, profiling_section.duration or -1,
              pretty_bytes(profiling_section.memory_created),
+             profiling_section._counters_str(),
              profiling_section.__str__(indent="  " + indent))
             for profiling_section in self.profiling_sections
         )
 
+    def _counters_str(self):
+        if not self.counters:
+            return ''
+
+        return ' (%s)' % ', '.join(
+            '%s: %s' % (name, value)
+            for name, value in sorted(self.counters.iteritems())
+        )
+
     def as_dict(self):
         _dict = {
             "name": self.job_step.name if self.job_step else '<root>',
             "duration": self.duration,
             "memory": self.memory_created,
+            "counters": dict(self.counters),
             "sections": [
                 profiling_section.as_dict()
                 for profiling_section in self.profiling_sections
@@ -101,6 +141,7 @@ class SimpleProfiler(BaseProfiler):
 
         self.profiling_section = \
             ProfilingSection(self, None, "<root>", None)
+        self.counters_lock = threading.Lock()
 
     def job_step(self, name):
         profiling_section = ProfilingSection(
@@ -108,6 +149,14 @@ class SimpleProfiler(BaseProfiler):
 
         return profiling_section
 
+    def count(self, name, value=1):
+        """
+        Add to a named counter of the current step, eg for cache hits
+        """
+        with self.counters_lock:
+            counters = self.profiling_section.counters
+            counters[name] = counters.get(name, 0) + value
+
     def _push(self, profiling_section):
         assert profiling_section.parent == self.profiling_section
         self.profiling_section = profiling_section
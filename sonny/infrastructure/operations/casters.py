@@ -3,6 +3,8 @@
 import time
 import math
 
+from sonny.infrastructure.context import helpers
+
 
 def to_date(*date_formats):
     date_formats_str = ', '.join(
@@ -79,3 +81,146 @@ def fix_account_number(value):
 
     fixed = '%.0fE%s' % (first_part, second_part)
     return fixed
+
+
+def memoize(caster, maxsize=10000, name=None):
+    """
+    Remember the caster's results for the `maxsize` most recently used
+    values, or for all values if it's `None`, for values that repeat a lot, eg
+    dates and amounts. Hits and misses are counted on the profiler, as
+    `memoize_<name>_hits` and `memoize_<name>_misses`
+    """
+    return MemoizedCaster(caster, maxsize=maxsize, name=name)
+
+
+PREVIOUS, NEXT, KEY, RESULT = range(4)
+
+
+class MemoizedCaster(object):
+    """
+    A caster with a least recently used cache of it's results, kept in a dict
+    of links of a circular, doubly linked list, from the least to the most
+    recently used. It's not thread-safe, so each thread should use it's own
+    """
+    report_every = 10000
+    """
+    How many calls to count, before adding them to the profiler's counters.
+    The rest are added when the step, or the job, exits
+    """
+
+    def __init__(self, caster, maxsize=10000, name=None):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize should be at least 1, or None")
+
+        self.caster = caster
+        self.maxsize = maxsize
+        self.name = name or getattr(caster, '__name__', 'caster')
+        self.hits = 0
+        self.misses = 0
+        self.reported_hits = 0
+        self.reported_misses = 0
+        self.is_report_pending = False
+        self.cache = {}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    @property
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        if not calls:
+            return None
+
+        return float(self.hits) / calls
+
+    def __call__(self, value):
+        try:
+            # Equal values of different types, eg 1 and 1.0, may be cast
+            # differently
+            key = (value.__class__, value)
+            link = self.cache.get(key)
+        except TypeError:
+            # Unhashable values can't be remembered
+            return self.caster(value)
+
+        if link is not None:
+            self.hits += 1
+            if self.maxsize is not None:
+                self._move_to_end(link)
+            result = link[RESULT]
+        else:
+            result = self.caster(value)
+            self.misses += 1
+            self._add(key, result)
+
+        if not self.is_report_pending:
+            self._report_later()
+        if (self.hits + self.misses) % self.report_every == 0:
+            self.report()
+
+        return result
+
+    def _move_to_end(self, link):
+        root = self.root
+        previous_link, next_link = link[PREVIOUS], link[NEXT]
+        previous_link[NEXT] = next_link
+        next_link[PREVIOUS] = previous_link
+        last = root[PREVIOUS]
+        last[NEXT] = root[PREVIOUS] = link
+        link[PREVIOUS] = last
+        link[NEXT] = root
+
+    def _add(self, key, result):
+        root = self.root
+        if self.maxsize is None:
+            self.cache[key] = [None, None, key, result]
+            return
+
+        if len(self.cache) >= self.maxsize:
+            oldest = root[NEXT]
+            root[NEXT] = oldest[NEXT]
+            oldest[NEXT][PREVIOUS] = root
+            del self.cache[oldest[KEY]]
+
+        last = root[PREVIOUS]
+        link = [last, root, key, result]
+        last[NEXT] = root[PREVIOUS] = self.cache[key] = link
+
+    def report(self):
+        """
+        Add the hits and misses since the last report to the profiler's
+        counters, if in a job
+        """
+        try:
+            job = helpers.get_current_job()
+        except IndexError:
+            # Try to have a later job's profiler report them
+            self.is_report_pending = False
+            return
+
+        if self.hits == self.reported_hits \
+                and self.misses == self.reported_misses:
+            return
+
+        job.profiler.count('memoize_%s_hits' % self.name,
+                           self.hits - self.reported_hits)
+        job.profiler.count('memoize_%s_misses' % self.name,
+                           self.misses - self.reported_misses)
+        self.reported_hits = self.hits
+        self.reported_misses = self.misses
+
+    def _report_later(self):
+        """
+        Have the profiler report the calls when the current step or job exits,
+        so that less than `report_every` calls are still counted
+        """
+        self.is_report_pending = True
+        try:
+            job = helpers.get_current_job()
+        except IndexError:
+            return
+
+        job.profiler.report_later(self._report_pending)
+
+    def _report_pending(self):
+        self.is_report_pending = False
+        self.report()
@@ -0,0 +1,269 @@
+"""
+An optional columnar mode, where data flows as `RecordBatch`es, with a NumPy
+array per column, instead of a dict per row, and the transformers and casters
+work on whole columns.
+
+It needs numpy, which is only imported when the columnar mode is used
+"""
+from sonny.infrastructure.context import helpers
+
+from sonny.infrastructure.operations import casters
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError(
+            "The columnar mode needs numpy, install it with `pip install "
+            "numpy`")
+
+    return numpy
+
+
+class RecordBatch(object):
+    """
+    A batch of rows, as a NumPy array per column, in the columns' order.
+
+    The columns' order is only meaningful to savers with positional queries
+    when it was set explicitly, with `dicts_to_tuples`, as `is_ordered`
+    """
+
+    def __init__(self, columns, arrays, is_ordered=False):
+        self.columns = list(columns)
+        self.arrays = dict(zip(self.columns, arrays))
+        self.is_ordered = is_ordered
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        """
+        Make a batch from rows of values, in the columns' order. Rows with less
+        values are padded with `None`, and extra values are dropped
+        """
+        numpy = import_numpy()
+        columns_count = len(columns)
+        table = numpy.empty((len(rows), columns_count), dtype=object)
+        for index, row in enumerate(rows):
+            if len(row) == columns_count:
+                table[index] = row
+            else:
+                row = list(row[:columns_count])
+                table[index] = row + [None] * (columns_count - len(row))
+
+        return cls(columns, [table[:, index] for index in xrange(columns_count)])
+
+    @classmethod
+    def from_dicts(cls, columns, dicts):
+        return cls.from_rows(columns, [
+            [_dict.get(column) for column in columns]
+            for _dict in dicts
+        ])
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+
+        return len(self.arrays[self.columns[0]])
+
+    def __getitem__(self, column):
+        return self.arrays[column]
+
+    def __contains__(self, column):
+        return column in self.arrays
+
+    def select(self, columns):
+        return RecordBatch(columns, [self.arrays[column] for column in columns])
+
+    def with_columns(self, columns_arrays):
+        """
+        A new batch, with some columns added or replaced
+        """
+        arrays = dict(self.arrays)
+        arrays.update(columns_arrays)
+        columns = self.columns + [
+            column
+            for column in columns_arrays
+            if column not in self.arrays
+        ]
+
+        return RecordBatch(columns, [arrays[column] for column in columns])
+
+    def tuples(self, columns):
+        """
+        The batch's rows, as tuples of the columns' values
+        """
+        return zip(*[self.arrays[column].tolist() for column in columns])
+
+    def iterrows(self):
+        """
+        The batch's rows, as dicts, for row-based operations
+        """
+        for values in self.tuples(self.columns):
+            yield dict(zip(self.columns, values))
+
+    def __repr__(self):
+        return '%s(%s rows, columns=%r)' % (
+            self.__class__.__name__, len(self), self.columns)
+
+
+def keep_keys(keys):
+    """
+    Like `transformers.keep_keys`, for record batches
+    """
+
+    @helpers.step
+    def do_keep_keys(batches):
+        return (
+            record_batch.select([
+                column for column in record_batch.columns if column in keys
+            ])
+            for record_batch in batches
+        )
+
+    return do_keep_keys
+
+
+def dicts_to_tuples(keys):
+    """
+    Like `transformers.dicts_to_tuples`, for record batches: keep the keys'
+    columns in the keys' order, for savers with positional queries
+    """
+
+    @helpers.step
+    def do_dicts_to_tuples(batches):
+        for record_batch in batches:
+            yield RecordBatch(
+                keys, [record_batch[key] for key in keys], is_ordered=True)
+
+    return do_dicts_to_tuples
+
+
+def cast_columns(keys_casts):
+    """
+    Like `transformers.cast_dicts_values`, for record batches. Casters with a
+    vectorised version cast whole columns, and any other caster is called once
+    per unique value of a column
+    """
+
+    @helpers.step
+    def do_cast_columns(batches):
+        for record_batch in batches:
+            yield record_batch.with_columns({
+                column: cast_array(caster, record_batch[column])
+                for column, caster in keys_casts.iteritems()
+                if column in record_batch
+            })
+
+    return do_cast_columns
+
+
+def update_with_static_values(static_values):
+    """
+    Like `transformers.update_with_static_values`, for record batches
+    """
+
+    @helpers.step
+    def do_update_with_static_values(batches):
+        numpy = import_numpy()
+        for record_batch in batches:
+            columns_arrays = {}
+            for column, value in static_values.iteritems():
+                array = numpy.empty(len(record_batch), dtype=object)
+                array.fill(value)
+                columns_arrays[column] = array
+            yield record_batch.with_columns(columns_arrays)
+
+    return do_update_with_static_values
+
+
+def record_batches_to_dicts():
+    """
+    Flatten record batches to a dict per row, to continue with row-based
+    transformers
+    """
+
+    @helpers.step
+    def do_record_batches_to_dicts(batches):
+        for record_batch in batches:
+            for row in record_batch.iterrows():
+                yield row
+
+    return do_record_batches_to_dicts
+
+
+def cast_array(caster, array):
+    """
+    Cast an array of values, with the caster's vectorised version if it has
+    one, or else by calling it once per unique value
+    """
+    vectorised_caster = vectorised_casters.get(caster)
+    if vectorised_caster:
+        return vectorised_caster(array)
+
+    numpy = import_numpy()
+    try:
+        uniques, inverse = numpy.unique(array, return_inverse=True)
+    except TypeError:
+        # Values that can't be sorted together, eg strings and `None`
+        uniques, inverse = array, None
+
+    cast = numpy.empty(len(uniques), dtype=object)
+    cast[:] = [caster(value) for value in uniques]
+    if inverse is None:
+        return cast
+
+    return cast[inverse]
+
+
+def from_gbp(array):
+    """
+    A vectorised `casters.from_gbp`
+    """
+    numpy = import_numpy()
+    if array.dtype.kind in 'biuf':
+        return array.astype(float)
+    if array.dtype.kind in 'SU':
+        return _strip_gbp(array.astype(unicode)).astype(float)
+
+    # Only strip strings, as numbers would lose precision as strings
+    is_string = numpy.array(
+        [isinstance(value, basestring) for value in array], dtype=bool)
+    cast = numpy.empty(len(array), dtype=float)
+    cast[is_string] = \
+        _strip_gbp(array[is_string].astype(unicode)).astype(float)
+    cast[~is_string] = [float(value) for value in array[~is_string]]
+
+    return cast
+
+
+def _strip_gbp(strings):
+    numpy = import_numpy()
+    strings = numpy.char.replace(strings, u'\xa3', u'')
+    strings = numpy.char.replace(strings, u',', u'')
+
+    return strings
+
+
+def fix_account_number(array):
+    """
+    A vectorised `casters.fix_account_number`, that only calls it for values
+    in E-Notation
+    """
+    numpy = import_numpy()
+    is_e_notation = numpy.char.find(
+        numpy.char.lower(array.astype(unicode)), u'e+') >= 0
+    fixed = array.copy()
+    fixed[is_e_notation] = [
+        casters.fix_account_number(value) for value in array[is_e_notation]
+    ]
+
+    return fixed
+
+
+vectorised_casters = {
+    casters.from_gbp: from_gbp,
+    casters.fix_account_number: fix_account_number,
+}
+"""
+Vectorised versions of casters, that cast a whole array at once
+"""
@@ -0,0 +1,122 @@
+import io
+import os
+import bz2
+import gzip
+import shutil
+import zipfile
+import tempfile
+from contextlib import contextmanager
+
+
+GZIP = 'gzip'
+BZ2 = 'bz2'
+ZIP = 'zip'
+MAGIC_NUMBERS = [
+    ('\x1f\x8b', GZIP),
+    ('BZh', BZ2),
+    ('PK\x03\x04', ZIP),
+]
+OOXML_CONTENT_TYPES = '[Content_Types].xml'
+"""
+A member that all Office Open XML files (eg `.xlsx`) have, as they are ZIP
+files themselves, and shouldn't be decompressed
+"""
+
+
+class UnsupportedArchive(Exception):
+    pass
+
+
+def get_compression(filename):
+    """
+    Detect a file's compression by it's contents, as fetched files don't keep
+    their extension, or return `None` if it's not compressed
+    """
+    with open(filename, 'rb') as _file:
+        start = _file.read(4)
+
+    for magic_number, compression in MAGIC_NUMBERS:
+        if start.startswith(magic_number):
+            break
+    else:
+        return None
+
+    if compression == ZIP:
+        with zipfile.ZipFile(filename) as archive:
+            if OOXML_CONTENT_TYPES in archive.namelist():
+                return None
+
+    return compression
+
+
+@contextmanager
+def open_decompressed(filename):
+    """
+    Open a file for reading, decompressing it as a stream if it's compressed,
+    without writing the decompressed file to disk.
+
+    ZIP archives should have a single file
+    """
+    compression = get_compression(filename)
+    if compression == GZIP:
+        # GzipFile's own readline is slow, so buffer it
+        _file = io.BufferedReader(gzip.GzipFile(filename, 'rb'))
+    elif compression == BZ2:
+        _file = bz2.BZ2File(filename, 'rb')
+    elif compression == ZIP:
+        archive = zipfile.ZipFile(filename)
+        try:
+            _file = archive.open(_get_single_member(archive))
+        except Exception:
+            archive.close()
+            raise
+    else:
+        _file = open(filename, 'rb')
+
+    try:
+        yield _file
+    finally:
+        _file.close()
+        if compression == ZIP:
+            archive.close()
+
+
+@contextmanager
+def decompressed_filename(filename):
+    """
+    Decompress a file to a temporary file, for readers that need a seekable
+    file, and delete it afterwards. If it's not compressed, use it as is
+    """
+    compression = get_compression(filename)
+    if compression is None:
+        yield filename
+        return
+
+    suffix = ''
+    if compression == ZIP:
+        with zipfile.ZipFile(filename) as archive:
+            suffix = os.path.basename(_get_single_member(archive))
+            suffix = '-%s' % suffix
+
+    _, local_filename = tempfile.mkstemp(suffix=suffix)
+    try:
+        with open_decompressed(filename) as _file, \
+                open(local_filename, 'wb') as local_file:
+            shutil.copyfileobj(_file, local_file)
+        yield local_filename
+    finally:
+        os.remove(local_filename)
+
+
+def _get_single_member(archive):
+    members = [
+        member
+        for member in archive.namelist()
+        if not member.endswith('/')
+    ]
+    if len(members) != 1:
+        raise UnsupportedArchive(
+            "Expected a single file in the ZIP archive, but found %s"
+            % len(members))
+
+    return members[0]
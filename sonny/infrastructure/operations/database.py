@@ -1,5 +1,9 @@
 from abc import ABCMeta, abstractmethod, abstractproperty
 
+from sonny.infrastructure.operations.sql import parse_insert_query
+from sonny.infrastructure.operations.utils import batch
+from sonny.infrastructure.operations.rows import as_mapping
+
 
 class DatabaseAccess(object):
     """
@@ -29,18 +33,27 @@ class DatabaseAccess(object):
 
         return connection
 
-    def create_connection_from_info(self, database):
+    def create_connection_from_info(self, database, **kwargs):
         """
-        Create a connection by passing a database info from DBRegistry
+        Create a connection by passing a database info from DBRegistry, and
+        any extra driver-specific arguments
 
         Mirrors the DatabaseConnector method
         """
+        connector = self.get_connector_from_info(database)
+        connection = connector.create_connection_from_info(database, **kwargs)
+
+        return connection
+
+    def get_connector_from_info(self, database):
+        """
+        Get the connector for a database info from DBRegistry
+        """
         connector_name = database['connector_name']
         connector_class = self.connectors_classes[connector_name]
         connector = connector_class()
-        connection = connector.create_connection_from_info(database)
 
-        return connection
+        return connector
 
 
 class DatabaseConnector(object):
@@ -49,6 +62,13 @@ class DatabaseConnector(object):
     """
     __metaclass__ = ABCMeta
 
+    multirow_insert_page_size = None
+    """
+    How many rows to send with each multi-row `INSERT ... VALUES` statement,
+    when running single-row INSERT queries for many rows. `None` if the driver
+    already does something similar
+    """
+
     @abstractproperty
     def connector_name(self):
         """
@@ -64,15 +84,48 @@ class DatabaseConnector(object):
         pass
 
     @abstractmethod
-    def create_connection_from_info(self, database):
+    def create_connection_from_info(self, database, **kwargs):
         """
-        Create a connection by passing a database info from DBRegistry
+        Create a connection by passing a database info from DBRegistry, and
+        any extra driver-specific arguments
         """
         pass
 
+    def is_connection_alive(self, connection):
+        """
+        Check that a connection can still be used
+        """
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+        connection.rollback()
+
+        return True
+
+    def executemany(self, cursor, query, rows):
+        """
+        Run a query for each of the rows. If the connector has a
+        `multirow_insert_page_size`, a single-row INSERT query is rewritten to
+        multi-row pages, to avoid a round trip per row, else, or if the query
+        can't be rewritten, or updates existing rows, `cursor.executemany` is
+        used
+        """
+        insert_query = \
+            self.multirow_insert_page_size and parse_insert_query(query)
+        if not insert_query or insert_query.is_upsert:
+            cursor.executemany(query, map(as_mapping, rows))
+            return
+
+        for page in batch(rows, batch_size=self.multirow_insert_page_size):
+            multirow_query, values = insert_query.multirow(page)
+            cursor.execute(multirow_query, values)
+
 
 @DatabaseAccess.register_connector
-class MySqlDatabaseConnector(DatabaseAccess):
+class MySqlDatabaseConnector(DatabaseConnector):
     """
     MySql connector class
     """
@@ -85,55 +138,66 @@ class MySqlDatabaseConnector(DatabaseAccess):
 
         return connection
 
-    def create_connection_from_info(self, database):
+    def is_connection_alive(self, connection):
+        connection.ping()
+
+        return True
+
+    def create_connection_from_info(self, database, **kwargs):
         return self.create_connection(
             host=database['host'],
             port=database['port'],
             user=database['username'],
             passwd=database['password'],
             db=database['database'],
+            **kwargs
         )
 
 
 @DatabaseAccess.register_connector
-class PostgresDatabaseConnector(DatabaseAccess):
+class PostgresDatabaseConnector(DatabaseConnector):
     """
     Postgres connector class
     """
     connector_name = 'Postgres'
+    multirow_insert_page_size = 1000
 
     def create_connection(self, *args, **kwargs):
         import psycopg2
         connection = psycopg2.connect(*args, **kwargs)
         return connection
 
-    def create_connection_from_info(self, database):
+    def create_connection_from_info(self, database, **kwargs):
         return self.create_connection(
             host=database['host'],
             port=database['port'],
             user=database['username'],
             password=database['password'],
             database=database['database'],
+            **kwargs
         )
 
 
 @DatabaseAccess.register_connector
-class MsSqlDatabaseConnector(DatabaseAccess):
+class MsSqlDatabaseConnector(DatabaseConnector):
     """
     MsSql connector class
     """
     connector_name = 'MsSql'
+    # SQL Server allows at most 1000 rows in a VALUES clause
+    multirow_insert_page_size = 1000
 
     def create_connection(self, *args, **kwargs):
         import pymssql
         connection = pymssql.connect(*args, **kwargs)
         return connection
 
-    def create_connection_from_info(self, database):
+    def create_connection_from_info(self, database, **kwargs):
         return self.create_connection(
             server=database['host'],
             port=database['port'],
             user=database['username'],
             password=database['password'],
             database=database['database'],
+            **kwargs
         )
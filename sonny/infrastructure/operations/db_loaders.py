@@ -34,15 +34,17 @@ class DbLoader(BaseDbLoader):
         with open(source['file'], 'rb') as _file:
             self.query = _file.read()
 
-        alias = self.source["database"]
-        self.connection = self.db_registry.create_connection_to_database(alias)
-        self.cursor = self.connection.cursor()
+    def _connection(self):
+        """
+        Check out a connection to the source from the job's pool
+        """
+        return self.db_registry.connection(self.source["database"])
 
-    def _get_column_names(self):
+    def _get_column_names(self, cursor):
         return tuple(
             name
             for name, _, _, _, _, _, _
-            in self.cursor.description
+            in cursor.description
         )
 
     def _as_dict(self, column_names, row):
@@ -50,18 +52,23 @@ class DbLoader(BaseDbLoader):
 
     @helpers.step
     def get_single(self, parameters):
-        self.cursor.execute(self.query, parameters)
-        column_names = self._get_column_names()
-        row = self.cursor.fetchone()
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.query, parameters)
+            column_names = self._get_column_names(cursor)
+            row = cursor.fetchone()
         if row is None:
             raise NoDBRowMatched()
         return self._as_dict(column_names, row)
 
     @helpers.step
     def get_multiple(self, parameters):
-        self.cursor.execute(self.query, parameters)
-        column_names = self._get_column_names()
-        for row in self.cursor.fetchall():
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(self.query, parameters)
+            column_names = self._get_column_names(cursor)
+            rows = cursor.fetchall()
+        for row in rows:
             yield self._as_dict(column_names, row)
 
 
@@ -1,17 +1,25 @@
 import re
 import os
+import sys
+import time
+import Queue
+import socket
 import fnmatch
-from ftplib import FTP, error_perm
+import posixpath
+from ftplib import error_perm, error_reply, error_temp
 import imaplib
 import tempfile
-from email import message_from_string
 from email.parser import HeaderParser
 from email.header import decode_header
 from abc import abstractmethod
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 
 from sonny.infrastructure.context import helpers
 
+from sonny.infrastructure.operations import imap
 from sonny.infrastructure.operations.base import BaseOperation
+from sonny.infrastructure.operations.utils import batch
 
 
 class BaseFileFetcher(BaseOperation):
@@ -37,6 +45,14 @@ class BaseFileFetcher(BaseOperation):
     def fetch_files_that_exist(self, filenames):
         return map(self.fetch_file_that_exists, filenames)
 
+    def open_files_that_exist(self, filenames):
+        """
+        Like `fetch_files_that_exist`, but fetchers that can read remote files
+        as a stream return file-like objects instead of local filenames. By
+        default, files are fetched locally
+        """
+        return self.fetch_files_that_exist(filenames)
+
     @abstractmethod
     def search_files(self, *args, **kwargs):
         pass
@@ -53,9 +69,21 @@ class BaseFileFetcher(BaseOperation):
         return self.__class__.__name__
 
 
+class IncompleteFtpTransfer(Exception):
+    pass
+
+
+RemoteFile = namedtuple('RemoteFile', ['name', 'size', 'modified'])
+"""
+A remote file's name, and it's size and modification time, if the server
+provides them
+"""
+
+
 class FtpContextManager(object):
     """
-    Manage the opening and closing of an FTP connection
+    Manage the checking out and returning of an FTP session from the job's
+    FTP registry, so that sessions are reused across steps
     """
 
     def __init__(self, source):
@@ -64,17 +92,81 @@ class FtpContextManager(object):
 
     def __enter__(self):
         job = helpers.get_current_job()
-        source = job.ftp_registry.get_ftp_server(self.source)
-        self.ftp = FTP(source["server"])
-        self.ftp.login(source['username'], source['password'])
+        self.ftp_registry = job.ftp_registry
+        self.ftp = self.ftp_registry.checkout_session(self.source)
 
         return self.ftp
 
     def __exit__(self, _type, value, traceback):
-        self.ftp.close()
+        if _type is None:
+            self.ftp_registry.checkin_session(self.source, self.ftp)
+        else:
+            self.ftp_registry.discard_session(self.source, self.ftp)
         self.ftp = None
 
 
+class FtpFileStream(object):
+    """
+    A file-like iterator over a remote file, read straight from the FTP data
+    connection, on an FTP session of it's own.
+
+    The transfer starts when it's first read, and `close` returns the session
+    """
+
+    def __init__(self, source, filename):
+        self.source = source
+        self.filename = filename
+        self.ftp_context_manager = None
+        self.connection = None
+        self._file = None
+
+    def __iter__(self):
+        self.open()
+        return iter(self._file)
+
+    def read(self, size=-1):
+        self.open()
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        self.open()
+        return self._file.readline(size)
+
+    def open(self):
+        if self._file is not None:
+            return
+
+        self.ftp_context_manager = FtpContextManager(self.source)
+        ftp = self.ftp_context_manager.__enter__()
+        try:
+            ftp.voidcmd('TYPE I')
+            self.connection = ftp.transfercmd('RETR %s' % self.filename)
+        except Exception:
+            self.ftp_context_manager.__exit__(*sys.exc_info())
+            raise
+        self._file = self.connection.makefile('rb')
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        self.connection.close()
+        self._file = self.connection = None
+        try:
+            # Closing before the end of the file aborts the transfer, after
+            # which the session is in an unknown state
+            self.ftp_context_manager.ftp.voidresp()
+        except Exception:
+            self.ftp_context_manager.__exit__(*sys.exc_info())
+        else:
+            self.ftp_context_manager.__exit__(None, None, None)
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (
+            self.__class__.__name__, self.source, self.filename)
+
+
 class TemporaryFileContextManager(object):
     """
     Manage the creating, opening and closing of a temporary filename
@@ -95,28 +187,72 @@ class TemporaryFileContextManager(object):
 
 @BaseFileFetcher.auto_mock_for_local_testing
 class FtpFetcher(BaseFileFetcher):
+    class OperationSettings(BaseFileFetcher.OperationSettings):
+        __job_settings_name__ = 'FtpFetcherOperationSettings'
+        concurrent_connections = 1
+        """
+        How many FTP connections to download multiple files over, concurrently
+        """
+        retries = 3
+        """
+        How many times to reconnect and resume a download from where it
+        stopped, after a connection error
+        """
+        retry_delay = 5
+        """
+        Seconds to wait before reconnecting
+        """
+
+    CONNECTION_ERRORS = (socket.error, EOFError, error_reply, error_temp)
+    """
+    Errors after which a transfer can be resumed on a new connection
+    """
+
     def __init__(self, source):
+        super(FtpFetcher, self).__init__()
+
         self.source = source
 
     @helpers.step
     def fetch_files(self, filenames):
-        with FtpContextManager(self.source) as ftp:
-            return self._fetch_files_with_ftp(ftp, filenames)
+        return self._map_with_ftp_connections(
+            self._fetch_file_with_ftp, filenames)
 
     @helpers.step
     def fetch_files_that_exist(self, filenames):
-        with FtpContextManager(self.source) as ftp:
-            return self._fetch_files_that_exist_with_ftp(ftp, filenames)
+        return self._map_with_ftp_connections(
+            self._fetch_file_that_exists_with_ftp, filenames)
 
     @helpers.step
     def fetch_file(self, filename):
         with FtpContextManager(self.source) as ftp:
-            return self._fetch_file(ftp, filename)
+            return self._fetch_file_with_ftp(ftp, filename)
 
     @helpers.step
     def fetch_file_that_exists(self, filename):
         with FtpContextManager(self.source) as ftp:
-            return self._fetch_file_that_exists_with_ftp(ftp, filename), None
+            return self._fetch_file_that_exists_with_ftp(ftp, filename)
+
+    @helpers.step
+    def open_files_that_exist(self, filenames):
+        """
+        Return a stream for each remote file that exists, that reads it
+        straight from the FTP data connection, so that no local file is needed
+        """
+        results = []
+        with FtpContextManager(self.source) as ftp:
+            ftp.voidcmd('TYPE I')
+            for filename in filenames:
+                try:
+                    ftp.size(filename)
+                except error_perm, e:
+                    # Servers that don't support SIZE reply with 500 or 502
+                    if str(e).startswith('550'):
+                        results.append((None, e))
+                        continue
+                results.append((FtpFileStream(self.source, filename), None))
+
+        return results
 
     @helpers.step
     def search_files(self, directory, pattern="*"):
@@ -140,12 +276,124 @@ class FtpFetcher(BaseFileFetcher):
 
             return filenames
 
+    @helpers.step
+    def list_files(self, directory):
+        """
+        List the files in a directory, with their size and modification time
+        """
+        with FtpContextManager(self.source) as ftp:
+            return self._list_files_with_ftp(ftp, directory)
+
+    @helpers.step
+    def search_new_regex_files(self, directory, regex):
+        """
+        List the files in a directory matching a regex, that are new or changed
+        since they were last passed to `save_listing_snapshot`. Files listed
+        without a size or modification time, eg with NLST, can't be told to
+        have changed, so they are always returned
+        """
+        snapshot = self._get_listing_snapshot(directory)
+        with FtpContextManager(self.source) as ftp:
+            remote_files = self._list_files_with_ftp(ftp, directory)
+
+        compiled_regex = re.compile(regex)
+        return [
+            remote_file._replace(
+                name=os.path.join(directory, remote_file.name))
+            for remote_file in remote_files
+            if compiled_regex.match(remote_file.name)
+            and (not self._has_metadata(remote_file)
+                 or snapshot.get(remote_file.name) !=
+                 [remote_file.size, remote_file.modified])
+        ]
+
+    @helpers.step
+    def save_listing_snapshot(self, directory, remote_files):
+        """
+        Remember files as seen, eg after they were imported, so that
+        `search_new_regex_files` doesn't return them again, unless they change
+        """
+        snapshot = self._get_listing_snapshot(directory)
+        snapshot.update(
+            (os.path.basename(remote_file.name),
+             [remote_file.size, remote_file.modified])
+            for remote_file in remote_files
+            if self._has_metadata(remote_file)
+        )
+        helpers.get_current_job().job_state.set(
+            self._get_listing_snapshot_key(directory), snapshot)
+
     @helpers.step
     def fetch_from_search(self, directory, pattern="*"):
         with FtpContextManager(self.source) as ftp:
             filenames = self._search_files_with_ftp(ftp, directory, pattern)
 
-            return self._fetch_files_with_ftp(ftp, filenames)
+            if self._get_connections_count(filenames) <= 1:
+                return self._fetch_files_with_ftp(ftp, filenames)
+
+        return self._map_with_ftp_connections(
+            self._fetch_file_with_ftp, filenames, directory=directory)
+
+    def _get_connections_count(self, filenames):
+        return min(self.OperationSettings.concurrent_connections,
+                   len(filenames))
+
+    def _map_with_ftp_connections(self, func, filenames, directory=None):
+        """
+        Call `func(ftp, filename)` for each filename, spreading the calls over
+        `concurrent_connections` FTP connections, each one in `directory`, and
+        return the results in the filenames' order
+        """
+        connections_count = self._get_connections_count(filenames)
+        if connections_count <= 1:
+            with FtpContextManager(self.source) as ftp:
+                if directory:
+                    ftp.cwd(directory)
+                return [func(ftp, filename) for filename in filenames]
+
+        ftp_context_managers = [
+            FtpContextManager(self.source)
+            for _ in xrange(connections_count)
+        ]
+        idle_ftps = Queue.Queue()
+        # The exception info of each session that raised, by it's id, to
+        # discard it instead of reusing it
+        failures = {}
+
+        def open_ftp(ftp_context_manager):
+            ftp = ftp_context_manager.__enter__()
+            try:
+                if directory:
+                    ftp.cwd(directory)
+            except Exception:
+                failures[id(ftp)] = sys.exc_info()
+                raise
+            idle_ftps.put(ftp)
+
+        def call_with_idle_ftp(filename):
+            ftp = idle_ftps.get()
+            try:
+                if failures:
+                    # The map raises the failure anyway
+                    return None
+                return func(ftp, filename)
+            except Exception:
+                failures[id(ftp)] = sys.exc_info()
+                raise
+            finally:
+                idle_ftps.put(ftp)
+
+        pool = ThreadPool(connections_count)
+        try:
+            pool.map(open_ftp, ftp_context_managers)
+            return pool.map(call_with_idle_ftp, filenames)
+        finally:
+            pool.close()
+            pool.join()
+            for ftp_context_manager in ftp_context_managers:
+                if ftp_context_manager.ftp:
+                    ftp_context_manager.__exit__(*failures.get(
+                        id(ftp_context_manager.ftp), (None, None, None)))
 
     def _search_files_with_ftp(self, ftp, directory, pattern="*"):
         ftp.cwd(directory)
@@ -161,6 +409,96 @@ class FtpFetcher(BaseFileFetcher):
 
         return filtered
 
+    def _list_files_with_ftp(self, ftp, directory):
+        """
+        List a directory's files with MLSD, or LIST if the server doesn't
+        support it, or names only with NLST if it's LIST format is unknown
+        """
+        ftp.cwd(directory)
+        if getattr(ftp, 'supports_mlsd', True):
+            lines = []
+            try:
+                ftp.retrlines('MLSD', lines.append)
+            except error_perm:
+                ftp.supports_mlsd = False
+            else:
+                return filter(None, map(self._parse_mlsd_line, lines))
+
+        lines = []
+        ftp.retrlines('LIST', lines.append)
+        remote_files = map(self._parse_list_line, lines)
+        if None in remote_files:
+            return [RemoteFile(filename, None, None) for filename in ftp.nlst()]
+
+        return [
+            remote_file
+            for remote_file in remote_files
+            if remote_file is not self.LIST_DIRECTORY
+        ]
+
+    def _parse_mlsd_line(self, line):
+        """
+        Parse an MLSD line, like `type=file;size=12;modify=20160101120000; a`,
+        or return `None` if it's not a file
+        """
+        facts_str, _, name = line.partition(' ')
+        facts = dict(
+            fact.partition('=')[::2]
+            for fact in facts_str.lower().split(';')
+            if fact
+        )
+        if facts.get('type', 'file') != 'file':
+            return None
+
+        size = facts.get('size')
+        return RemoteFile(name, int(size) if size else None,
+                          facts.get('modify'))
+
+    LIST_DIRECTORY = RemoteFile(None, None, None)
+    """
+    What `_parse_list_line` returns for directories and other non-files
+    """
+    UNIX_LIST_REGEX = re.compile(
+        r'^(?P<type>[-dlbcps])\S*\s+\d+\s+\S+\s+\S+\s+(?P<size>\d+)\s+'
+        r'(?P<modified>\S+\s+\S+\s+\S+)\s(?P<name>.+)$')
+    DOS_LIST_REGEX = re.compile(
+        r'^(?P<modified>\d\d-\d\d-\d\d\s+\d\d:\d\d[AP]M)\s+'
+        r'(?:(?P<directory><DIR>)|(?P<size>\d+))\s+(?P<name>.+)$')
+
+    def _parse_list_line(self, line):
+        """
+        Parse a Unix or DOS style LIST line, or return `None` if it's in an
+        unknown format
+        """
+        match = self.UNIX_LIST_REGEX.match(line)
+        if match:
+            if match.group('type') != '-':
+                return self.LIST_DIRECTORY
+            return RemoteFile(match.group('name'), int(match.group('size')),
+                              match.group('modified'))
+
+        match = self.DOS_LIST_REGEX.match(line)
+        if match:
+            if match.group('directory'):
+                return self.LIST_DIRECTORY
+            return RemoteFile(match.group('name'), int(match.group('size')),
+                              match.group('modified'))
+
+        if line.startswith('total '):
+            return self.LIST_DIRECTORY
+
+        return None
+
+    def _has_metadata(self, remote_file):
+        return remote_file.size is not None or remote_file.modified is not None
+
+    def _get_listing_snapshot_key(self, directory):
+        return ('ftp_listing', self.source, directory)
+
+    def _get_listing_snapshot(self, directory):
+        return helpers.get_current_job().job_state.get(
+            self._get_listing_snapshot_key(directory), {})
+
     def _fetch_files_with_ftp(self, ftp, filenames):
         return [
             self._fetch_file_with_ftp(ftp, filename)
@@ -186,13 +524,115 @@ class FtpFetcher(BaseFileFetcher):
         return local_filename
 
     def _fetch_file_that_exists_with_ftp(self, ftp, filename):
-        with TemporaryFileContextManager() as (local_filename, local_file):
+        fetch_cache = helpers.get_current_job().fetch_cache
+        cache_key = self._get_cache_key_with_ftp(ftp, filename)
+        if cache_key:
+            local_filename = fetch_cache.get(cache_key)
+            if local_filename:
+                return local_filename, None
+
+        _, local_filename = tempfile.mkstemp()
+        try:
+            exception = self._download_with_ftp(ftp, filename, local_filename)
+        except Exception:
+            # Don't leave a download that failed midway behind
+            os.remove(local_filename)
+            raise
+        if exception:
+            os.remove(local_filename)
+            return None, exception
+
+        if cache_key:
+            fetch_cache.put(cache_key, local_filename)
+
+        return local_filename, None
+
+    def _download_with_ftp(self, ftp, filename, local_filename):
+        """
+        Download a file, and after a connection error reconnect and resume
+        from the partial file's size with `REST`, up to `retries` times. If the
+        server rejects resuming, the download starts over instead. The
+        download is complete when it matches the remote SIZE, if the server
+        supports it.
+
+        Return an appropriate exception, if that file could not be fetched
+        """
+        directory = ftp.pwd()
+        remote_size = self._get_remote_size_with_ftp(ftp, filename)
+        retries = 0
+        can_resume = True
+        while True:
+            if not can_resume:
+                open(local_filename, 'wb').close()
+            offset = os.path.getsize(local_filename)
+            is_rest_rejected = False
             try:
-                ftp.retrbinary('RETR %s' % filename, local_file.write)
+                with open(local_filename, 'ab') as local_file:
+                    ftp.retrbinary('RETR %s' % filename, local_file.write,
+                                   rest=offset or None)
+                local_size = os.path.getsize(local_filename)
+                if remote_size is None or local_size == remote_size:
+                    return None
+                if local_size > remote_size:
+                    raise IncompleteFtpTransfer(
+                        "FTP file %s is %s bytes, but %s were downloaded"
+                        % (filename, remote_size, local_size))
+                error = IncompleteFtpTransfer(
+                    "FTP file %s is %s bytes, but only %s were downloaded"
+                    % (filename, remote_size, local_size))
             except error_perm, e:
-                return None, e
+                # Only a fresh download means that the file is missing, a
+                # resumed one means that the server doesn't support `REST`
+                if not offset:
+                    return e
+                can_resume = False
+                is_rest_rejected = True
+                error = e
+            except self.CONNECTION_ERRORS, e:
+                error = e
+
+            if retries >= self.OperationSettings.retries:
+                raise error
+            retries += 1
+            if not can_resume:
+                helpers.get_current_job().logger.warn(
+                    "Downloading FTP file %s again from the start after: %s",
+                    filename, error)
+            else:
+                helpers.get_current_job().logger.warn(
+                    "Resuming FTP file %s from byte %s after: %s",
+                    filename, os.path.getsize(local_filename), error)
+            if not is_rest_rejected:
+                time.sleep(self.OperationSettings.retry_delay)
+                helpers.get_current_job().ftp_registry.reconnect_session(
+                    self.source, ftp)
+                ftp.cwd(directory)
+
+    def _get_remote_size_with_ftp(self, ftp, filename):
+        try:
+            ftp.voidcmd('TYPE I')
+            return ftp.size(filename)
+        except (error_perm, error_reply):
+            return None
+
+    def _get_cache_key_with_ftp(self, ftp, filename):
+        """
+        Identify a remote file's contents by it's path, size and modification
+        time, or return `None` if caching is disabled, or the server can't tell
+        """
+        if not helpers.get_current_job().fetch_cache.enabled:
+            return None
 
-        return local_filename, None
+        try:
+            ftp.voidcmd('TYPE I')
+            size = ftp.size(filename)
+            modified = ftp.sendcmd('MDTM %s' % filename).split()[-1]
+            directory = ftp.pwd()
+        except (error_perm, error_reply):
+            return None
+
+        return ('ftp', self.source, posixpath.join(directory, filename), size,
+                modified)
 
     def _filter_files_by_filename(self, filenames, pattern):
         return [
@@ -202,10 +642,11 @@ class FtpFetcher(BaseFileFetcher):
         ]
 
     def _filter_regex_files_by_filename(self, filenames, regex):
+        compiled_regex = re.compile(regex)
         return [
             filename
             for filename in filenames
-            if re.match(regex, filename)
+            if compiled_regex.match(filename)
         ]
 
 
@@ -238,8 +679,23 @@ class ImapContextManager(object):
 
 @BaseFileFetcher.auto_mock_for_local_testing
 class EmailFetcher(BaseFileFetcher):
+    class OperationSettings(BaseFileFetcher.OperationSettings):
+        __job_settings_name__ = 'EmailFetcherOperationSettings'
+        fetch_batch_size = 50
+        """
+        How many messages to FETCH with a single command
+        """
+        incremental = False
+        """
+        Only search mail that arrived since the last run, by remembering the
+        last UID seen per mailbox, as long as the mailbox's UIDVALIDITY
+        doesn't change. It's kept in the `job_state`, which needs a durable
+        directory configured
+        """
+
     EMAIL_PART_HEADERS = '(BODY[HEADER])'
-    EMAIL_PART_WHOLE = '(RFC822)'
+    EMAIL_PART_STRUCTURE = '(BODYSTRUCTURE)'
+    EMAIL_PART_SECTION = 'BODY.PEEK[%s]'
     SEARCH_QUERY_FIELDS_MAPPING = {
         'Date': 'SentOn',
     }
@@ -251,9 +707,16 @@ class EmailFetcher(BaseFileFetcher):
         """
         :param patter: Case-insensitive pattern match the files fetched
         """
+        super(EmailFetcher, self).__init__()
+
         self.source = source
         self.pattern = pattern.lower()
         self.header_parser = HeaderParser()
+        self.pending_sync_states = {}
+        """
+        The sync state of each mailbox searched, to be saved with
+        `save_sync_state` once the fetched files have been imported
+        """
 
     @helpers.step
     def fetch_file(self, filename):
@@ -273,69 +736,305 @@ class EmailFetcher(BaseFileFetcher):
     @helpers.step
     def fetch_from_search(self, maillbox, **search_params):
         with ImapContextManager(self.source, maillbox) as connection:
+            sync_state = None
+            if self.OperationSettings.incremental:
+                sync_state = self._get_sync_state(connection, maillbox)
             message_ids = self._search_for_emails_in_server(
-                connection, search_params)
-            matched_message_ids = self._filter_matching_emails(
+                connection, search_params, sync_state)
+            matched_messages = self._filter_matching_emails(
                 connection, message_ids, search_params)
-            attachments = self._fetch_messages_attachments(
-                connection, matched_message_ids)
-            filtered_attachments = self._filter_attachments_by_filename(
-                attachments)
-            local_filenames = self._save_attachments(filtered_attachments)
-            return [f for f in local_filenames if f is not None]
-
-    def _search_for_emails_in_server(self, connection, search_params):
+            local_filenames = self._fetch_messages_attachments_files(
+                connection, matched_messages)
+            local_filenames = [f for f in local_filenames if f is not None]
+
+            if sync_state is not None and message_ids:
+                self.pending_sync_states[maillbox] = dict(
+                    sync_state, last_uid=max(map(int, message_ids)))
+
+            return local_filenames
+
+    @helpers.step
+    def save_sync_state(self):
+        """
+        Remember the mail fetched by `fetch_from_search` as seen, eg after it
+        was imported, so that `incremental` searches don't return it again.
+        Until then, a failed import fetches the same mail again on the next run
+        """
+        for mailbox, sync_state in self.pending_sync_states.iteritems():
+            self._save_sync_state(mailbox, sync_state)
+        self.pending_sync_states = {}
+
+    def _search_for_emails_in_server(self, connection, search_params,
+                                     sync_state=None):
+        """
+        Search for messages' sequence numbers, or, if `incremental`, for the
+        UIDs of messages that arrived after the last UID in `sync_state`
+        """
         search_query = self._get_search_query(search_params)
-        _, (message_ids_str,) = connection.search(None, search_query)
-        message_ids = message_ids_str.split()
+        if sync_state is None:
+            _, (message_ids_str,) = connection.search(None, search_query)
+            return message_ids_str.split()
 
-        for message_id in message_ids:
-            yield message_id
+        last_uid = sync_state.get('last_uid')
+        if last_uid is not None:
+            search_query = 'UID %s:* %s' % (last_uid + 1, search_query)
+        _, (uids_str,) = connection.uid('SEARCH', None, search_query)
+
+        # `n:*` always includes the last UID, even if it's lower than `n`
+        return [
+            uid
+            for uid in uids_str.split()
+            if last_uid is None or int(uid) > last_uid
+        ]
+
+    def _get_sync_state(self, connection, mailbox):
+        """
+        The mailbox's UIDVALIDITY and the last UID seen in it, which is
+        forgotten if the UIDVALIDITY changed
+        """
+        _, (uidvalidity,) = connection.response('UIDVALIDITY')
+        if uidvalidity is None:
+            _, (status,) = connection.status(mailbox, '(UIDVALIDITY)')
+            uidvalidity = re.search(r'UIDVALIDITY (\d+)', status).group(1)
+
+        sync_state = helpers.get_current_job().job_state.get(
+            self._get_sync_state_key(mailbox), {})
+        if sync_state.get('uidvalidity') != uidvalidity:
+            sync_state = {'uidvalidity': uidvalidity}
+
+        return sync_state
+
+    def _save_sync_state(self, mailbox, sync_state):
+        helpers.get_current_job().job_state.set(
+            self._get_sync_state_key(mailbox), sync_state)
+
+    def _get_sync_state_key(self, mailbox):
+        return ('imap_sync', self.source, mailbox)
 
     def _filter_matching_emails(self, connection, message_ids, search_params):
-        for message_id in message_ids:
-            headers = self._fetch_email_part(
-                connection, message_id, self.EMAIL_PART_HEADERS)
+        emails_headers = self._fetch_emails_part(
+            connection, message_ids, self.EMAIL_PART_HEADERS)
+        for message_id, headers in emails_headers:
             parsed_headers = self.header_parser.parsestr(headers)
             if self._headers_match_params(parsed_headers, search_params):
-                yield message_id
+                yield message_id, parsed_headers
+
+    def _fetch_messages_attachments_files(self, connection, messages):
+        """
+        Save the matching attachments of each message, from the fetch cache if
+        they were fetched before
+        """
+        fetch_cache = helpers.get_current_job().fetch_cache
+        for messages_batch in batch(
+                messages, self.OperationSettings.fetch_batch_size):
+            cache_keys = {}
+            local_filenames_by_id = {}
+            for message_id, parsed_headers in messages_batch:
+                cache_keys[message_id] = self._get_cache_key(parsed_headers)
+                local_filenames = self._get_cached_attachments(
+                    cache_keys[message_id])
+                if local_filenames is not None:
+                    local_filenames_by_id[message_id] = local_filenames
+
+            uncached_message_ids = [
+                message_id
+                for message_id, _ in messages_batch
+                if message_id not in local_filenames_by_id
+            ]
+            messages_attachments = self._fetch_messages_attachments(
+                connection, uncached_message_ids)
+            for message_id, saved_attachments in messages_attachments:
+                cache_key = cache_keys[message_id]
+                if cache_key:
+                    for filename, local_filename in saved_attachments:
+                        fetch_cache.put(
+                            cache_key + ('attachment', filename),
+                            local_filename)
+                    fetch_cache.put_index(
+                        cache_key + ('pattern', self.pattern),
+                        [filename for filename, _ in saved_attachments])
+                local_filenames_by_id[message_id] = [
+                    local_filename
+                    for _, local_filename in saved_attachments
+                ]
+
+            for message_id, _ in messages_batch:
+                for local_filename in local_filenames_by_id.get(message_id, []):
+                    yield local_filename
+
+    def _get_cache_key(self, parsed_headers):
+        """
+        Identify a message by it's Message-ID, or return `None` if caching is
+        disabled, or it doesn't have one
+        """
+        if not helpers.get_current_job().fetch_cache.enabled:
+            return None
+
+        message_id_header = parsed_headers['Message-ID']
+        if not message_id_header:
+            return None
+
+        return ('imap', self.source, message_id_header.strip())
+
+    def _get_cached_attachments(self, cache_key):
+        """
+        The local copies of a message's matching attachments, if all of them
+        are cached, else `None`
+        """
+        if not cache_key:
+            return None
+
+        fetch_cache = helpers.get_current_job().fetch_cache
+        filenames = fetch_cache.get_index(cache_key + ('pattern', self.pattern))
+        if filenames is None:
+            return None
+
+        local_filenames = []
+        for filename in filenames:
+            local_filename = fetch_cache.get(
+                cache_key + ('attachment', filename), suffix='-%s' % filename,
+                count=False)
+            if not local_filename:
+                for local_filename in local_filenames:
+                    os.remove(local_filename)
+                return None
+            local_filenames.append(local_filename)
+
+        return local_filenames
 
     def _fetch_messages_attachments(self, connection, message_ids):
+        """
+        Yield each message's ID, and it's saved attachments that match the
+        pattern, as `(filename, local_filename)`.
+
+        Only the matching parts are downloaded, after finding them in the
+        messages' BODYSTRUCTURE, with a FETCH per batch of messages that have
+        them in the same sections
+        """
+        message_ids = list(message_ids)
+        attachment_parts = self._fetch_attachment_parts(connection, message_ids)
+
+        message_ids_by_sections = {}
+        for message_id in message_ids:
+            sections = tuple(
+                part.section for part in attachment_parts[message_id])
+            if sections:
+                message_ids_by_sections.setdefault(sections, [])\
+                    .append(message_id)
+
+        saved_attachments = {}
+        for sections, message_ids_with_sections in \
+                message_ids_by_sections.iteritems():
+            parts = '(%s)' % ' '.join(
+                self.EMAIL_PART_SECTION % section for section in sections)
+            for message_ids_batch in batch(
+                    message_ids_with_sections,
+                    self.OperationSettings.fetch_batch_size):
+                responses = self._fetch(connection, message_ids_batch, parts)
+                for message_id in message_ids_batch:
+                    saved_attachments[message_id] = list(
+                        self._save_attachments(
+                            attachment_parts[message_id],
+                            responses.get(message_id, {})))
+
         for message_id in message_ids:
-            _email = self._fetch_email_part(
-                connection, message_id, self.EMAIL_PART_WHOLE)
-            message = message_from_string(_email)
-            if not message.is_multipart():
+            yield message_id, saved_attachments.get(message_id, [])
+
+    def _fetch_attachment_parts(self, connection, message_ids):
+        """
+        Map each message ID to it's parts with filenames matching the pattern
+        """
+        attachment_parts = {}
+        for message_ids_batch in batch(
+                message_ids, self.OperationSettings.fetch_batch_size):
+            responses = self._fetch(
+                connection, message_ids_batch, self.EMAIL_PART_STRUCTURE)
+            for message_id in message_ids_batch:
+                bodystructure = responses.get(message_id, {})\
+                    .get('BODYSTRUCTURE')
+                if not bodystructure:
+                    attachment_parts[message_id] = []
+                    continue
+
+                attachment_parts[message_id] = [
+                    part
+                    for part in imap.get_attachment_parts(bodystructure)
+                    if self._filename_matches(part.filename)
+                ]
+
+        return attachment_parts
+
+    def _filename_matches(self, filename):
+        charset = decode_header(filename)[0][1]
+        if charset:
+            string_to_decode = decode_header(filename)[0][0]
+            filename = str(string_to_decode).decode(charset)
+        filename = filename.lower()
+
+        return fnmatch.fnmatch(filename, self.pattern)
+
+    def _save_attachments(self, attachment_parts, response):
+        """
+        Decode the fetched attachment parts of a message to temporary files
+        """
+        for part in attachment_parts:
+            data = response.get('BODY[%s]' % part.section)
+            if data is None:
                 continue
 
-            attachments = message.get_payload()[1:]
-            for attachment in attachments:
-                yield attachment
-
-    def _filter_attachments_by_filename(self, attachments):
-        for attachment in attachments:
-            filename = attachment.get_filename()
-            charset = decode_header(filename)[0][1]
-            if charset:
-                string_to_decode = decode_header(filename)[0][0]
-                filename = str(string_to_decode).decode(charset)
-            filename = filename.lower()
-            if fnmatch.fnmatch(filename, self.pattern):
-                yield attachment
-
-    def _save_attachments(self, attachments):
-        for attachment in attachments:
-            suffix = '-%s' % attachment.get_filename()
+            suffix = '-%s' % part.filename
             with TemporaryFileContextManager(suffix=suffix)\
                     as (local_filename, local_file):
-                local_file.write(attachment.get_payload(decode=True))
-            yield local_filename
+                imap.decode_to_file(data, part.encoding, local_file)
+            yield part.filename, local_filename
 
-    def _fetch_email_part(self, connection, message_id, part):
-        _, data = connection.fetch(message_id, part)
-        _, part_data = data[0]
+    def _fetch_emails_part(self, connection, message_ids, part):
+        """
+        Fetch a part of many messages, with a FETCH command per
+        `fetch_batch_size` messages, and yield each message's ID and part, in
+        the messages' order
+        """
+        for message_ids_batch in batch(
+                message_ids, self.OperationSettings.fetch_batch_size):
+            responses = self._fetch(connection, message_ids_batch, part)
+            for message_id in message_ids_batch:
+                items = responses.get(message_id, {})
+                if part[1:-1] in items:
+                    yield message_id, items[part[1:-1]]
+
+    def _fetch(self, connection, message_ids, parts):
+        """
+        FETCH parts of messages by sequence number, or by UID if
+        `incremental`, and map each message ID to it's data items
+        """
+        message_set = self._get_message_set(message_ids)
+        if not self.OperationSettings.incremental:
+            _, data = connection.fetch(message_set, parts)
+            return imap.parse_fetch_response(data)
 
-        return part_data
+        # Responses are still by sequence number, but include the UID
+        _, data = connection.uid('FETCH', message_set, parts)
+        return {
+            items['UID']: items
+            for items in imap.parse_fetch_response(data).itervalues()
+            if 'UID' in items
+        }
+
+    def _get_message_set(self, message_ids):
+        """
+        Compress message IDs into an IMAP message set, eg `1:50,77`
+        """
+        ranges = []
+        for message_id in sorted(set(map(int, message_ids))):
+            if ranges and ranges[-1][1] == message_id - 1:
+                ranges[-1][1] = message_id
+            else:
+                ranges.append([message_id, message_id])
+
+        return ','.join(
+            str(start) if start == end else '%s:%s' % (start, end)
+            for start, end in ranges
+        )
 
     def _get_search_query(self, search_params):
         return '(%s)' % ' '.join(
@@ -398,16 +1097,42 @@ class NoOpFetcher(BaseFileFetcher):
     def search_regex_files(self, *args, **kwargs):
         return kwargs.get('filenames') or []
 
+    @helpers.step
+    def list_files(self, *args, **kwargs):
+        return kwargs.get('remote_files') or []
+
+    @helpers.step
+    def search_new_regex_files(self, *args, **kwargs):
+        return kwargs.get('remote_files') or []
+
+    @helpers.step
+    def save_listing_snapshot(self, *args, **kwargs):
+        pass
+
+    @helpers.step
+    def save_sync_state(self, *args, **kwargs):
+        pass
+
 
 class LocalFileContextManager(object):
-    def __init__(self, filenames, fetcher, disposer):
+    def __init__(self, filenames, fetcher, disposer, streaming=False):
+        """
+        :param streaming: Open the files as streams where the fetcher supports
+            it, instead of fetching them to local files. Streams are closed
+            instead of deleted
+        """
         self.filenames = filenames
         self.fetcher = fetcher
         self.disposer = disposer
-        pass
+        self.streaming = streaming
 
     def __enter__(self):
-        self.local_filenames = self.fetcher.fetch_files_that_exist(self.filenames)
+        if self.streaming:
+            self.local_filenames = \
+                self.fetcher.open_files_that_exist(self.filenames)
+        else:
+            self.local_filenames = \
+                self.fetcher.fetch_files_that_exist(self.filenames)
         self.local_filenames = [
             local_filename
             for local_filename, exception in self.local_filenames
@@ -416,4 +1141,11 @@ class LocalFileContextManager(object):
         return self.local_filenames
 
     def __exit__(self, type, value, traceback):
-        self.disposer.delete_files(self.local_filenames)
+        for local_filename in self.local_filenames:
+            if not isinstance(local_filename, basestring):
+                local_filename.close()
+        self.disposer.delete_files([
+            local_filename
+            for local_filename in self.local_filenames
+            if isinstance(local_filename, basestring)
+        ])
@@ -0,0 +1,164 @@
+import re
+import base64
+import quopri
+import itertools
+from email import utils
+from cStringIO import StringIO
+from collections import namedtuple
+
+
+TOKEN_REGEX = re.compile(
+    r'\s*(?:(?P<open>\()|(?P<close>\))|"(?P<string>(?:[^"\\]|\\.)*)"'
+    r'|\{(?P<literal>\d+)\}$|(?P<atom>[^\s()"]+))',
+    re.DOTALL)
+ESCAPED_CHAR_REGEX = re.compile(r'\\(.)', re.DOTALL)
+OPEN = object()
+CLOSE = object()
+
+
+class AttachmentPart(namedtuple('AttachmentPart', [
+        'section', 'filename', 'encoding'])):
+    """
+    A part of a message with a filename, from it's BODYSTRUCTURE:
+
+    * section: the part's section number, to fetch it with `BODY[<section>]`
+    * filename: the part's filename, as in the message's headers
+    * encoding: the part's lower case Content-Transfer-Encoding
+    """
+
+
+def parse_fetch_response(data):
+    """
+    Parse a FETCH response for many messages, as returned by imaplib, to a dict
+    of each message ID's data items, eg `{'1': {'BODYSTRUCTURE': [...]}}`.
+
+    Lists are parsed to lists, NIL to `None`, and literals are kept as is,
+    without copying them
+    """
+    values = _parse(_tokenize(data))
+    responses = {}
+    for message_id, items in zip(values[::2], values[1::2]):
+        responses.setdefault(message_id, {})\
+            .update(zip(items[::2], items[1::2]))
+
+    return responses
+
+
+def get_attachment_parts(bodystructure, section=''):
+    """
+    Yield the parts of a parsed BODYSTRUCTURE that have a filename, in either
+    their Content-Disposition or their Content-Type
+    """
+    if isinstance(bodystructure[0], list):
+        parts = itertools.takewhile(
+            lambda value: isinstance(value, list), bodystructure)
+        for number, part in enumerate(parts, 1):
+            part_section = '%s.%s' % (section, number) if section else str(number)
+            for attachment_part in get_attachment_parts(part, part_section):
+                yield attachment_part
+        return
+
+    _type, subtype, parameters, _, _, encoding = bodystructure[:6]
+    # Extension data starts after the basic fields, and any type-specific
+    # ones: lines for text, and envelope, body and lines for messages
+    if _type.lower() == 'text':
+        md5_index = 8
+    elif (_type.lower(), subtype.lower()) == ('message', 'rfc822'):
+        md5_index = 10
+    else:
+        md5_index = 7
+    disposition = None
+    if len(bodystructure) > md5_index + 1:
+        disposition = bodystructure[md5_index + 1]
+
+    filename = None
+    if disposition:
+        filename = _get_parameter(disposition[1], 'filename')
+    filename = filename or _get_parameter(parameters, 'name')
+    if filename:
+        yield AttachmentPart(section or '1', filename,
+                             (encoding or '7bit').lower())
+
+
+def decode_to_file(data, encoding, _file):
+    """
+    Decode a part's data by it's Content-Transfer-Encoding, line by line,
+    straight into a file
+    """
+    if encoding == 'base64':
+        base64.decode(StringIO(data), _file)
+    elif encoding == 'quoted-printable':
+        quopri.decode(StringIO(data), _file)
+    else:
+        _file.write(data)
+
+
+def _get_parameter(parameters, name):
+    """
+    Get a parameter's value from a BODYSTRUCTURE's parameters list, decoding
+    RFC 2231 values, eg `filename*` or `filename*0*`, to UTF-8 strings
+    """
+    if not parameters:
+        return None
+
+    # decode_params keeps it's first parameter as is, as it's a header's value
+    decoded_parameters = utils.decode_params(
+        [('', '')] + zip(parameters[::2], parameters[1::2]))
+    for key, value in decoded_parameters[1:]:
+        if key.lower() == name:
+            value = utils.collapse_rfc2231_value(value)
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            return value
+
+    return None
+
+
+def _tokenize(data):
+    """
+    Split imaplib's response data to tokens. imaplib returns literals as
+    `(<line up to the literal>, <literal>)` tuples, and the rest of the
+    response as strings
+    """
+    for item in data:
+        if isinstance(item, tuple):
+            line, literal = item
+        else:
+            line, literal = item, None
+
+        position = 0
+        while line[position:].strip():
+            match = TOKEN_REGEX.match(line, position)
+            if not match:
+                raise ValueError(
+                    "Can't parse IMAP response: %r" % line[position:])
+            position = match.end()
+
+            if match.group('open'):
+                yield OPEN
+            elif match.group('close'):
+                yield CLOSE
+            elif match.group('literal') is not None:
+                yield literal
+            elif match.group('string') is not None:
+                yield ESCAPED_CHAR_REGEX.sub(r'\1', match.group('string'))
+            elif match.group('atom').upper() == 'NIL':
+                yield None
+            else:
+                yield match.group('atom')
+
+
+def _parse(tokens):
+    values = []
+    outer_values = []
+    for token in tokens:
+        if token is OPEN:
+            outer_values.append(values)
+            values = []
+        elif token is CLOSE:
+            inner_values, values = values, outer_values.pop()
+            values.append(inner_values)
+        else:
+            values.append(token)
+
+    return values
@@ -1,12 +1,24 @@
+import gc
 import csv
 import xlrd
-import datetime
+import cPickle
+import marshal
+import zipfile
+import cStringIO
+import multiprocessing
 from StringIO import StringIO
 from abc import abstractmethod
+from contextlib import contextmanager
 
 from sonny.infrastructure.context import helpers
 
 from sonny.infrastructure.operations.base import BaseOperation
+from sonny.infrastructure.operations import columnar
+from sonny.infrastructure.operations import compression
+from sonny.infrastructure.operations import xlsx
+from sonny.infrastructure.operations.xldates import XldateConverter
+from sonny.infrastructure.operations.rows import make_row_class
+from sonny.infrastructure.operations.utils import batch
 
 
 class BaseLoader(BaseOperation):
@@ -19,23 +31,76 @@ class BaseLoader(BaseOperation):
 
 
 class CsvLoader(BaseLoader):
+    class OperationSettings(BaseLoader.OperationSettings):
+        __job_settings_name__ = 'CsvLoaderOperationSettings'
+        compact_rows = False
+        """
+        Load rows as read-only, dict-like tuples, that share their headers,
+        instead of dicts, to save memory and time on wide files. Rows with
+        more or less values than headers are still loaded as dicts
+        """
+
     def __init__(self):
-        pass
+        super(CsvLoader, self).__init__()
 
     @helpers.step
     def get_all_data_with_headers(self, filename, delimiter=None):
-        with open(filename, 'rb') as _file:
+        """
+        Load a CSV file, decompressing it on the fly if it's gzip, bz2 or zip
+        compressed, or read a file-like object as is, eg a fetcher's stream
+        """
+        with self._open(filename) as _file:
             data = self.get_all_data_with_headers_from_file(_file, delimiter=delimiter)
             for datum in data:
                 yield datum
 
+    @helpers.step
+    def get_record_batches(self, filename, delimiter=None, batch_size=10000):
+        """
+        Load a CSV file as `columnar.RecordBatch`es of up to `batch_size`
+        rows, for the columnar mode
+        """
+        with self._open(filename) as _file:
+            reader = csv.reader(_file, delimiter=delimiter or ',',
+                                skipinitialspace=True)
+            headers = reader.next()
+            for rows in batch(reader, batch_size=batch_size):
+                yield columnar.RecordBatch.from_rows(headers, rows)
+
+    @contextmanager
+    def _open(self, filename):
+        if not isinstance(filename, basestring):
+            yield filename
+            return
+
+        with compression.open_decompressed(filename) as _file:
+            yield _file
+
     def get_all_data_with_headers_from_file(self, _file, delimiter=None):
         delimiter = delimiter or ','
         reader = csv.reader(_file, delimiter=delimiter, skipinitialspace=True)
 
         headers = reader.next()
 
-        for row in reader:
+        for datum in self._get_data(headers, reader):
+            yield datum
+
+    def _get_data(self, headers, rows):
+        """
+        Make the rows' values into data, keyed by the headers
+        """
+        if self.OperationSettings.compact_rows \
+                and len(set(headers)) == len(headers):
+            row_class = make_row_class(headers)
+            headers_count = len(headers)
+            for row in rows:
+                if len(row) == headers_count:
+                    yield row_class(row)
+                else:
+                    yield dict(zip(headers, row))
+            return
+
+        for row in rows:
             datum = {
                 header: value
                 for header, value in zip(headers, row)
@@ -43,6 +108,155 @@ class CsvLoader(BaseLoader):
             yield datum
 
 
+class ParallelCsvLoader(CsvLoader):
+    """
+    A `CsvLoader` that splits a local file to byte ranges, that end at record
+    boundaries, and parses them in a pool of processes.
+
+    Records are split on newlines outside of quotes, so a quote inside an
+    unquoted field, eg `5" disk`, would misalign the ranges. Compressed files
+    and streams are loaded serially
+    """
+    class OperationSettings(CsvLoader.OperationSettings):
+        __job_settings_name__ = 'ParallelCsvLoaderOperationSettings'
+        processes = None
+        """
+        How many processes to parse with, by default one per CPU
+        """
+        chunk_bytes = 16 * 1024 * 1024
+        """
+        About how many bytes of the file each process parses at a time
+        """
+        ordered = True
+        """
+        Yield the rows in the file's order, instead of as each chunk is parsed
+        """
+
+    @helpers.step
+    def get_all_data_with_headers(self, filename, delimiter=None):
+        if not isinstance(filename, basestring) \
+                or compression.get_compression(filename):
+            data = super(ParallelCsvLoader, self).get_all_data_with_headers(
+                filename, delimiter=delimiter)
+            for datum in data:
+                yield datum
+            return
+
+        delimiter = delimiter or ','
+        ranges = get_record_ranges(filename, self.OperationSettings.chunk_bytes)
+        if not ranges:
+            return
+
+        headers_range, ranges = ranges[0], ranges[1:]
+        headers = parse_csv_range(filename, headers_range, delimiter)[0]
+        for datum in self._get_data(headers, self._get_rows(filename, ranges, delimiter)):
+            yield datum
+
+    def _get_rows(self, filename, ranges, delimiter):
+        if len(ranges) <= 1:
+            for _range in ranges:
+                for row in parse_csv_range(filename, _range, delimiter):
+                    yield row
+            return
+
+        pool = multiprocessing.Pool(self.OperationSettings.processes)
+        try:
+            arguments = [(filename, _range, delimiter) for _range in ranges]
+            if self.OperationSettings.ordered:
+                chunks = pool.imap(_parse_csv_range_star, arguments)
+            else:
+                chunks = pool.imap_unordered(_parse_csv_range_star, arguments)
+            for marshalled_rows in chunks:
+                for row in _load_without_gc(marshal.loads, marshalled_rows):
+                    yield row
+        finally:
+            # Also stops the workers if the rows weren't all consumed
+            pool.terminate()
+            pool.join()
+
+
+RECORD_RANGES_BLOCK_BYTES = 1024 * 1024
+
+
+def get_record_ranges(filename, chunk_bytes, quotechar='"'):
+    """
+    Split a CSV file to `(start, end)` byte ranges of about `chunk_bytes`,
+    that end after a record's newline. The first range is the headers' record.
+
+    A newline ends a record if there's an even number of quotes before it, as
+    escaped quotes are doubled, which only needs counting quotes in a single
+    pass, rather than parsing the file
+    """
+    ranges = []
+    start = 0
+    next_end = 0
+    offset = 0
+    quotes_parity = 0
+    with open(filename, 'rb') as _file:
+        while True:
+            block = _file.read(RECORD_RANGES_BLOCK_BYTES)
+            if not block:
+                break
+
+            counted = 0
+            position = max(next_end - offset, 0)
+            while position < len(block):
+                newline = block.find('\n', position)
+                if newline == -1:
+                    break
+                quotes_parity = \
+                    (quotes_parity + block.count(quotechar, counted, newline)) % 2
+                counted = newline
+                position = newline + 1
+                if quotes_parity == 0:
+                    ranges.append((start, offset + position))
+                    start = offset + position
+                    next_end = start + chunk_bytes
+                    position = max(next_end - offset, position)
+
+            quotes_parity = \
+                (quotes_parity + block.count(quotechar, counted)) % 2
+            offset += len(block)
+
+    if start < offset:
+        ranges.append((start, offset))
+
+    return ranges
+
+
+def parse_csv_range(filename, _range, delimiter):
+    """
+    Parse the records in a byte range of a CSV file, to lists of values
+    """
+    start, end = _range
+    with open(filename, 'rb') as _file:
+        _file.seek(start)
+        data = _file.read(end - start)
+
+    reader = csv.reader(
+        cStringIO.StringIO(data), delimiter=delimiter, skipinitialspace=True)
+
+    return list(reader)
+
+
+def _parse_csv_range_star(arguments):
+    # Pool.imap only passes a single argument. The rows are sent back
+    # marshalled, as pickling many small lists is slower than parsing them
+    return marshal.dumps(parse_csv_range(*arguments))
+
+
+def _load_without_gc(loads, data):
+    # Making many lists at once triggers the garbage collector over and over,
+    # though none of them can be garbage yet
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return loads(data)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+
 class ExcelLoader(BaseLoader):
     XLRD_WARNING_LOG_PREFIX = 'WARNING *** '
     XLRD_ERROR_LOG_PREFIX = 'ERROR *** '
@@ -52,19 +266,65 @@ class ExcelLoader(BaseLoader):
         self.sheet_index = sheet_index
         self.skip_start_empty_rows = skip_start_empty_rows
         self.skip_start_empty_columns = skip_start_empty_columns
+        self.xldate_converters = {}
 
     @helpers.step
     def get_all_data_with_headers(self, filename):
-        workbook = self._load_workbook(filename)
-        sheet = workbook.sheet_by_index(self.sheet_index)
+        sheet = self._load_sheet(filename)
         first_row_index, first_column_index = self._get_first_row_and_first_column_indexes(sheet)
         headers = self._get_sheet_headers(sheet, first_row_index, first_column_index)
         data = self._get_sheet_data(sheet, headers, first_row_index, first_column_index)
         return data
 
+    @helpers.step
+    def get_record_batches(self, filename, batch_size=10000):
+        """
+        Load the sheet as `columnar.RecordBatch`es of up to `batch_size` rows,
+        for the columnar mode
+        """
+        sheet = self._load_sheet(filename)
+        first_row_index, first_column_index = self._get_first_row_and_first_column_indexes(sheet)
+        headers = self._get_sheet_headers(sheet, first_row_index, first_column_index)
+        data = self._get_sheet_data(sheet, headers, first_row_index, first_column_index)
+        for rows in batch(data, batch_size=batch_size):
+            yield columnar.RecordBatch.from_dicts(headers, rows)
+
+    def _load_sheet(self, filename):
+        """
+        Load only the sheet, by it's index or name, and release the workbook's
+        file
+        """
+        workbook = self._load_workbook(filename)
+        if isinstance(self.sheet_index, basestring):
+            sheet = workbook.sheet_by_name(self.sheet_index)
+        else:
+            sheet = workbook.sheet_by_index(self.sheet_index)
+        workbook.release_resources()
+
+        return sheet
+
+    def _load_sheet_rows(self, filename):
+        """
+        Load the sheet's name, headers and rows' values
+        """
+        sheet = self._load_sheet(filename)
+        first_row_index, first_column_index = self._get_first_row_and_first_column_indexes(sheet)
+        headers = self._get_sheet_headers(sheet, first_row_index, first_column_index)
+        rows = [
+            self._get_sheet_row_values(sheet, row_index, first_column_index)
+            for row_index in xrange(first_row_index + 1, sheet.nrows)
+        ]
+
+        return sheet.name, headers, rows
+
     def _load_workbook(self, filename):
         logfile = StringIO()
-        workbook = xlrd.open_workbook(filename, logfile=logfile)
+        # xlrd needs a seekable file, so compressed files are decompressed to
+        # a temporary one first. Sheets are only parsed when they are first
+        # used, for formats that support it
+        with compression.decompressed_filename(filename) as filename:
+            workbook = xlrd.open_workbook(
+                filename, logfile=logfile, on_demand=True)
         self._log_import_logs(logfile)
 
         return workbook
@@ -79,67 +339,307 @@ class ExcelLoader(BaseLoader):
 
     def _get_first_row_and_first_column_indexes(self, sheet):
         if self.skip_start_empty_rows:
-            for row_index in xrange(0, sheet.nrows):
-                if not self._row_is_empty(sheet, row_index):
-                    first_row_index = row_index
-                    break
-            else:
-                # TODO: Perhaps we need to raise an error?
-                first_row_index = sheet.nrows
+            first_row_index = self._get_first_non_empty_row_index(sheet)
         else:
             first_row_index = 0
 
         if self.skip_start_empty_columns:
-            for column_index in xrange(0, sheet.ncols):
-                if not self._column_is_empty(sheet, column_index):
-                    first_column_index = column_index
-                    break
-            else:
-                # TODO: Perhaps we need to raise an error?
-                first_column_index = sheet.nrows
+            first_column_index = self._get_first_non_empty_column_index(sheet)
         else:
             first_column_index = 0
 
         return first_row_index, first_column_index
 
-    def _row_is_empty(self, sheet, row_index):
-        return all(
-            sheet.cell(row_index, column_index).ctype == xlrd.biffh.XL_CELL_EMPTY
-            for column_index in xrange(0, sheet.ncols)
-        )
+    def _get_first_non_empty_row_index(self, sheet):
+        """
+        The first row with a non-empty cell, by the rows' cell types, without
+        making cell objects
+        """
+        for row_index in xrange(0, sheet.nrows):
+            # Empty cells' type is 0, so `any` stops at the first non-empty one
+            if any(sheet.row_types(row_index)):
+                return row_index
 
-    def _column_is_empty(self, sheet, column_index):
-        return all(
-            sheet.cell(row_index, column_index).ctype == xlrd.biffh.XL_CELL_EMPTY
-            for row_index in xrange(0, sheet.nrows)
-        )
+        # TODO: Perhaps we need to raise an error?
+        return sheet.nrows
+
+    def _get_first_non_empty_column_index(self, sheet):
+        """
+        The first column with a non-empty cell. Each row is only scanned up to
+        the first non-empty column found so far, so a single pass over the
+        rows finds it
+        """
+        first_column_index = sheet.ncols
+        for row_index in xrange(0, sheet.nrows):
+            cell_types = sheet.row_types(row_index, 0, first_column_index)
+            for column_index, cell_type in enumerate(cell_types):
+                if cell_type != xlrd.biffh.XL_CELL_EMPTY:
+                    first_column_index = column_index
+                    break
+            if first_column_index == 0:
+                break
+
+        # TODO: Perhaps we need to raise an error?
+        return first_column_index
 
     def _get_sheet_headers(self, sheet, first_row_index, first_column_index):
-        return [
-            sheet.cell_value(first_row_index, column_index)
-            for column_index in xrange(first_column_index, sheet.ncols)
-        ]
+        if first_row_index >= sheet.nrows:
+            return []
+
+        return sheet.row_values(first_row_index, first_column_index)
 
     def _get_sheet_data(self, sheet, headers, first_row_index,
                         first_column_index):
         return (
-            {
-                header: self._get_sheet_cell_value(sheet, row_index, column_index)
-                for column_index, header in enumerate(headers, first_column_index)
-            }
+            dict(zip(headers, self._get_sheet_row_values(
+                sheet, row_index, first_column_index)))
             for row_index in xrange(first_row_index + 1, sheet.nrows)
         )
 
-    def _get_sheet_cell_value(self, sheet, row, column):
-        value = sheet.cell_value(row, column)
+    def _get_sheet_row_values(self, sheet, row_index, first_column_index):
+        """
+        A row's values, read with it's cell types as whole rows, with date
+        cells converted to datetimes
+        """
+        values = sheet.row_values(row_index, first_column_index)
+        cell_types = sheet.row_types(row_index, first_column_index)
+        if xlrd.biffh.XL_CELL_DATE in cell_types:
+            to_datetime = self._get_xldate_converter(sheet)
+            values = [
+                to_datetime(value)
+                if cell_type == xlrd.biffh.XL_CELL_DATE else value
+                for value, cell_type in zip(values, cell_types)
+            ]
 
-        cell_type = sheet.cell_type(row, column)
+        return values
 
-        if cell_type == xlrd.biffh.XL_CELL_DATE:
-            value = self._get_sheet_cell_value_as_date(sheet, value)
+    def _get_sheet_cell_value_as_date(self, sheet, value):
+        return self._get_xldate_converter(sheet)(value)
 
-        return value
+    def _get_xldate_converter(self, sheet):
+        datemode = sheet.book.datemode
+        xldate_converter = self.xldate_converters.get(datemode)
+        if xldate_converter is None:
+            xldate_converter = self.xldate_converters[datemode] = \
+                XldateConverter(datemode)
 
-    def _get_sheet_cell_value_as_date(self, sheet, value):
-        date_tuple = xlrd.xldate_as_tuple(value, sheet.book.datemode)
-        return datetime.datetime(*date_tuple)
+        return xldate_converter
+
+
+class MultiSheetExcelLoader(ExcelLoader):
+    """
+    Load several sheets of a workbook, by their indexes or names, or all of
+    them by default, each in a worker process, as a single stream of rows in
+    the sheets' order. Each row has it's sheet's name, under `sheet_name_key`.
+
+    XLSX sheets are streamed like with `XlsxStreamingLoader`, so that each
+    worker only parses it's own sheet
+    """
+
+    def __init__(self, sheets=None, sheet_name_key='sheet_name',
+                 processes=None, skip_start_empty_rows=True,
+                 skip_start_empty_columns=True):
+        super(MultiSheetExcelLoader, self).__init__(
+            skip_start_empty_rows=skip_start_empty_rows,
+            skip_start_empty_columns=skip_start_empty_columns)
+        self.sheets = sheets
+        self.sheet_name_key = sheet_name_key
+        self.processes = processes
+
+    @helpers.step
+    def get_all_data_with_headers(self, filename):
+        # Decompress once, rather than in each worker
+        with compression.decompressed_filename(filename) as filename:
+            for sheet_name, headers, rows in self._load_sheets_rows(filename):
+                for values in rows:
+                    datum = dict(zip(headers, values))
+                    datum[self.sheet_name_key] = sheet_name
+                    yield datum
+
+    @helpers.step
+    def get_record_batches(self, filename, batch_size=10000):
+        """
+        Load the sheets as `columnar.RecordBatch`es of up to `batch_size` rows
+        of a single sheet, with it's name under `sheet_name_key`
+        """
+        numpy = columnar.import_numpy()
+        with compression.decompressed_filename(filename) as filename:
+            for sheet_name, headers, rows in self._load_sheets_rows(filename):
+                for rows_batch in batch(rows, batch_size=batch_size):
+                    record_batch = columnar.RecordBatch.from_rows(
+                        headers, rows_batch)
+                    sheet_names = numpy.empty(len(record_batch), dtype=object)
+                    sheet_names.fill(sheet_name)
+                    yield record_batch.with_columns({
+                        self.sheet_name_key: sheet_names})
+
+    def _count_sheets(self, filename):
+        """
+        Count an XLSX workbook's sheets from it's workbook part, as xlrd
+        parses all of an XLSX workbook's sheets when opening it. Other
+        workbooks are opened on demand, which doesn't parse their sheets
+        """
+        if zipfile.is_zipfile(filename):
+            with zipfile.ZipFile(filename) as archive:
+                return xlsx.count_sheets(archive)
+
+        workbook = self._load_workbook(filename)
+        try:
+            return workbook.nsheets
+        finally:
+            workbook.release_resources()
+
+    def _load_sheets_rows(self, filename):
+        sheets = self.sheets
+        if sheets is None:
+            sheets = range(self._count_sheets(filename))
+
+        arguments = [
+            (filename, sheet, self.skip_start_empty_rows,
+             self.skip_start_empty_columns)
+            for sheet in sheets
+        ]
+        if len(sheets) <= 1 or self.processes == 1:
+            for _arguments in arguments:
+                yield load_excel_sheet_rows(*_arguments)
+            return
+
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for pickled_sheet_rows in pool.imap(_load_excel_sheet_rows_star, arguments):
+                yield _load_without_gc(cPickle.loads, pickled_sheet_rows)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def load_excel_sheet_rows(filename, sheet, skip_start_empty_rows=True,
+                          skip_start_empty_columns=True):
+    """
+    Load a sheet's name, headers and rows' values, by it's index or name.
+    XLSX sheets are streamed, as xlrd parses all of an XLSX workbook's sheets
+    when opening it
+    """
+    if zipfile.is_zipfile(filename):
+        loader_class = XlsxStreamingLoader
+    else:
+        loader_class = ExcelLoader
+    loader = loader_class(sheet, skip_start_empty_rows, skip_start_empty_columns)
+
+    return loader._load_sheet_rows(filename)
+
+
+def _load_excel_sheet_rows_star(arguments):
+    # Pool.imap only passes a single argument. The rows are sent back pickled
+    # in one go, so that they can be unpickled without the garbage collector
+    return cPickle.dumps(
+        load_excel_sheet_rows(*arguments), cPickle.HIGHEST_PROTOCOL)
+
+
+class XlsxStreamingLoader(BaseLoader):
+    """
+    Load an XLSX sheet like `ExcelLoader`, but by streaming it's XML a row at
+    a time, instead of loading the whole workbook, so that memory stays flat
+    however big the sheet is. Only the shared strings are kept in memory.
+
+    The headers end at the header row's last non-empty cell, and cells right
+    of them are ignored
+    """
+
+    def __init__(self, sheet_index=0, skip_start_empty_rows=True,
+                 skip_start_empty_columns=True):
+        self.sheet_index = sheet_index
+        self.skip_start_empty_rows = skip_start_empty_rows
+        self.skip_start_empty_columns = skip_start_empty_columns
+
+    @helpers.step
+    def get_all_data_with_headers(self, filename):
+        with compression.decompressed_filename(filename) as filename, \
+                zipfile.ZipFile(filename) as archive:
+            workbook = xlsx.Workbook(archive)
+            sheet = workbook.get_sheet(self.sheet_index)
+            headers, rows = self._get_sheet_headers_and_rows(workbook, sheet)
+            for values in rows:
+                yield dict(zip(headers, values))
+
+    def _load_sheet_rows(self, filename):
+        """
+        Load the sheet's name, headers and rows' values, like
+        `ExcelLoader._load_sheet_rows`
+        """
+        with compression.decompressed_filename(filename) as filename, \
+                zipfile.ZipFile(filename) as archive:
+            workbook = xlsx.Workbook(archive)
+            sheet = workbook.get_sheet(self.sheet_index)
+            headers, rows = self._get_sheet_headers_and_rows(workbook, sheet)
+
+            return sheet.name, headers, list(rows)
+
+    def _get_sheet_headers_and_rows(self, workbook, sheet):
+        """
+        The sheet's headers, and a generator of it's rows' values, one per
+        header
+        """
+        if self.skip_start_empty_columns:
+            first_column_index = self._get_first_non_empty_column_index(
+                workbook, sheet)
+        else:
+            first_column_index = 0
+
+        rows = self._get_sheet_rows(workbook, sheet, first_column_index)
+        header_cells = next(rows, None)
+        if header_cells is None:
+            return [], iter([])
+
+        headers = [
+            header_cells.get(column_index, u'')
+            for column_index in xrange(max(header_cells or [-1]) + 1)
+        ]
+        rows = (
+            [
+                cells.get(column_index, u'')
+                for column_index in xrange(len(headers))
+            ]
+            for cells in rows
+        )
+
+        return headers, rows
+
+    def _get_first_non_empty_column_index(self, workbook, sheet):
+        """
+        A first pass over the sheet, that stops early once a row has a value
+        in the first column of the sheet's used range, which is usually near
+        the start
+        """
+        first_used_column_index = \
+            workbook.get_first_used_column_index(sheet) or 0
+        first_column_index = None
+        for _, cells in workbook.iter_rows(sheet):
+            row_first_column_index = min(
+                column_index for column_index, _ in cells)
+            if first_column_index is None \
+                    or row_first_column_index < first_column_index:
+                first_column_index = row_first_column_index
+            if first_column_index <= first_used_column_index:
+                break
+
+        return first_column_index or 0
+
+    def _get_sheet_rows(self, workbook, sheet, first_column_index):
+        """
+        Yield each row's cells, as a dict of their index from the first
+        column to their value, including the empty rows between
+        """
+        next_row_index = None if self.skip_start_empty_rows else 0
+        for row_index, cells in workbook.iter_rows(sheet):
+            if next_row_index is None:
+                next_row_index = row_index
+            for _ in xrange(next_row_index, row_index):
+                yield {}
+
+            yield {
+                column_index - first_column_index: value
+                for column_index, value in cells
+                if column_index >= first_column_index
+            }
+            next_row_index = row_index + 1
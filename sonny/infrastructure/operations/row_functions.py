@@ -0,0 +1,199 @@
+"""
+Compile a chain of row transformers to a single function per row, with
+generated code, that makes one output per row, instead of a new dict, and a
+generator, per transformer
+"""
+import itertools
+from collections import namedtuple, OrderedDict
+
+
+class RowTransform(namedtuple('RowTransform', ['name', 'argument'])):
+    """
+    What a row transformer does, for compiling it:
+
+    * name: the transformer factory's name, eg `keep_keys`
+    * argument: the factory's argument, eg the keys to keep
+    """
+
+
+def compile_row_function(row_transforms):
+    """
+    Compile row transforms to a function, that transforms a single row like
+    the transformers would, one after the other.
+
+    Casts are only done once the row's output is made, so a cast's error is
+    only raised if it's key is still in the output
+    """
+    return RowFunctionCompiler(row_transforms).compile()
+
+
+def _missing_key(key):
+    raise KeyError(key)
+
+
+class RowFunctionCompiler(object):
+    """
+    Compile row transforms, by keeping track of what the row would be, without
+    making it: a base row, the keys kept from it and the casts of it's values,
+    and the values set over it. Rows are only made when a transform needs
+    them, eg to pass them to a function
+    """
+
+    def __init__(self, row_transforms):
+        self.row_transforms = row_transforms
+        self.namespace = {'_missing_key': _missing_key}
+        self.names = {}
+        self.counter = itertools.count()
+        self.lines = []
+        self._set_base('row', is_owned=False)
+
+    def compile(self):
+        for row_transform in self.row_transforms:
+            getattr(self, row_transform.name)(row_transform.argument)
+        self.lines.append('return %s' % self._make_row())
+
+        source = 'def row_function(row):\n%s\n' % '\n'.join(
+            '    ' + line for line in self.lines)
+        exec compile(source, '<row_function>', 'exec') in self.namespace
+        row_function = self.namespace['row_function']
+        row_function.source = source
+
+        return row_function
+
+    def keep_keys(self, keys):
+        keys = set(keys)
+        if self.kept_keys is None:
+            self.kept_keys = keys
+        else:
+            self.kept_keys = self.kept_keys & keys
+        self.base_casts = {
+            key: casts
+            for key, casts in self.base_casts.iteritems()
+            if key in keys
+        }
+        self.values = OrderedDict(
+            (key, value)
+            for key, value in self.values.iteritems()
+            if key in keys
+        )
+        self.is_transformed = True
+
+    def cast_dicts_values(self, keys_casts):
+        for key, caster in keys_casts.iteritems():
+            if not caster:
+                continue
+            caster_name = self._bind('caster', caster)
+            if key in self.values:
+                self.values[key] = '%s(%s)' % (caster_name, self.values[key])
+            elif self.kept_keys is None or key in self.kept_keys:
+                self.base_casts.setdefault(key, []).append(caster_name)
+        self.is_transformed = True
+
+    def update_with_static_values(self, static_values):
+        for key, value in static_values.iteritems():
+            self.values[key] = self._bind('value', value)
+        self.is_transformed = True
+
+    def update_with_dynamic_values(self, dynamic_values):
+        row = self._make_row()
+        values = OrderedDict()
+        for key, func in dynamic_values.iteritems():
+            # Call the functions with the row as it is now, before it's updated
+            value = self._new_local('value')
+            self.lines.append('%s = %s(%s)' % (
+                value, self._bind('func', func), row))
+            values[key] = value
+        self._set_base(row, is_owned=self.is_owned)
+        self.values = values
+        self.is_transformed = True
+
+    def generic_map(self, func):
+        row = self._make_row()
+        mapped = self._new_local('row')
+        self.lines.append('%s = %s(%s)' % (mapped, self._bind('func', func), row))
+        self._set_base(mapped, is_owned=False)
+
+    def dicts_to_tuples(self, keys):
+        values = self._new_local('row')
+        self.lines.append('%s = (%s)' % (values, ''.join(
+            '%s, ' % self._get_value(key) for key in keys)))
+        self._set_base(values, is_owned=False)
+
+    def _set_base(self, base, is_owned):
+        self.base = base
+        self.is_owned = is_owned
+        self.kept_keys = None
+        self.base_casts = {}
+        self.values = OrderedDict()
+        self.is_transformed = False
+
+    def _get_value(self, key):
+        if key in self.values:
+            return self.values[key]
+        if self.kept_keys is not None and key not in self.kept_keys:
+            return '_missing_key(%s)' % self._bind_key(key)
+
+        return self._cast('%s[%s]' % (self.base, self._bind_key(key)), key)
+
+    def _cast(self, value, key):
+        for caster_name in self.base_casts.get(key, []):
+            value = '%s(%s)' % (caster_name, value)
+
+        return value
+
+    def _make_row(self):
+        """
+        Make the row as it is now, and return it's name
+        """
+        if not self.is_transformed:
+            return self.base
+
+        if self.kept_keys is None and self.is_owned:
+            row = self.base
+        elif self.kept_keys is None:
+            row = self._new_local('row')
+            self.lines.append('%s = dict(%s)' % (row, self.base))
+        else:
+            row = self._new_local('row')
+            self.lines.append('%s = {}' % row)
+            for key in self.kept_keys:
+                if key in self.values:
+                    continue
+                key_name = self._bind_key(key)
+                self.lines.append('if %s in %s: %s[%s] = %s' % (
+                    key_name, self.base, row, key_name,
+                    self._cast('%s[%s]' % (self.base, key_name), key)))
+
+        if self.kept_keys is None:
+            for key in self.base_casts:
+                if key in self.values:
+                    continue
+                key_name = self._bind_key(key)
+                self.lines.append('if %s in %s: %s[%s] = %s' % (
+                    key_name, row, row, key_name,
+                    self._cast('%s[%s]' % (row, key_name), key)))
+        for key, value in self.values.iteritems():
+            self.lines.append('%s[%s] = %s' % (row, self._bind_key(key), value))
+
+        self._set_base(row, is_owned=True)
+
+        return row
+
+    def _bind(self, prefix, value):
+        """
+        Bind a value to a new name in the function's namespace
+        """
+        name = '%s_%s' % (prefix, next(self.counter))
+        self.namespace[name] = value
+
+        return name
+
+    def _bind_key(self, key):
+        name = self.names.get(key)
+        if name is None:
+            name = self.names[key] = self._bind('key', key)
+
+        return name
+
+    def _new_local(self, prefix):
+        return '%s_%s' % (prefix, next(self.counter))
@@ -0,0 +1,114 @@
+import itertools
+
+
+class CompactRow(tuple):
+    """
+    A read-only, dict-like row, that keeps only it's values, and shares it's
+    keys' index with all rows with the same keys, through it's class.
+
+    It's used like a dict, eg `row[key]`, `key in row`, `row.get(key)`,
+    `row.iteritems()` and `dict(row)`, and iterating it gives it's keys. Use
+    `make_row_class` to get a class for some keys
+    """
+    __slots__ = ()
+
+    keys_tuple = ()
+    keys_index = {}
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self.keys_index[key])
+
+    def get(self, key, default=None):
+        index = self.keys_index.get(key)
+        if index is None:
+            return default
+
+        return tuple.__getitem__(self, index)
+
+    def __contains__(self, key):
+        return key in self.keys_index
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self.keys_tuple)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self.keys_tuple)
+
+    def itervalues(self):
+        return tuple.__iter__(self)
+
+    def values(self):
+        return list(tuple.__iter__(self))
+
+    def iteritems(self):
+        return itertools.izip(self.keys_tuple, tuple.__iter__(self))
+
+    def items(self):
+        return zip(self.keys_tuple, tuple.__iter__(self))
+
+    def as_dict(self):
+        return dict(self.items())
+
+    copy = as_dict
+
+    def __eq__(self, other):
+        if isinstance(other, (CompactRow, dict)):
+            return self.as_dict() == dict(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def __reduce__(self):
+        # Row classes are made at runtime, so they are pickled by their keys,
+        # which pickle only stores once per dump
+        return make_row, (self.keys_tuple, tuple(tuple.__iter__(self)))
+
+
+_row_classes = {}
+
+
+def make_row_class(keys):
+    """
+    Get the `CompactRow` class for some keys, making it the first time
+    """
+    keys = tuple(keys)
+    row_class = _row_classes.get(keys)
+    if row_class is None:
+        row_class = type('CompactRow', (CompactRow,), {
+            '__slots__': (),
+            'keys_tuple': keys,
+            'keys_index': {key: index for index, key in enumerate(keys)},
+        })
+        row_class = _row_classes.setdefault(keys, row_class)
+
+    return row_class
+
+
+def make_row(keys, values):
+    return make_row_class(keys)(values)
+
+
+def as_mapping(row):
+    """
+    Convert a compact row to a dict, for code that only accepts real dicts,
+    eg some DB drivers' named parameters. Other rows are returned as is
+    """
+    if isinstance(row, CompactRow):
+        return row.as_dict()
+
+    return row
@@ -1,8 +1,15 @@
+import os
+import sys
+import errno
+import time
+import tempfile
+import threading
 from abc import abstractmethod
 
 from sonny.infrastructure.context import helpers
 from sonny.infrastructure.operations.base import BaseOperation
-from sonny.infrastructure.operations.utils import batch
+from sonny.infrastructure.operations.sql import parse_insert_query
+from sonny.infrastructure.operations.utils import batch, IterableFile
 
 
 class BaseSaver(BaseOperation):
@@ -18,13 +25,37 @@ class BaseSaver(BaseOperation):
     def save_no_data_multiple_queries(self):
         pass
 
+    def save_record_batches(self, batches):
+        """
+        Save `columnar.RecordBatch`es, by default as a dict per row
+        """
+        return self.save(
+            row
+            for record_batch in batches
+            for row in record_batch.iterrows()
+        )
+
     def __repr__(self):
         return self.__class__.__name__
 
 
 @BaseSaver.auto_mock_for_local_testing
 class DbSaver(BaseSaver):
+    class OperationSettings(BaseSaver.OperationSettings):
+        __job_settings_name__ = 'DbSaverOperationSettings'
+        batch_size = 15000
+        """
+        How many rows to pull from the data, and send with each `executemany`
+        """
+
+    connection_options = {}
+    """
+    Extra driver-specific arguments for the connection
+    """
+
     def __init__(self, destination):
+        super(DbSaver, self).__init__()
+
         job = helpers.get_current_job()
         self.db_registry = job.db_registry
         self.destination = destination
@@ -33,8 +64,7 @@ class DbSaver(BaseSaver):
         self.multiple_queries = self._split_multiple_queries()
 
         alias = self.destination["database"]
-        self.connection = self.db_registry.create_connection_to_database(alias)
-        self.cursor = self.connection.cursor()
+        self.connector = self.db_registry.get_database_connector(alias)
 
     def _split_multiple_queries(self):
         """
@@ -46,11 +76,60 @@ class DbSaver(BaseSaver):
         """
         return filter(None, map(str.strip, self.query.split(';\n')))
 
+    def _connection(self):
+        """
+        Check out a connection to the destination from the job's pool
+        """
+        alias = self.destination["database"]
+        return self.db_registry.connection(alias, **self.connection_options)
+
     @helpers.step
     def save(self, data):
-        for batched_rows in batch(data):
-            self.cursor.executemany(self.query, batched_rows)
-        self.connection.commit()
+        batch_size = self.OperationSettings.batch_size
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            for batched_rows in batch(data, batch_size=batch_size):
+                self.connector.executemany(cursor, self.query, batched_rows)
+            connection.commit()
+
+    @helpers.step
+    def save_record_batches(self, batches):
+        """
+        Save `columnar.RecordBatch`es, passing each batch's columns to
+        `executemany` as positional rows, without making a dict per row
+        """
+        insert_query = parse_insert_query(self.query)
+        if not insert_query:
+            return super(DbSaver, self).save_record_batches(batches)
+
+        query = insert_query.positional_query
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            for record_batch in batches:
+                values = self._get_record_batch_values(insert_query, record_batch)
+                self.connector.executemany(cursor, query, values)
+            connection.commit()
+
+    def _get_record_batch_values(self, insert_query, record_batch):
+        """
+        A batch's rows as tuples, of the query's named parameters, or of all
+        the batch's columns for positional ones, which need the columns' order
+        set with `columnar.dicts_to_tuples`
+        """
+        if insert_query.is_named:
+            return record_batch.tuples(insert_query.parameters)
+
+        if not record_batch.is_ordered:
+            raise ValueError(
+                "A positional query needs the batches' columns in it's "
+                "placeholders' order, with `columnar.dicts_to_tuples`")
+        if len(record_batch.columns) != len(insert_query.parameters):
+            raise ValueError(
+                "The query has %s placeholders, but the batch has %s columns: "
+                "%r" % (len(insert_query.parameters),
+                        len(record_batch.columns), record_batch.columns))
+
+        return record_batch.tuples(record_batch.columns)
 
     @helpers.step
     def save_no_data(self):
@@ -58,9 +137,219 @@ class DbSaver(BaseSaver):
 
     @helpers.step
     def save_no_data_multiple_queries(self):
-        for query in self.multiple_queries:
-            self.cursor.execute(query, [])
-        self.connection.commit()
+        with self._connection() as connection:
+            cursor = connection.cursor()
+            for query in self.multiple_queries:
+                cursor.execute(query, [])
+            connection.commit()
+
+
+@BaseSaver.auto_mock_for_local_testing
+class BulkDbSaver(BaseSaver):
+    """
+    Save with the bulk-loading saver registered for the destination database's
+    connector, or with a plain `DbSaver` if there isn't one
+    """
+    connector_savers = {}
+
+    @classmethod
+    def register_connector_saver(cls, connector_name):
+        """
+        Register a bulk-loading saver, for a specific database connector
+        """
+        def decorator(saver_class):
+            cls.connector_savers[connector_name] = saver_class
+
+            return saver_class
+
+        return decorator
+
+    def __init__(self, destination):
+        job = helpers.get_current_job()
+        database = job.db_registry.get_database(destination['database'])
+        saver_class = self.connector_savers.get(
+            database['connector_name'], DbSaver)
+        self.saver = saver_class(destination)
+
+    def save(self, data):
+        return self.saver.save(data)
+
+    def save_record_batches(self, batches):
+        return self.saver.save_record_batches(batches)
+
+    def save_no_data(self):
+        return self.saver.save_no_data()
+
+    def save_no_data_multiple_queries(self):
+        return self.saver.save_no_data_multiple_queries()
+
+
+class BaseBulkDbSaver(DbSaver):
+    """
+    A `DbSaver` that streams the rows of a plain
+    `INSERT INTO table (columns) VALUES (placeholders)` query through the
+    driver's bulk-loading path, as tab-separated text. Any other query is saved
+    with `executemany`
+    """
+    NULL = '\\N'
+    TRUE = 't'
+    FALSE = 'f'
+    ESCAPES = [
+        ('\\', '\\\\'),
+        ('\t', '\\t'),
+        ('\n', '\\n'),
+        ('\r', '\\r'),
+    ]
+
+    def __init__(self, destination):
+        super(BaseBulkDbSaver, self).__init__(destination)
+
+        self.insert_query = parse_insert_query(self.query)
+        self.table_and_columns = \
+            self.insert_query and self.insert_query.table_and_columns()
+
+    @helpers.step
+    def save(self, data):
+        if not self.table_and_columns:
+            helpers.get_current_job().logger.debug(
+                "Query in %s is not a plain INSERT, using executemany",
+                self.destination['file'])
+            return super(BaseBulkDbSaver, self).save(data)
+
+        table, columns = self.table_and_columns
+        lines = (
+            self._format_row(self.insert_query.row_values(row))
+            for row in data
+        )
+        with self._connection() as connection:
+            self._bulk_load(connection.cursor(), table, columns, lines)
+            connection.commit()
+
+    @helpers.step
+    def save_record_batches(self, batches):
+        if not self.table_and_columns:
+            return super(BaseBulkDbSaver, self).save_record_batches(batches)
+
+        table, columns = self.table_and_columns
+        lines = (
+            self._format_row(values)
+            for record_batch in batches
+            for values in self._get_record_batch_values(
+                self.insert_query, record_batch)
+        )
+        with self._connection() as connection:
+            self._bulk_load(connection.cursor(), table, columns, lines)
+            connection.commit()
+
+    @abstractmethod
+    def _bulk_load(self, cursor, table, columns, lines):
+        pass
+
+    def _format_row(self, values):
+        return '\t'.join(map(self._format_value, values)) + '\n'
+
+    def _format_value(self, value):
+        if value is None:
+            return self.NULL
+        if isinstance(value, bool):
+            return self.TRUE if value else self.FALSE
+
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif isinstance(value, float):
+            value = repr(value)
+        elif isinstance(value, time.struct_time):
+            value = time.strftime('%Y-%m-%d %H:%M:%S', value)
+        elif not isinstance(value, str):
+            value = str(value)
+
+        for char, escaped in self.ESCAPES:
+            value = value.replace(char, escaped)
+
+        return value
+
+
+@BulkDbSaver.register_connector_saver('Postgres')
+@BaseSaver.auto_mock_for_local_testing
+class PostgresCopySaver(BaseBulkDbSaver):
+    """
+    Bulk load with `COPY ... FROM STDIN`
+    """
+    COPY_QUERY = "COPY %s (%s) FROM STDIN WITH (FORMAT text, ENCODING 'UTF8')"
+
+    def _bulk_load(self, cursor, table, columns, lines):
+        query = self.COPY_QUERY % (table, ', '.join(columns))
+        cursor.copy_expert(query, IterableFile(lines))
+
+
+@BulkDbSaver.register_connector_saver('MySql')
+@BaseSaver.auto_mock_for_local_testing
+class MySqlLoadDataSaver(BaseBulkDbSaver):
+    """
+    Bulk load with `LOAD DATA LOCAL INFILE`, streaming the rows through a named
+    pipe, so that they are never written to disk. The server needs to have
+    `local_infile` enabled
+    """
+    TRUE = '1'
+    FALSE = '0'
+    LOAD_DATA_QUERY = (
+        "LOAD DATA LOCAL INFILE %%s INTO TABLE %s CHARACTER SET utf8 "
+        "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+        "LINES TERMINATED BY '\\n' (%s)"
+    )
+
+    connection_options = {'local_infile': 1}
+
+    def _bulk_load(self, cursor, table, columns, lines):
+        query = self.LOAD_DATA_QUERY % (table, ', '.join(columns))
+        with NamedPipeContextManager(lines) as filename:
+            cursor.execute(query, (filename,))
+
+
+class NamedPipeContextManager(object):
+    """
+    Manage a temporary named pipe, that a background thread writes the lines
+    to, for APIs that only read from a filename
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.exc_info = None
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'data')
+        os.mkfifo(self.filename)
+        self.thread = threading.Thread(target=self._write_lines)
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.filename
+
+    def _write_lines(self):
+        try:
+            with open(self.filename, 'wb') as _file:
+                for line in self.lines:
+                    _file.write(line)
+        except IOError, e:
+            # The reader stopped reading, and it should report why
+            if e.errno != errno.EPIPE:
+                self.exc_info = sys.exc_info()
+        except Exception:
+            self.exc_info = sys.exc_info()
+
+    def __exit__(self, _type, value, traceback):
+        # If the reader never opened the pipe, or stopped reading early, open
+        # and close it ourselves, so that the writer stops blocking
+        while self.thread.is_alive():
+            fd = os.open(self.filename, os.O_RDONLY | os.O_NONBLOCK)
+            self.thread.join(0.1)
+            os.close(fd)
+        os.remove(self.filename)
+        os.rmdir(self.directory)
+
+        if _type is None and self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
 
 
 @BaseSaver.register_default_noop
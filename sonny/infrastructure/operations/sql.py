@@ -0,0 +1,162 @@
+import re
+from collections import namedtuple
+
+
+VALUES_REGEX = re.compile(r'\bVALUES\s*\(', re.IGNORECASE)
+PLACEHOLDER_REGEX = re.compile(r'%\((?P<name>[^)]+)\)s|%(?P<positional>s)|%%')
+PLAIN_PLACEHOLDER_REGEX = re.compile(r'^\s*(%\([^)]+\)s|%s)\s*$')
+PLAIN_INSERT_PREFIX_REGEX = re.compile(
+    r'^\s*INSERT\s+INTO\s+(?P<table>[^\s(]+)\s*\((?P<columns>[^)]*)\)\s*$',
+    re.IGNORECASE)
+UPDATE_REGEX = re.compile(r'\bUPDATE\b', re.IGNORECASE)
+QUOTES = '\'"`'
+
+
+class InsertQuery(namedtuple('InsertQuery', [
+        'prefix', 'values_template', 'suffix', 'parameters'])):
+    """
+    A single-row `INSERT ... VALUES (...)` query, split around it's VALUES row:
+
+    * prefix: everything up to, and including, the `VALUES` keyword
+    * values_template: the parenthesised row, with it's placeholders
+    * suffix: anything after the row, eg `ON CONFLICT DO NOTHING`
+    * parameters: the placeholders' names in order, or `None` for each `%s`
+    """
+
+    @property
+    def is_named(self):
+        return bool(self.parameters) and None not in self.parameters
+
+    @property
+    def is_upsert(self):
+        """
+        Whether the query updates existing rows, eg with `ON CONFLICT ... DO
+        UPDATE` or `ON DUPLICATE KEY UPDATE`. In a multi-row version of it, two
+        rows with the same key would conflict with each other, which on
+        Postgres is an error
+        """
+        return bool(UPDATE_REGEX.search(self.suffix))
+
+    def row_values(self, row):
+        """
+        The values of a data row, in placeholders' order
+        """
+        if self.is_named:
+            return tuple(row[name] for name in self.parameters)
+
+        return tuple(row)
+
+    @property
+    def positional_values_template(self):
+        """
+        The values template, with any named placeholders made positional
+        """
+        return PLACEHOLDER_REGEX.sub(
+            lambda match: '%%' if match.group() == '%%' else '%s',
+            self.values_template)
+
+    @property
+    def positional_query(self):
+        """
+        The single-row query, with any named placeholders made positional
+        """
+        return ('%s %s %s' % (
+            self.prefix, self.positional_values_template, self.suffix)).rstrip()
+
+    def multirow(self, rows):
+        """
+        A multi-row version of the query for the rows, and it's flattened
+        parameters
+        """
+        values_template = self.positional_values_template
+        query = '%s %s %s' % (
+            self.prefix, ', '.join([values_template] * len(rows)), self.suffix)
+        values = tuple(
+            value
+            for row in rows
+            for value in self.row_values(row)
+        )
+
+        return query.rstrip(), values
+
+    def table_and_columns(self):
+        """
+        The table and columns inserted to, if the query is a plain
+        `INSERT INTO table (columns) VALUES (placeholders)`, else `None`
+        """
+        if self.suffix:
+            return None
+        match = PLAIN_INSERT_PREFIX_REGEX.match(self.prefix[:-len('VALUES')])
+        if not match:
+            return None
+        columns = [column.strip() for column in match.group('columns').split(',')]
+        if len(columns) != len(self.parameters):
+            return None
+        placeholders = self.values_template[1:-1].split(',')
+        if not all(PLAIN_PLACEHOLDER_REGEX.match(placeholder)
+                   for placeholder in placeholders):
+            return None
+
+        return match.group('table'), columns
+
+
+def parse_insert_query(query):
+    """
+    Split a single-row INSERT query around it's VALUES row, or return `None` if
+    it isn't one
+    """
+    query = query.strip().rstrip(';').rstrip()
+    match = VALUES_REGEX.search(query)
+    if not match:
+        return None
+
+    values_start = match.end() - 1
+    values_end = _find_closing_parenthesis(query, values_start)
+    if values_end is None:
+        return None
+
+    prefix = query[:match.start()] + 'VALUES'
+    values_template = query[values_start:values_end + 1]
+    suffix = query[values_end + 1:].strip()
+    if suffix.startswith(','):
+        # Already a multi-row query
+        return None
+    if _get_parameters(prefix) or _get_parameters(suffix):
+        return None
+
+    parameters = _get_parameters(values_template)
+    if not parameters:
+        return None
+    if None in parameters and any(parameters):
+        # Mixed named and positional placeholders
+        return None
+
+    return InsertQuery(prefix, values_template, suffix, tuple(parameters))
+
+
+def _get_parameters(sql):
+    return [
+        match.group('name')
+        for match in PLACEHOLDER_REGEX.finditer(sql)
+        if match.group() != '%%'
+    ]
+
+
+def _find_closing_parenthesis(sql, start):
+    depth = 0
+    quote = None
+    for index in xrange(start, len(sql)):
+        char = sql[index]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in QUOTES:
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return index
+
+    return None
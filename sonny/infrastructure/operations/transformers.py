@@ -2,6 +2,11 @@ import itertools
 
 from sonny.infrastructure.context import helpers
 
+from sonny.infrastructure.operations.row_functions import (
+    RowTransform, compile_row_function)
+from sonny.infrastructure.operations.utils import (
+    background_iterator, ReplayableIterable)
+
 
 def keep_keys(keys):
     """
@@ -19,6 +24,7 @@ def keep_keys(keys):
             for _input in inputs
         )
 
+    do_keep_keys.row_transform = RowTransform('keep_keys', keys)
     return do_keep_keys
 
 
@@ -38,6 +44,7 @@ def dicts_to_tuples(keys):
             for _input in inputs
         )
 
+    do_dicts_to_tuples.row_transform = RowTransform('dicts_to_tuples', keys)
     return do_dicts_to_tuples
 
 
@@ -66,6 +73,8 @@ def cast_dicts_values(keys_casts):
             for _input in inputs
         )
 
+    do_cast_dicts_values.row_transform = \
+        RowTransform('cast_dicts_values', keys_casts)
     return do_cast_dicts_values
 
 
@@ -78,6 +87,7 @@ def generic_map(func):
     def do_generic_map(inputs):
         return itertools.imap(func, inputs)
 
+    do_generic_map.row_transform = RowTransform('generic_map', func)
     return do_generic_map
 
 
@@ -94,7 +104,11 @@ def update_with_static_values(static_values):
     def update_with_static_values_for_input(_input):
         return dict(_input.items() + static_values_items)
 
-    return generic_map(update_with_static_values_for_input)
+    do_update_with_static_values = \
+        generic_map(update_with_static_values_for_input)
+    do_update_with_static_values.row_transform = \
+        RowTransform('update_with_static_values', static_values)
+    return do_update_with_static_values
 
 
 def update_with_dynamic_values(dynamic_values):
@@ -116,7 +130,11 @@ def update_with_dynamic_values(dynamic_values):
 
         return updated
 
-    return generic_map(update_with_static_values_for_input)
+    do_update_with_dynamic_values = \
+        generic_map(update_with_static_values_for_input)
+    do_update_with_dynamic_values.row_transform = \
+        RowTransform('update_with_dynamic_values', dynamic_values)
+    return do_update_with_dynamic_values
 
 
 def generator_to_tuples():
@@ -131,3 +149,72 @@ def generator_to_tuples():
         return tuple(inputs)
 
     return do_generator_to_tuples
+
+
+def generator_to_replayable(batch_size=1000):
+    """
+    Consume a generator into a temporary file, that can be iterated multiple
+    times, without holding it all in memory. Use the result as a context
+    manager, to delete the file when done
+    """
+
+    @helpers.step
+    def do_generator_to_replayable(inputs):
+        return ReplayableIterable(inputs, batch_size=batch_size)
+
+    return do_generator_to_replayable
+
+
+def in_background_thread(queue_size=10, batch_size=1000):
+    """
+    Consume a generator in a background thread, in batches through a bounded
+    queue, so that producing (eg loading, transforming) and consuming (eg
+    saving) the data run concurrently
+    """
+
+    @helpers.step
+    def do_in_background_thread(inputs):
+        return background_iterator(
+            inputs, queue_size=queue_size, batch_size=batch_size)
+
+    return do_in_background_thread
+
+
+def pipeline(*transformers):
+    """
+    Chain transformers in a single step. Consecutive row transformers, from
+    this module's factories, are compiled to a single function per row, that
+    makes one output per row, instead of a new dict, and a generator, per
+    transformer. Any other transformer is chained as is
+    """
+    stages = []
+    row_transforms = []
+    for transformer in transformers:
+        row_transform = getattr(transformer, 'row_transform', None)
+        if row_transform:
+            row_transforms.append(row_transform)
+            continue
+
+        if row_transforms:
+            stages.append(_map_rows(compile_row_function(row_transforms)))
+            row_transforms = []
+        stages.append(transformer)
+    if row_transforms:
+        stages.append(_map_rows(compile_row_function(row_transforms)))
+
+    @helpers.step
+    def do_pipeline(inputs):
+        for stage in stages:
+            inputs = stage(inputs)
+
+        return inputs
+
+    return do_pipeline
+
+
+def _map_rows(row_function):
+    def map_rows(inputs):
+        return itertools.imap(row_function, inputs)
+
+    map_rows.row_function = row_function
+    return map_rows
@@ -1,7 +1,163 @@
+import os
+import sys
+import Queue
+import cPickle
+import itertools
+import tempfile
+import threading
+
+from sonny.infrastructure.context import helpers
 
 
 def batch(iterable, batch_size=15000):
-    data_list = list(iterable)
-    data_size = len(data_list)
-    for slice_size in range(0, data_size, batch_size):
-        yield data_list[slice_size:min(slice_size + batch_size, data_size)]
+    """
+    Split an iterable in lists of `batch_size` items, pulling only one batch
+    at a time, so that memory stays flat however long the iterable is
+    """
+    iterator = iter(iterable)
+    while True:
+        batched = list(itertools.islice(iterator, batch_size))
+        if not batched:
+            return
+        yield batched
+
+
+def background_iterator(iterable, queue_size=10, batch_size=1000):
+    """
+    Iterate an iterable in a background thread, that puts batches of items in
+    a bounded queue, so that producing items overlaps with consuming them,
+    without getting too far ahead of it.
+
+    Any exception raised while producing is re-raised while consuming. As the
+    iterable runs in another thread, any steps it calls, eg of lazy loaders and
+    transformers, run as plain calls, and anything they count on the profiler
+    is added to the consuming thread's current step
+    """
+    queue = Queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        helpers.disable_steps_in_thread()
+        try:
+            for batched in batch(iterable, batch_size=batch_size):
+                if not put(('items', batched)):
+                    return
+        except Exception:
+            put(('error', sys.exc_info()))
+        else:
+            put(('done', None))
+
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            kind, value = queue.get()
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise value[0], value[1], value[2]
+            for item in value:
+                yield item
+    finally:
+        # Stop the producer, if we stopped consuming early
+        stopped.set()
+        thread.join()
+
+
+class IterableFile(object):
+    """
+    A read-only file-like object over an iterable of strings, for APIs that
+    want to `read` from a file, without having to write the data to one
+    """
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            try:
+                chunk = next(self.iterator)
+            except StopIteration:
+                break
+            chunks.append(chunk)
+            length += len(chunk)
+
+        data = ''.join(chunks)
+        if size < 0:
+            self.buffer = ''
+            return data
+
+        self.buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        while '\n' not in self.buffer:
+            try:
+                self.buffer += next(self.iterator)
+            except StopIteration:
+                break
+
+        end = self.buffer.find('\n') + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+
+        return line
+
+
+class ReplayableIterable(object):
+    """
+    Consume an iterable once, into a temporary file of pickled batches, so
+    that it can be iterated multiple times, while holding only a batch of it
+    in memory at a time.
+
+    Should be used as a context manager, to delete the file when done:
+
+    with ReplayableIterable(data) as replayable:
+        for first_pass in replayable: pass
+        for second_pass in replayable: pass
+    """
+
+    def __init__(self, iterable, batch_size=1000):
+        fd, self.filename = tempfile.mkstemp(suffix='.rows')
+        try:
+            with os.fdopen(fd, 'wb') as _file:
+                for batched in batch(iterable, batch_size=batch_size):
+                    cPickle.dump(batched, _file, cPickle.HIGHEST_PROTOCOL)
+        except:
+            self.close()
+            raise
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as _file:
+            while True:
+                try:
+                    batched = cPickle.load(_file)
+                except EOFError:
+                    return
+                for item in batched:
+                    yield item
+
+    def close(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _type, value, traceback):
+        self.close()
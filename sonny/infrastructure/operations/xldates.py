@@ -0,0 +1,29 @@
+import datetime
+
+import xlrd
+
+
+class XldateConverter(object):
+    """
+    Convert Excel date serials to datetimes, like `xlrd.xldate_as_tuple`,
+    remembering each serial's datetime, as sheets repeat the same dates over
+    and over
+    """
+    max_size = 100000
+    """
+    How many datetimes to remember, before forgetting them all
+    """
+
+    def __init__(self, datemode):
+        self.datemode = datemode
+        self.datetimes = {}
+
+    def __call__(self, value):
+        _datetime = self.datetimes.get(value)
+        if _datetime is None:
+            if len(self.datetimes) >= self.max_size:
+                self.datetimes.clear()
+            date_tuple = xlrd.xldate_as_tuple(value, self.datemode)
+            _datetime = self.datetimes[value] = datetime.datetime(*date_tuple)
+
+        return _datetime
@@ -0,0 +1,289 @@
+"""
+Streaming parsing of XLSX workbooks' parts, with iterparse, for loaders that
+can't keep a whole workbook in memory
+"""
+import re
+import posixpath
+from collections import namedtuple
+from xml.etree import cElementTree
+
+import xlrd
+from xlrd.xlsx import error_code_from_text
+
+from sonny.infrastructure.operations.xldates import XldateConverter
+
+
+SPREADSHEETML = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIPS = \
+    '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+WORKBOOK = 'xl/workbook.xml'
+WORKBOOK_RELATIONSHIPS = 'xl/_rels/workbook.xml.rels'
+SHARED_STRINGS = 'xl/sharedStrings.xml'
+STYLES = 'xl/styles.xml'
+
+ROW_TAG = SPREADSHEETML + 'row'
+CELL_TAG = SPREADSHEETML + 'c'
+VALUE_TAG = SPREADSHEETML + 'v'
+INLINE_STRING_TAG = SPREADSHEETML + 'is'
+TEXT_TAG = SPREADSHEETML + 't'
+PHONETIC_TAG = SPREADSHEETML + 'rPh'
+SHEET_DATA_TAG = SPREADSHEETML + 'sheetData'
+DIMENSION_TAG = SPREADSHEETML + 'dimension'
+
+CELL_REFERENCE_REGEX = re.compile(r'^\$?([A-Z]+)')
+DATE_FORMAT_IDS = set(range(14, 23) + range(27, 37) + range(45, 48) +
+                      range(50, 59) + range(71, 82))
+"""
+Excel's built-in date and time number formats
+"""
+DATE_FORMAT_CODE_REGEX = re.compile(r'[ymdhs]', re.IGNORECASE)
+FORMAT_CODE_LITERALS_REGEX = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.|_.|\*.')
+
+
+class Sheet(namedtuple('Sheet', ['name', 'path'])):
+    """
+    A workbook's sheet:
+
+    * name: the sheet's name, as shown in it's tab
+    * path: the sheet's XML part in the archive
+    """
+
+
+class Workbook(object):
+    """
+    An open XLSX archive's shared parts: it's sheets, shared strings, date
+    styles and date mode. Sheets' rows are parsed lazily, with `iter_rows`
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        # Parts' names are case-insensitive
+        self.part_names = {
+            name.lower(): name
+            for name in archive.namelist()
+        }
+        self.sheets, self.datemode = self._parse_workbook()
+        self.to_datetime = XldateConverter(self.datemode)
+        self.shared_strings = self._parse_shared_strings()
+        self.date_styles = self._parse_date_styles()
+
+    def open_part(self, path):
+        return self.archive.open(self.part_names[path.lower()])
+
+    def has_part(self, path):
+        return path.lower() in self.part_names
+
+    def get_sheet(self, sheet_index_or_name):
+        if isinstance(sheet_index_or_name, basestring):
+            for sheet in self.sheets:
+                if sheet.name == sheet_index_or_name:
+                    return sheet
+            raise xlrd.XLRDError(
+                "No sheet named <%r>" % sheet_index_or_name)
+
+        return self.sheets[sheet_index_or_name]
+
+    def get_first_used_column_index(self, sheet):
+        """
+        The first column of the sheet's used range, from it's `dimension`,
+        which is before the sheet's data, or `None` if it doesn't have one.
+        The used range includes formatted empty cells, so the first non-empty
+        column may be after it
+        """
+        with self.open_part(sheet.path) as _file:
+            for _, element in cElementTree.iterparse(_file, events=('start',)):
+                if element.tag == DIMENSION_TAG:
+                    return get_column_index(element.get('ref'))
+                if element.tag == SHEET_DATA_TAG:
+                    return None
+
+        return None
+
+    def iter_rows(self, sheet):
+        """
+        Yield each row that has a value, as it's index and a list of it's
+        non-empty cells' `(column index, value)`. Dates are converted to
+        datetimes, and rows are dropped from memory once parsed
+        """
+        with self.open_part(sheet.path) as _file:
+            events = cElementTree.iterparse(_file, events=('start', 'end'))
+            sheet_data = None
+            row_index = -1
+            for event, element in events:
+                if event == 'start':
+                    if element.tag == SHEET_DATA_TAG:
+                        sheet_data = element
+                    continue
+                if element.tag != ROW_TAG:
+                    continue
+
+                row_number = element.get('r')
+                row_index = int(row_number) - 1 if row_number else row_index + 1
+                cells = self._get_row_cells(element)
+                if sheet_data is not None:
+                    sheet_data.clear()
+                if cells:
+                    yield row_index, cells
+
+    def _get_row_cells(self, row):
+        cells = []
+        column_index = -1
+        for cell in row.iter(CELL_TAG):
+            reference = cell.get('r')
+            if reference:
+                column_index = get_column_index(reference)
+            else:
+                column_index += 1
+
+            value = self._get_cell_value(cell)
+            if value is not None:
+                cells.append((column_index, value))
+
+        return cells
+
+    def _get_cell_value(self, cell):
+        cell_type = cell.get('t', 'n')
+        if cell_type == 'inlineStr':
+            inline_string = cell.find(INLINE_STRING_TAG)
+            if inline_string is None:
+                return None
+            return _get_text(inline_string)
+
+        value = cell.findtext(VALUE_TAG)
+        if value is None or (value == '' and cell_type != 'str'):
+            return None
+
+        if cell_type == 'n':
+            value = float(value)
+            if int(cell.get('s', '0')) in self.date_styles:
+                return self.to_datetime(value)
+            return value
+        if cell_type == 's':
+            return self.shared_strings[int(value)]
+        if cell_type == 'b':
+            return int(value)
+        if cell_type == 'e':
+            return error_code_from_text.get(value, value)
+
+        return value
+
+    def _parse_workbook(self):
+        relationships = {}
+        with self.open_part(WORKBOOK_RELATIONSHIPS) as _file:
+            for element in cElementTree.parse(_file).getroot():
+                target = element.get('Target')
+                if target.startswith('/'):
+                    target = target[1:]
+                else:
+                    target = posixpath.normpath(posixpath.join('xl', target))
+                relationships[element.get('Id')] = target
+
+        with self.open_part(WORKBOOK) as _file:
+            root = cElementTree.parse(_file).getroot()
+
+        sheets = [
+            Sheet(element.get('name'),
+                  relationships[element.get(RELATIONSHIPS + 'id')])
+            for element in root.iter(SPREADSHEETML + 'sheet')
+        ]
+        properties = root.find(SPREADSHEETML + 'workbookPr')
+        datemode = 0
+        if properties is not None \
+                and properties.get('date1904', '').lower() in ('1', 'true'):
+            datemode = 1
+
+        return sheets, datemode
+
+    def _parse_shared_strings(self):
+        if not self.has_part(SHARED_STRINGS):
+            return []
+
+        shared_strings = []
+        with self.open_part(SHARED_STRINGS) as _file:
+            for _, element in cElementTree.iterparse(_file):
+                if element.tag == SPREADSHEETML + 'si':
+                    shared_strings.append(_get_text(element))
+                    element.clear()
+
+        return shared_strings
+
+    def _parse_date_styles(self):
+        """
+        The indexes of the cell styles that format numbers as dates
+        """
+        if not self.has_part(STYLES):
+            return set()
+
+        with self.open_part(STYLES) as _file:
+            root = cElementTree.parse(_file).getroot()
+
+        date_format_ids = set(DATE_FORMAT_IDS)
+        for number_format in root.iter(SPREADSHEETML + 'numFmt'):
+            format_id = int(number_format.get('numFmtId'))
+            if is_date_format_code(number_format.get('formatCode', '')):
+                date_format_ids.add(format_id)
+            else:
+                date_format_ids.discard(format_id)
+
+        cell_styles = root.find(SPREADSHEETML + 'cellXfs')
+        if cell_styles is None:
+            return set()
+
+        return {
+            index
+            for index, cell_style in enumerate(cell_styles)
+            if int(cell_style.get('numFmtId', '0')) in date_format_ids
+        }
+
+
+def count_sheets(archive):
+    """
+    Count an open XLSX archive's sheets, from it's workbook part only, without
+    parsing it's shared strings and styles, like `Workbook` does
+    """
+    part_names = {
+        name.lower(): name
+        for name in archive.namelist()
+    }
+    with archive.open(part_names[WORKBOOK]) as _file:
+        return sum(
+            1
+            for _, element in cElementTree.iterparse(_file)
+            if element.tag == SPREADSHEETML + 'sheet'
+        )
+
+
+def get_column_index(reference):
+    """
+    A cell reference's 0-based column index, eg 0 for `A1` and 27 for `AB3`
+    """
+    column_index = 0
+    for letter in CELL_REFERENCE_REGEX.match(reference).group(1):
+        column_index = column_index * 26 + ord(letter) - ord('A') + 1
+
+    return column_index - 1
+
+
+def is_date_format_code(format_code):
+    """
+    Whether a number format shows dates or times, by it's date and time
+    codes, outside of literals, colours and conditions
+    """
+    format_code = FORMAT_CODE_LITERALS_REGEX.sub('', format_code)
+    return bool(DATE_FORMAT_CODE_REGEX.search(format_code))
+
+
+def _get_text(element):
+    """
+    The text of a shared or inline string, joining it's rich text runs, and
+    leaving out phonetic hints
+    """
+    texts = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            texts.append(child.text or u'')
+        elif child.tag != PHONETIC_TAG:
+            texts.extend(text.text or u'' for text in child.iter(TEXT_TAG))
+
+    return u''.join(texts)
@@ -0,0 +1,89 @@
+import itertools
+import unittest
+
+from sonny.infrastructure.facilities.connection_pool import (
+    ConnectionPool, ConnectionPoolExhausted)
+
+
+class FakeConnection(object):
+    def __init__(self, key, number):
+        self.key = key
+        self.number = number
+        self.alive = True
+        self.closed = False
+        self.resets = 0
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.numbers = itertools.count()
+        self.pool = ConnectionPool(
+            lambda key: FakeConnection(key, next(self.numbers)),
+            lambda key, connection: setattr(connection, 'closed', True),
+            is_connection_alive=lambda key, connection: connection.alive,
+            reset_connection=self.reset_connection,
+            max_size=2,
+            timeout=0,
+        )
+
+    def reset_connection(self, key, connection):
+        connection.resets += 1
+
+    def test_connection_is_reused(self):
+        with self.pool.connection('a') as first:
+            pass
+        with self.pool.connection('a') as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEquals(first.resets, 2)
+
+    def test_connections_are_per_key(self):
+        with self.pool.connection('a') as first:
+            pass
+        with self.pool.connection('b') as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertEquals(second.key, 'b')
+
+    def test_dead_connection_is_replaced(self):
+        with self.pool.connection('a') as first:
+            pass
+        first.alive = False
+        with self.pool.connection('a') as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_connection_is_discarded_on_exception(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection('a') as first:
+                raise ValueError()
+        with self.pool.connection('a') as second:
+            pass
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+
+    def test_max_size(self):
+        with self.pool.connection('a'):
+            with self.pool.connection('a'):
+                with self.assertRaises(ConnectionPoolExhausted):
+                    with self.pool.connection('a'):
+                        pass
+                with self.pool.connection('b'):
+                    pass
+
+    def test_close_all(self):
+        with self.pool.connection('a') as first:
+            with self.pool.connection('b') as second:
+                pass
+        self.pool.close_all()
+
+        self.assertTrue(first.closed)
+        self.assertTrue(second.closed)
+        with self.pool.connection('a') as third:
+            pass
+        self.assertIsNot(first, third)
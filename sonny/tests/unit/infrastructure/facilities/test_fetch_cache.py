@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sonny.import_jobs.base import Importer
+from sonny.infrastructure.facilities.fetch_cache import FetchCache
+
+from sonny.infrastructure.context import helpers
+
+
+class ImporterToTestFetchCache(Importer):
+    uuid = 'b0e5c4a2-5d3e-4f0b-9a57-3c7f1d2e8a61'
+
+    class JobSettings(Importer.JobSettings):
+        class FetchCacheFacilitySettings(FetchCache.FacilitySettings):
+            enabled = True
+            directory = None
+            max_bytes = 10
+
+    @helpers.step
+    def do_run(self):
+        fetch_cache = helpers.get_current_job().fetch_cache
+        self.missing = fetch_cache.get('missing')
+
+        _, local_filename = tempfile.mkstemp()
+        with open(local_filename, 'wb') as local_file:
+            local_file.write('contents')
+        fetch_cache.put('key', local_filename)
+        os.remove(local_filename)
+        self.cached_filename = fetch_cache.get('key', suffix='-file.csv')
+        with open(self.cached_filename, 'rb') as cached_file:
+            self.cached_contents = cached_file.read()
+
+        fetch_cache.put_index('index', ['a', 'b'])
+        self.index = fetch_cache.get_index('index')
+
+        # Being written by another thread, so not evicted
+        _, self.temporary_filename = tempfile.mkstemp(
+            dir=fetch_cache.directory, suffix='.tmp')
+        with open(self.temporary_filename, 'wb') as temporary_file:
+            temporary_file.write('other thread contents')
+
+        # Over `max_bytes`, so 'key' is evicted
+        _, local_filename = tempfile.mkstemp()
+        with open(local_filename, 'wb') as local_file:
+            local_file.write('other contents')
+        fetch_cache.put('other key', local_filename)
+        os.remove(local_filename)
+        self.evicted = fetch_cache.get('key')
+        self.uncounted = fetch_cache.get('missing', count=False)
+        self.counters = dict(
+            helpers.get_current_job().profiler.profiling_section.counters)
+
+
+class TestFetchCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        ImporterToTestFetchCache.JobSettings.FetchCacheFacilitySettings\
+            .directory = self.directory
+        self.importer = ImporterToTestFetchCache()
+        self.importer.test_import()
+
+    def test_missing_file(self):
+        self.assertIsNone(self.importer.missing)
+
+    def test_cached_file(self):
+        self.assertEquals(self.importer.cached_contents, 'contents')
+        self.assertTrue(self.importer.cached_filename.endswith('-file.csv'))
+
+    def test_index(self):
+        self.assertEquals(self.importer.index, ['a', 'b'])
+
+    def test_least_recently_used_is_evicted(self):
+        self.assertIsNone(self.importer.evicted)
+
+    def test_temporary_files_are_not_evicted(self):
+        self.assertTrue(os.path.isfile(self.importer.temporary_filename))
+
+    def test_lookups_are_counted_once(self):
+        self.assertEquals(self.importer.counters,
+                          {'fetch_cache_hits': 2, 'fetch_cache_misses': 2})
+
+    def tearDown(self):
+        os.remove(self.importer.cached_filename)
+        shutil.rmtree(self.directory)
@@ -0,0 +1,158 @@
+import socket
+import unittest
+
+from sonny.infrastructure.context import helpers
+from sonny.infrastructure.facilities import ftp_registry
+from sonny.infrastructure.facilities.ftp_registry import FtpRegistry
+from sonny.infrastructure.operations.fetchers import FtpContextManager
+
+
+class FakeFtp(object):
+    """
+    A fake FTP session, that records the commands sent to it
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.alive = True
+        self.closed = False
+        self.directory = '/home'
+        self.commands = []
+
+    def connect(self, server):
+        self.commands.append('CONNECT %s' % server)
+        self.alive = True
+        self.closed = False
+
+    def login(self, username, password):
+        self.commands.append('USER %s' % username)
+
+    def pwd(self):
+        return self.directory
+
+    def cwd(self, directory):
+        self.commands.append('CWD %s' % directory)
+        self.directory = directory
+
+    def voidcmd(self, command):
+        self.commands.append(command)
+        if not self.alive:
+            raise socket.error("Connection reset by peer")
+
+    def quit(self):
+        self.commands.append('QUIT')
+
+    def close(self):
+        self.closed = True
+
+
+class FakeJob(object):
+    class config(object):
+        ftp_registry = {
+            'source': {
+                'server': 'ftp.example.com',
+                'username': 'username',
+                'password': 'password',
+            },
+        }
+
+
+class FtpRegistrySettings(FtpRegistry.FacilitySettings):
+    keepalive_after_idle = 0
+
+
+class TestFtpRegistry(unittest.TestCase):
+    def setUp(self):
+        self.ftps = []
+        self.FTP = ftp_registry.FTP
+        ftp_registry.FTP = self.create_ftp
+
+        self.job = FakeJob()
+        self.registry = FtpRegistry()
+        self.registry.enter_job(self.job, FtpRegistrySettings)
+
+    def create_ftp(self, server):
+        ftp = FakeFtp(server)
+        self.ftps.append(ftp)
+
+        return ftp
+
+    def test_session_is_reused(self):
+        first = self.registry.checkout_session('source')
+        self.registry.checkin_session('source', first)
+        second = self.registry.checkout_session('source')
+
+        self.assertIs(first, second)
+        self.assertEquals(len(self.ftps), 1)
+        self.assertEquals(first.server, 'ftp.example.com')
+        self.assertIn('NOOP', second.commands)
+
+    def test_dead_session_is_replaced(self):
+        first = self.registry.checkout_session('source')
+        self.registry.checkin_session('source', first)
+        first.alive = False
+
+        second = self.registry.checkout_session('source')
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        self.assertEquals(len(self.ftps), 2)
+
+    def test_reconnect_session(self):
+        ftp = self.registry.checkout_session('source')
+        ftp.alive = False
+
+        self.registry.reconnect_session('source', ftp)
+
+        self.assertTrue(ftp.alive)
+        self.assertEquals(ftp.commands[-2:],
+                          ['CONNECT ftp.example.com', 'USER username'])
+
+    def test_cwd_is_reset_on_checkin(self):
+        ftp = self.registry.checkout_session('source')
+        ftp.cwd('some/directory')
+
+        self.registry.checkin_session('source', ftp)
+
+        self.assertEquals(ftp.pwd(), '/home')
+
+    def test_session_is_discarded(self):
+        first = self.registry.checkout_session('source')
+        self.registry.discard_session('source', first)
+        second = self.registry.checkout_session('source')
+
+        self.assertIsNot(first, second)
+        self.assertTrue(first.closed)
+        self.assertIn('QUIT', first.commands)
+
+    @helpers.job
+    def test_session_is_discarded_when_the_caller_raises(self, job):
+        job.ftp_registry.get_ftp_server = \
+            lambda alias: FakeJob.config.ftp_registry[alias]
+
+        with self.assertRaises(ValueError):
+            with FtpContextManager('source') as first:
+                raise ValueError()
+        with FtpContextManager('source') as second:
+            pass
+        with FtpContextManager('source') as third:
+            pass
+
+        self.assertTrue(first.closed)
+        self.assertIsNot(first, second)
+        self.assertIs(second, third)
+
+    def test_sessions_are_closed_on_exit_job(self):
+        first = self.registry.checkout_session('source')
+        second = self.registry.checkout_session('source')
+        self.registry.checkin_session('source', first)
+        self.registry.checkin_session('source', second)
+
+        self.registry.exit_job(self.job, None, None, None)
+
+        self.assertTrue(first.closed)
+        self.assertTrue(second.closed)
+        self.assertEquals(len(self.ftps), 2)
+
+    def tearDown(self):
+        ftp_registry.FTP = self.FTP
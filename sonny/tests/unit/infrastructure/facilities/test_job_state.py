@@ -0,0 +1,69 @@
+import shutil
+import tempfile
+import unittest
+
+from sonny import testing_conf
+from sonny.import_jobs.base import Importer
+from sonny.infrastructure.facilities.job_state import (
+    JobState, JobStateNotConfigured)
+
+from sonny.infrastructure.context import helpers
+
+
+class ImporterToTestJobState(Importer):
+    uuid = '6f0d8a4e-2b7c-4f5e-8c1d-9e3a7b5c2d10'
+
+    class JobSettings(Importer.JobSettings):
+        class JobStateFacilitySettings(JobState.FacilitySettings):
+            directory = None
+
+    @helpers.step
+    def do_run(self):
+        job_state = helpers.get_current_job().job_state
+        self.values.append(job_state.get(('key', 1), 'default'))
+        job_state.set(('key', 1), {'seen': ['a.csv']})
+
+
+class TestJobState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        ImporterToTestJobState.JobSettings.JobStateFacilitySettings\
+            .directory = self.directory
+        self.importer = ImporterToTestJobState()
+        self.importer.values = []
+
+    def test_values_are_kept_between_runs(self):
+        self.importer.run_import()
+        self.importer.run_import()
+
+        self.assertEquals(self.importer.values,
+                          ['default', {'seen': ['a.csv']}])
+
+    def test_test_runs_dont_keep_values(self):
+        self.importer.test_import()
+        self.importer.test_import()
+
+        self.assertEquals(self.importer.values, ['default', 'default'])
+
+    def test_directory_is_required(self):
+        ImporterToTestJobState.JobSettings.JobStateFacilitySettings\
+            .directory = None
+
+        with self.assertRaises(JobStateNotConfigured):
+            self.importer.run_import()
+
+    def test_directory_from_config(self):
+        ImporterToTestJobState.JobSettings.JobStateFacilitySettings\
+            .directory = None
+        testing_conf.job_state_directory = self.directory
+        try:
+            self.importer.run_import()
+            self.importer.run_import()
+        finally:
+            del testing_conf.job_state_directory
+
+        self.assertEquals(self.importer.values,
+                          ['default', {'seen': ['a.csv']}])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
@@ -4,6 +4,7 @@ from datetime import datetime
 import unittest
 from ddt import ddt, data, unpack
 
+from sonny.infrastructure.context import helpers
 from sonny.infrastructure.facilities import *  # noqa
 
 from sonny.infrastructure.operations import casters
@@ -128,3 +129,91 @@ class TestFixAccountNumber(unittest.TestCase):
         else:
             with self.assertRaises(AssertionError):
                 result = caster(gbp)
+
+
+class TestMemoize(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def _caster(self, value):
+        self.calls.append(value)
+        return unicode(value)
+
+    def test_remembers_results(self):
+        caster = casters.memoize(self._caster)
+
+        results = [caster(value) for value in ['a', 'b', 'a', 1, 1.0, 'a']]
+
+        self.assertEqual(results, [u'a', u'b', u'a', u'1', u'1.0', u'a'])
+        self.assertEqual(self.calls, ['a', 'b', 1, 1.0])
+        self.assertEqual((caster.hits, caster.misses), (2, 4))
+        self.assertEqual(caster.hit_rate, 2.0 / 6)
+
+    def test_forgets_least_recently_used(self):
+        caster = casters.memoize(self._caster, maxsize=2)
+
+        for value in ['a', 'b', 'a', 'c', 'a', 'b']:
+            caster(value)
+
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(len(caster.cache), 2)
+
+    def test_unbounded(self):
+        caster = casters.memoize(self._caster, maxsize=None)
+
+        for value in ['a', 'b', 'c', 'a', 'b', 'c']:
+            caster(value)
+
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+
+    def test_unhashable_values(self):
+        caster = casters.memoize(self._caster)
+
+        self.assertEqual(caster([1]), u'[1]')
+        self.assertEqual(caster([1]), u'[1]')
+        self.assertEqual(self.calls, [[1], [1]])
+
+    def test_errors_are_not_remembered(self):
+        caster = casters.memoize(casters.from_gbp)
+
+        for _ in xrange(2):
+            with self.assertRaises(ValueError):
+                caster('a')
+        self.assertEqual(caster.misses, 0)
+
+    @helpers.job
+    def test_reports_to_profiler(self, job):
+        caster = casters.memoize(self._caster, name='test')
+        caster.report_every = 3
+
+        for value in ['a', 'a', 'b', 'b']:
+            caster(value)
+        counters = job.profiler.profiling_section.counters
+        self.assertEqual(
+            (counters['memoize_test_hits'], counters['memoize_test_misses']),
+            (1, 2))
+
+        caster.report()
+        self.assertEqual(
+            (counters['memoize_test_hits'], counters['memoize_test_misses']),
+            (2, 2))
+
+    def test_short_runs_are_reported_on_exit(self):
+        caster = casters.memoize(self._caster, name='test')
+
+        @helpers.step
+        def cast(values):
+            return map(caster, values)
+
+        @helpers.job
+        def run(job):
+            cast(['a', 'a', 'b'])
+            caster('b')
+            return job.profiler.profiling_section
+
+        root_section = run()
+        step_section, = root_section.profiling_sections
+        self.assertEqual(step_section.counters,
+                         {'memoize_test_hits': 1, 'memoize_test_misses': 2})
+        self.assertEqual(root_section.counters,
+                         {'memoize_test_hits': 1, 'memoize_test_misses': 0})
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import tempfile
+import unittest
+
+from sonny.infrastructure.context import helpers
+from sonny.infrastructure.facilities import *  # noqa
+
+from sonny.infrastructure.operations import casters
+from sonny.infrastructure.operations import columnar
+from sonny.infrastructure.operations.loaders import CsvLoader
+from sonny.infrastructure.operations.savers import DbSaver, PrintSaver
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestRecordBatch(unittest.TestCase):
+    def test_from_rows(self):
+        record_batch = columnar.RecordBatch.from_rows(
+            ['a', 'b'], [['1', '2'], ['3'], ['4', '5', '6']])
+
+        self.assertEquals(len(record_batch), 3)
+        self.assertEquals(record_batch['a'].tolist(), ['1', '3', '4'])
+        self.assertEquals(record_batch['b'].tolist(), ['2', None, '5'])
+
+    def test_from_dicts(self):
+        record_batch = columnar.RecordBatch.from_dicts(
+            ['a', 'b'], [{'a': 1, 'b': 2}, {'b': 3}])
+
+        self.assertEquals(record_batch.tuples(['b', 'a']), [(2, 1), (3, None)])
+
+    def test_iterrows(self):
+        record_batch = columnar.RecordBatch.from_rows(['a', 'b'], [[1, 2]])
+
+        self.assertEquals(list(record_batch.iterrows()), [{'a': 1, 'b': 2}])
+
+    def test_with_columns(self):
+        record_batch = columnar.RecordBatch.from_rows(['a', 'b'], [[1, 2]])
+
+        record_batch = record_batch.with_columns({
+            'b': numpy.array([3]), 'c': numpy.array([4])})
+
+        self.assertEquals(record_batch.columns, ['a', 'b', 'c'])
+        self.assertEquals(record_batch.tuples(record_batch.columns), [(1, 3, 4)])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestColumnarTransformers(unittest.TestCase):
+    def setUp(self):
+        self.batches = [
+            columnar.RecordBatch.from_rows(['a', 'b', 'c'], [
+                [u'£1,000.5', '3.142e+27', '2017-01-02'],
+                ['2', '1234', '2017-01-02'],
+            ]),
+        ]
+
+    @helpers.job
+    def test_keep_keys(self, job):
+        batches = list(columnar.keep_keys(['a', 'd'])(self.batches))
+
+        self.assertEquals(batches[0].columns, ['a'])
+
+    @helpers.job
+    def test_update_with_static_values(self, job):
+        batches = list(
+            columnar.update_with_static_values({'d': 1})(self.batches))
+
+        self.assertEquals(batches[0]['d'].tolist(), [1, 1])
+
+    @helpers.job
+    def test_dicts_to_tuples(self, job):
+        batches = columnar.update_with_static_values({'d': 0})(self.batches)
+
+        batches = list(columnar.dicts_to_tuples(['d', 'a'])(batches))
+
+        self.assertEquals(batches[0].columns, ['d', 'a'])
+        self.assertTrue(batches[0].is_ordered)
+        self.assertEquals(batches[0].tuples(batches[0].columns),
+                          [(0, u'£1,000.5'), (0, '2')])
+
+    @helpers.job
+    def test_cast_columns_matches_casters(self, job):
+        keys_casts = {
+            'a': casters.from_gbp,
+            'b': casters.fix_account_number,
+            'c': casters.to_date('%Y-%m-%d'),
+        }
+        batches = columnar.cast_columns(keys_casts)(self.batches)
+
+        rows = list(columnar.record_batches_to_dicts()(batches))
+
+        self.assertEquals(rows, [
+            {
+                key: keys_casts[key](value)
+                for key, value in row.iteritems()
+            }
+            for row in self.batches[0].iterrows()
+        ])
+        self.assertIsInstance(rows[1]['c'], time.struct_time)
+
+    def test_from_gbp_matches_casters(self):
+        values = [u'£1,000.5', '2', 0.1 + 0.2, 123456789.123456789, 7]
+
+        for array in [numpy.array(values, dtype=object),
+                      numpy.array(values[2:4]),
+                      numpy.array(values[:2])]:
+            cast = columnar.cast_array(casters.from_gbp, array)
+
+            self.assertEquals(cast.tolist(),
+                              map(casters.from_gbp, array.tolist()))
+
+    def test_cast_array_of_unsortable_values(self):
+        array = numpy.array(['1', None, '1'], dtype=object)
+
+        cast = columnar.cast_array(casters.cast_if_not_none(int), array)
+
+        self.assertEquals(cast.tolist(), [1, None, 1])
+
+
+@unittest.skipUnless(numpy, "numpy is not installed")
+class TestColumnarLoadAndSave(unittest.TestCase):
+    @helpers.job
+    def test_csv_loader_record_batches(self, job):
+        _file = ['a,b', 'c,d', 'e,f', 'g']
+
+        batches = list(CsvLoader().get_record_batches(_file, batch_size=2))
+
+        self.assertEquals([len(record_batch) for record_batch in batches], [2, 1])
+        self.assertEquals(batches[0].tuples(['a', 'b']), [('c', 'd'), ('e', 'f')])
+        self.assertEquals(batches[1].tuples(['a', 'b']), [('g', None)])
+
+    @helpers.job
+    def test_print_saver_saves_record_batches(self, job):
+        PrintSaver().save_record_batches([
+            columnar.RecordBatch.from_rows(['a'], [[1]]),
+        ])
+
+    @helpers.job
+    def test_db_saver_saves_positional_query_in_given_order(self, job):
+        saver, calls = self.create_db_saver(job, "INSERT INTO t VALUES (%s, %s)")
+        batches = [columnar.RecordBatch.from_rows(['a', 'b'], [[1, 2]])]
+        batches = columnar.update_with_static_values({'c': 0})(batches)
+
+        saver.save_record_batches(columnar.dicts_to_tuples(['c', 'a'])(batches))
+
+        self.assertEquals(calls, [("INSERT INTO t VALUES (%s, %s)", [(0, 1)])])
+
+    @helpers.job
+    def test_db_saver_needs_positional_query_order(self, job):
+        saver, calls = self.create_db_saver(job, "INSERT INTO t VALUES (%s, %s)")
+        batches = [columnar.RecordBatch.from_rows(['a', 'b'], [[1, 2]])]
+
+        with self.assertRaises(ValueError):
+            saver.save_record_batches(batches)
+        with self.assertRaises(ValueError):
+            saver.save_record_batches(
+                columnar.dicts_to_tuples(['a'])(batches))
+        self.assertEquals(calls, [])
+
+    @helpers.job
+    def test_db_saver_saves_named_query(self, job):
+        saver, calls = self.create_db_saver(
+            job, "INSERT INTO t VALUES (%(b)s, %(a)s)")
+
+        saver.save_record_batches([
+            columnar.RecordBatch.from_rows(['a', 'b'], [[1, 2]]),
+        ])
+
+        self.assertEquals(calls, [("INSERT INTO t VALUES (%s, %s)", [(2, 1)])])
+
+    def create_db_saver(self, job, query):
+        """
+        A `DbSaver` of the query, that records it's `executemany` calls
+        """
+        _file, filename = tempfile.mkstemp(suffix='.sql')
+        os.write(_file, query)
+        os.close(_file)
+        self.addCleanup(os.remove, filename)
+        job.mock_registry.unregister_mock(DbSaver)
+        job.db_registry.get_database_connector = lambda alias: None
+
+        saver = DbSaver({'database': 'destination', 'file': filename})
+        calls = []
+        saver.connector = FakeConnector(calls)
+        saver._connection = FakeConnection
+
+        return saver, calls
+
+
+class FakeConnector(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def executemany(self, cursor, query, rows):
+        self.calls.append((query, list(rows)))
+
+
+class FakeConnection(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def cursor(self):
+        return None
+
+    def commit(self):
+        pass
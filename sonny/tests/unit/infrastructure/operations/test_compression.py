@@ -0,0 +1,87 @@
+import os
+import bz2
+import gzip
+import zipfile
+import tempfile
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.compression import (
+    get_compression, open_decompressed, decompressed_filename,
+    UnsupportedArchive, GZIP, BZ2, ZIP)
+
+CONTENTS = 'a,b\n1,2\n3,4\n'
+
+
+def write_gzip(filename, contents):
+    with gzip.GzipFile(filename, 'wb') as _file:
+        _file.write(contents)
+
+
+def write_bz2(filename, contents):
+    with open(filename, 'wb') as _file:
+        _file.write(bz2.compress(contents))
+
+
+def write_zip(filename, contents, members=('data.csv',)):
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for member in members:
+            archive.writestr(member, contents)
+
+
+def write_plain(filename, contents):
+    with open(filename, 'wb') as _file:
+        _file.write(contents)
+
+
+@ddt
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        _, self.filename = tempfile.mkstemp()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    @data(
+        (write_gzip, GZIP),
+        (write_bz2, BZ2),
+        (write_zip, ZIP),
+        (write_plain, None),
+    )
+    @unpack
+    def test_get_compression(self, write, expected):
+        write(self.filename, CONTENTS)
+
+        self.assertEquals(get_compression(self.filename), expected)
+
+    def test_office_open_xml_is_not_decompressed(self):
+        write_zip(self.filename, CONTENTS,
+                  members=('[Content_Types].xml', 'xl/workbook.xml'))
+
+        self.assertIsNone(get_compression(self.filename))
+
+    @data(write_gzip, write_bz2, write_zip, write_plain)
+    def test_open_decompressed(self, write):
+        write(self.filename, CONTENTS)
+
+        with open_decompressed(self.filename) as _file:
+            self.assertEquals(list(_file), ['a,b\n', '1,2\n', '3,4\n'])
+
+    @data(write_gzip, write_bz2, write_zip, write_plain)
+    def test_decompressed_filename(self, write):
+        write(self.filename, CONTENTS)
+
+        with decompressed_filename(self.filename) as filename:
+            with open(filename, 'rb') as _file:
+                self.assertEquals(_file.read(), CONTENTS)
+
+        self.assertTrue(os.path.isfile(self.filename))
+        if filename != self.filename:
+            self.assertFalse(os.path.exists(filename))
+
+    def test_zip_with_many_files(self):
+        write_zip(self.filename, CONTENTS, members=('a.csv', 'b.csv'))
+
+        with self.assertRaises(UnsupportedArchive):
+            with open_decompressed(self.filename):
+                pass
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.database import (
+    MySqlDatabaseConnector, PostgresDatabaseConnector)
+
+
+class RecordingCursor(object):
+    def __init__(self):
+        self.calls = []
+
+    def execute(self, query, values):
+        self.calls.append(('execute', query, values))
+
+    def executemany(self, query, rows):
+        self.calls.append(('executemany', query, rows))
+
+
+class PagedPostgresDatabaseConnector(PostgresDatabaseConnector):
+    multirow_insert_page_size = 2
+
+
+@ddt
+class TestDatabaseConnectorExecutemany(unittest.TestCase):
+    @data(
+        # Rewritten, in pages
+        (PagedPostgresDatabaseConnector,
+         "INSERT INTO t (a) VALUES (%s)", [(1,), (2,), (3,)], [
+             ('execute', "INSERT INTO t (a) VALUES (%s), (%s)", (1, 2)),
+             ('execute', "INSERT INTO t (a) VALUES (%s)", (3,)),
+         ]),
+        # Not rewritable
+        (PagedPostgresDatabaseConnector,
+         "UPDATE t SET a = %s", [(1,), (2,)], [
+             ('executemany', "UPDATE t SET a = %s", [(1,), (2,)]),
+         ]),
+        # Upserts would conflict with themselves in a page
+        (PagedPostgresDatabaseConnector,
+         "INSERT INTO t (a) VALUES (%s) ON CONFLICT (a) DO UPDATE "
+         "SET a = EXCLUDED.a", [(1,), (1,)], [
+             ('executemany', "INSERT INTO t (a) VALUES (%s) ON CONFLICT (a) "
+              "DO UPDATE SET a = EXCLUDED.a", [(1,), (1,)]),
+         ]),
+        # Ignoring conflicts is fine
+        (PagedPostgresDatabaseConnector,
+         "INSERT INTO t (a) VALUES (%s) ON CONFLICT DO NOTHING", [(1,), (1,)], [
+             ('execute', "INSERT INTO t (a) VALUES (%s), (%s) "
+              "ON CONFLICT DO NOTHING", (1, 1)),
+         ]),
+        # Connector doesn't rewrite
+        (MySqlDatabaseConnector,
+         "INSERT INTO t (a) VALUES (%s)", [(1,), (2,)], [
+             ('executemany', "INSERT INTO t (a) VALUES (%s)", [(1,), (2,)]),
+         ]),
+    )
+    @unpack
+    def test_executemany_calls(self, connector_class, query, rows, expected):
+        cursor = RecordingCursor()
+        connector_class().executemany(cursor, query, rows)
+
+        self.assertEquals(cursor.calls, expected)
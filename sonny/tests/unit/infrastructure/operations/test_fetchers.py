@@ -1,12 +1,34 @@
 # -*- coding: utf-8 -*-
 
+import re
+import os
+import time
+import shutil
+import tempfile
+import socket
+import threading
+from StringIO import StringIO
+from ftplib import error_perm
+from email import message_from_string
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+from email.mime.text import MIMEText
 import unittest
 from ddt import ddt, data, unpack
 
 from sonny.infrastructure.context import helpers
 from sonny.infrastructure.facilities import *  # noqa
+from sonny.infrastructure.facilities.email_registry import EmailRegistry
+from sonny.infrastructure.facilities.job_state import (
+    JobState, JobStateNotConfigured)
 
-from sonny.infrastructure.operations.fetchers import NoOpFetcher
+from sonny.infrastructure.operations import fetchers
+from sonny.infrastructure.operations.fetchers import (
+    NoOpFetcher, FtpFetcher, IncompleteFtpTransfer, LocalFileContextManager,
+    RemoteFile, EmailFetcher, FtpFileStream)
+from sonny.infrastructure.operations.loaders import CsvLoader
+from sonny.import_jobs.common import EmailCsvDbImporter
+from sonny.infrastructure.operations.file_deleters import LocalFileDeleter
 
 
 @ddt
@@ -25,3 +47,819 @@ class TestNoOpFetcher(unittest.TestCase):
         result = self.fetcher().fetch_file(filename)
 
         self.assertEquals(result, filename)
+
+
+class DroppingFtp(object):
+    """
+    A fake FTP session, that drops the connection after sending
+    `bytes_per_connection` bytes
+    """
+
+    def __init__(self, contents, bytes_per_connection, size=None):
+        self.contents = contents
+        self.bytes_per_connection = bytes_per_connection
+        self.size_ = len(contents) if size is None else size
+        self.rests = []
+        self.reconnects = 0
+
+    def pwd(self):
+        return '/'
+
+    def cwd(self, directory):
+        pass
+
+    def voidcmd(self, command):
+        pass
+
+    def size(self, filename):
+        return self.size_
+
+    def retrbinary(self, command, callback, rest=None):
+        self.rests.append(rest)
+        start = rest or 0
+        end = start + self.bytes_per_connection
+        callback(self.contents[start:end])
+        if end < len(self.contents):
+            raise socket.error("Connection reset by peer")
+
+
+class RestRejectingFtp(DroppingFtp):
+    """
+    A fake FTP session, that drops the connection once, and doesn't support
+    resuming with `REST`
+    """
+
+    def retrbinary(self, command, callback, rest=None):
+        if rest:
+            self.rests.append(rest)
+            self.bytes_per_connection = len(self.contents)
+            raise error_perm('502 Command not implemented')
+        super(RestRejectingFtp, self).retrbinary(command, callback, rest)
+
+
+class ResumingFtpFetcher(FtpFetcher):
+    class OperationSettings(FtpFetcher.OperationSettings):
+        retries = 3
+        retry_delay = 0
+
+
+class TestFtpFetcherResuming(unittest.TestCase):
+    fetcher = ResumingFtpFetcher
+
+    def fetch(self, job, ftp):
+        def reconnect_session(alias, ftp):
+            ftp.reconnects += 1
+        job.ftp_registry.reconnect_session = reconnect_session
+
+        return self.fetcher('source')._fetch_file_that_exists_with_ftp(
+            ftp, 'file.csv')
+
+    @helpers.job
+    def test_resumes_from_partial_file(self, job):
+        ftp = DroppingFtp('0123456789', 4)
+        local_filename, exception = self.fetch(job, ftp)
+
+        self.assertIsNone(exception)
+        with open(local_filename) as local_file:
+            self.assertEquals(local_file.read(), '0123456789')
+        os.remove(local_filename)
+        self.assertEquals(ftp.rests, [None, 4, 8])
+        self.assertEquals(ftp.reconnects, 2)
+
+    @helpers.job
+    def test_starts_over_when_rest_is_rejected(self, job):
+        ftp = RestRejectingFtp('0123456789', 4)
+        local_filename, exception = self.fetch(job, ftp)
+
+        self.assertIsNone(exception)
+        with open(local_filename) as local_file:
+            self.assertEquals(local_file.read(), '0123456789')
+        os.remove(local_filename)
+        self.assertEquals(ftp.rests, [None, 4, None])
+        self.assertEquals(ftp.reconnects, 1)
+
+    @helpers.job
+    def test_gives_up_after_retries(self, job):
+        ftp = DroppingFtp('0123456789', 2)
+
+        with self.assertRaises(socket.error):
+            self.fetch(job, ftp)
+
+        self.assertEquals(ftp.rests, [None, 2, 4, 6])
+
+    @helpers.job
+    def test_resumes_when_shorter_than_remote_size(self, job):
+        ftp = DroppingFtp('0123456789', 10, size=12)
+
+        with self.assertRaises(IncompleteFtpTransfer):
+            self.fetch(job, ftp)
+
+        self.assertEquals(ftp.rests, [None, 10, 10, 10])
+
+    @helpers.job
+    def test_partial_files_are_deleted(self, job):
+        fetcher = self.fetcher('source')
+        partial_filenames = []
+
+        download_with_ftp = fetcher._download_with_ftp
+
+        def _download_with_ftp(ftp, filename, local_filename):
+            partial_filenames.append(local_filename)
+            return download_with_ftp(ftp, filename, local_filename)
+        fetcher._download_with_ftp = _download_with_ftp
+        ftp = DroppingFtp('0123456789', 2)
+        job.ftp_registry.checkout_session = lambda alias: ftp
+        job.ftp_registry.discard_session = lambda alias, ftp: None
+        job.ftp_registry.reconnect_session = lambda alias, ftp: None
+
+        # Outside of a `LocalFileContextManager`
+        with self.assertRaises(socket.error):
+            fetcher.fetch_file('file.csv')
+
+        self.assertEquals(len(partial_filenames), 1)
+        self.assertFalse(os.path.exists(partial_filenames[0]))
+
+
+class FetchingFtp(object):
+    """
+    A fake FTP session, that sends files, slower for the ones with a bigger
+    delay, so that downloads over several sessions finish out of order
+    """
+
+    def __init__(self, files, delays):
+        self.files = files
+        self.delays = delays
+        self.directories = []
+        self.retrieved = []
+
+    def pwd(self):
+        return '/'
+
+    def cwd(self, directory):
+        self.directories.append(directory)
+
+    def voidcmd(self, command):
+        pass
+
+    def size(self, filename):
+        if filename not in self.files:
+            raise error_perm('550 No such file')
+        return len(self.files[filename])
+
+    def retrbinary(self, command, callback, rest=None):
+        filename = command[len('RETR '):]
+        if filename not in self.files:
+            raise error_perm('550 No such file')
+        time.sleep(self.delays.get(filename, 0))
+        self.retrieved.append(filename)
+        callback(self.files[filename])
+
+
+class ConcurrentFtpFetcher(FtpFetcher):
+    class OperationSettings(FtpFetcher.OperationSettings):
+        concurrent_connections = 3
+
+
+class TestFtpFetcherConnections(unittest.TestCase):
+    fetcher = ConcurrentFtpFetcher
+    files = {'a.csv': 'a', 'b.csv': 'b', 'c.csv': 'c', 'd.csv': 'd'}
+    delays = {'a.csv': 0.06, 'b.csv': 0.04, 'c.csv': 0.02}
+
+    def use_ftps(self, job):
+        self.checked_out = []
+        self.checked_in = []
+        lock = threading.Lock()
+
+        def checkout_session(alias):
+            ftp = FetchingFtp(self.files, self.delays)
+            with lock:
+                self.checked_out.append(ftp)
+            return ftp
+
+        def checkin_session(alias, ftp):
+            with lock:
+                self.checked_in.append(ftp)
+
+        def discard_session(alias, ftp):
+            with lock:
+                self.discarded.append(ftp)
+        self.discarded = []
+        job.ftp_registry.checkout_session = checkout_session
+        job.ftp_registry.checkin_session = checkin_session
+        job.ftp_registry.discard_session = discard_session
+
+    def assertAllCheckedIn(self):
+        self.assertEquals(len(self.checked_out), 3)
+        self.assertEquals(sorted(map(id, self.checked_in)),
+                          sorted(map(id, self.checked_out)))
+        self.assertEquals(self.discarded, [])
+
+    def read_and_remove(self, local_filename):
+        with open(local_filename) as local_file:
+            contents = local_file.read()
+        os.remove(local_filename)
+
+        return contents
+
+    @helpers.job
+    def test_results_are_in_filenames_order(self, job):
+        self.use_ftps(job)
+
+        local_filenames = self.fetcher('source').fetch_files(
+            ['a.csv', 'b.csv', 'c.csv', 'd.csv'])
+
+        self.assertEquals(map(self.read_and_remove, local_filenames),
+                          ['a', 'b', 'c', 'd'])
+        self.assertAllCheckedIn()
+        # Each file was downloaded once, over any of the sessions
+        retrieved = [
+            filename
+            for ftp in self.checked_out
+            for filename in ftp.retrieved
+        ]
+        self.assertEquals(sorted(retrieved), ['a.csv', 'b.csv', 'c.csv',
+                                              'd.csv'])
+
+    @helpers.job
+    def test_missing_files_are_returned_with_their_exception(self, job):
+        self.use_ftps(job)
+
+        results = self.fetcher('source').fetch_files_that_exist(
+            ['a.csv', 'missing.csv', 'c.csv', 'd.csv'])
+
+        self.assertEquals(len(results), 4)
+        (missing, exception) = results[1]
+        self.assertIsNone(missing)
+        self.assertIsInstance(exception, error_perm)
+        self.assertEquals([
+            self.read_and_remove(local_filename)
+            for local_filename, exception in results
+            if exception is None
+        ], ['a', 'c', 'd'])
+        self.assertAllCheckedIn()
+
+    @helpers.job
+    def test_worker_exception_is_raised_and_session_discarded(self, job):
+        self.use_ftps(job)
+
+        def func(ftp, filename):
+            if filename == 'b.csv':
+                raise ValueError(filename)
+            return filename
+
+        with self.assertRaises(ValueError):
+            self.fetcher('source')._map_with_ftp_connections(
+                func, ['a.csv', 'b.csv', 'c.csv', 'd.csv'])
+
+        # The session that raised is discarded, and the others are reused
+        self.assertEquals(len(self.checked_out), 3)
+        self.assertEquals(len(self.discarded), 1)
+        self.assertEquals(
+            sorted(map(id, self.checked_in + self.discarded)),
+            sorted(map(id, self.checked_out)))
+
+    @helpers.job
+    def test_connections_are_in_the_directory(self, job):
+        self.use_ftps(job)
+
+        self.fetcher('source')._map_with_ftp_connections(
+            lambda ftp, filename: filename, ['a.csv', 'b.csv', 'c.csv'],
+            directory='dir')
+
+        self.assertEquals([ftp.directories for ftp in self.checked_out],
+                          [['dir']] * 3)
+        self.assertAllCheckedIn()
+
+
+class ListingFtp(object):
+    """
+    A fake FTP session, that lists a directory with MLSD or LIST
+    """
+
+    def __init__(self, mlsd_lines=None, list_lines=(), nlst_names=()):
+        self.mlsd_lines = mlsd_lines
+        self.list_lines = list_lines
+        self.nlst_names = nlst_names
+
+    def cwd(self, directory):
+        pass
+
+    def retrlines(self, command, callback):
+        if command == 'MLSD':
+            if self.mlsd_lines is None:
+                raise error_perm('500 Unknown command')
+            lines = self.mlsd_lines
+        else:
+            lines = self.list_lines
+        for line in lines:
+            callback(line)
+
+    def nlst(self):
+        return list(self.nlst_names)
+
+
+@ddt
+class TestFtpFetcherListing(unittest.TestCase):
+    fetcher = FtpFetcher
+
+    @data(
+        ('type=file;size=12;modify=20160101120000; a.csv',
+         RemoteFile('a.csv', 12, '20160101120000')),
+        ('Type=File;Size=3; with spaces.csv',
+         RemoteFile('with spaces.csv', 3, None)),
+        ('type=dir;modify=20160101120000; archive', None),
+        ('type=cdir; .', None),
+    )
+    @unpack
+    @helpers.job
+    def test_parse_mlsd_line(self, line, expected, job):
+        self.assertEquals(self.fetcher('source')._parse_mlsd_line(line),
+                          expected)
+
+    @data(
+        ('-rw-r--r--   1 owner group     1024 Jan 01 12:00 a.csv',
+         RemoteFile('a.csv', 1024, 'Jan 01 12:00')),
+        ('-rw-r--r--   1 owner group     1024 Jan 01  2015 with spaces.csv',
+         RemoteFile('with spaces.csv', 1024, 'Jan 01  2015')),
+        ('drwxr-xr-x   2 owner group     4096 Jan 01 12:00 archive',
+         FtpFetcher.LIST_DIRECTORY),
+        ('01-01-16  12:00PM                 1024 a.csv',
+         RemoteFile('a.csv', 1024, '01-01-16  12:00PM')),
+        ('01-01-16  12:00PM       <DIR>          archive',
+         FtpFetcher.LIST_DIRECTORY),
+        ('something else', None),
+    )
+    @unpack
+    @helpers.job
+    def test_parse_list_line(self, line, expected, job):
+        self.assertEquals(self.fetcher('source')._parse_list_line(line),
+                          expected)
+
+    def list_files(self, ftp):
+        return self.fetcher('source')._list_files_with_ftp(ftp, '')
+
+    @helpers.job
+    def test_list_files_with_mlsd(self, job):
+        ftp = ListingFtp(mlsd_lines=[
+            'type=file;size=12;modify=20160101120000; a.csv',
+            'type=dir;modify=20160101120000; archive',
+        ])
+
+        self.assertEquals(self.list_files(ftp),
+                          [RemoteFile('a.csv', 12, '20160101120000')])
+
+    @helpers.job
+    def test_list_files_falls_back_to_list(self, job):
+        ftp = ListingFtp(list_lines=[
+            'total 8',
+            '-rw-r--r--   1 owner group     1024 Jan 01 12:00 a.csv',
+            'drwxr-xr-x   2 owner group     4096 Jan 01 12:00 archive',
+        ])
+
+        self.assertEquals(self.list_files(ftp),
+                          [RemoteFile('a.csv', 1024, 'Jan 01 12:00')])
+        self.assertFalse(ftp.supports_mlsd)
+
+    @helpers.job
+    def test_list_files_falls_back_to_nlst(self, job):
+        ftp = ListingFtp(list_lines=['something else'], nlst_names=['a.csv'])
+
+        self.assertEquals(self.list_files(ftp),
+                          [RemoteFile('a.csv', None, None)])
+
+    @helpers.test_job
+    def test_search_new_regex_files(self, job):
+        job.mock_registry.unregister_mock(FtpFetcher)
+        ftp = ListingFtp(mlsd_lines=[
+            'type=file;size=12;modify=20160101120000; a_1.csv',
+            'type=file;size=12;modify=20160101120000; b_1.csv',
+            'type=file;size=12;modify=20160101120000; other.txt',
+        ])
+        job.ftp_registry.checkout_session = lambda alias: ftp
+        job.ftp_registry.checkin_session = lambda alias, ftp: None
+        fetcher = self.fetcher('source')
+
+        remote_files = fetcher.search_new_regex_files('dir', r'\w_\d\.csv')
+        self.assertEquals([remote_file.name for remote_file in remote_files],
+                          ['dir/a_1.csv', 'dir/b_1.csv'])
+
+        fetcher.save_listing_snapshot('dir', remote_files[:1])
+        ftp.mlsd_lines[1] = 'type=file;size=13;modify=20160102120000; b_1.csv'
+        remote_files = fetcher.search_new_regex_files('dir', r'\w_\d\.csv')
+        self.assertEquals([remote_file.name for remote_file in remote_files],
+                          ['dir/b_1.csv'])
+
+        fetcher.save_listing_snapshot('dir', remote_files)
+        self.assertEquals(
+            fetcher.search_new_regex_files('dir', r'\w_\d\.csv'), [])
+
+    @helpers.test_job
+    def test_search_new_regex_files_without_metadata(self, job):
+        job.mock_registry.unregister_mock(FtpFetcher)
+        ftp = ListingFtp(list_lines=['something else'], nlst_names=['a_1.csv'])
+        job.ftp_registry.checkout_session = lambda alias: ftp
+        job.ftp_registry.checkin_session = lambda alias, ftp: None
+        fetcher = self.fetcher('source')
+
+        remote_files = fetcher.search_new_regex_files('dir', r'\w_\d\.csv')
+        fetcher.save_listing_snapshot('dir', remote_files)
+
+        # It may have changed since
+        self.assertEquals(
+            fetcher.search_new_regex_files('dir', r'\w_\d\.csv'),
+            [RemoteFile('dir/a_1.csv', None, None)])
+
+
+def make_email(message_id, attachments):
+    message = MIMEMultipart()
+    message['Message-ID'] = '<%s@example.com>' % message_id
+    message['Subject'] = 'Report %s' % message_id
+    message.attach(MIMEText('body'))
+    for filename, contents in attachments:
+        attachment = MIMEApplication(contents)
+        attachment.add_header(
+            'Content-Disposition', 'attachment', filename=filename)
+        message.attach(attachment)
+
+    return message.as_string()
+
+
+class FakeImapConnection(object):
+    """
+    A fake IMAP connection, that responds to FETCH and SEARCH commands, by
+    sequence number or UID, like imaplib does. Messages are numbered by their
+    UIDs' order
+    """
+
+    def __init__(self, emails, uidvalidity='1'):
+        self.emails = emails
+        self.uidvalidity = uidvalidity
+        self.fetches = []
+        self.searches = []
+
+    def login(self, username, password):
+        pass
+
+    def select(self, mailbox):
+        pass
+
+    def close(self):
+        pass
+
+    def logout(self):
+        pass
+
+    def response(self, code):
+        return code, [self.uidvalidity]
+
+    def search(self, charset, query):
+        self.searches.append(query)
+        return 'OK', [' '.join(self._get_uids())]
+
+    def uid(self, command, *args):
+        if command == 'FETCH':
+            return self.fetch(*args, uid=True)
+
+        _, query = args
+        self.searches.append(query)
+        uids = self._get_uids()
+        match = re.match(r'UID (\d+):\*', query)
+        if match:
+            uids = [
+                uid for uid in uids if int(uid) >= int(match.group(1))
+            ] or uids[-1:]
+
+        return 'OK', [' '.join(uids)]
+
+    def fetch(self, message_set, part, uid=False):
+        self.fetches.append((message_set, part))
+        uids = self._get_uids()
+        data = []
+        for message_id in self._parse_message_set(message_set):
+            if message_id not in self.emails:
+                continue
+            _email = self.emails[message_id]
+            prefix = '%s (' % message_id
+            if uid:
+                prefix = '%s (UID %s ' % (uids.index(message_id) + 1,
+                                          message_id)
+            if part == EmailFetcher.EMAIL_PART_HEADERS:
+                headers = _email.split('\n\n', 1)[0] + '\n\n'
+                data.append(('%sBODY[HEADER] {%s}' % (prefix, len(headers)),
+                             headers))
+                data.append(')')
+            elif part == EmailFetcher.EMAIL_PART_STRUCTURE:
+                data.append('%sBODYSTRUCTURE %s)' % (
+                    prefix,
+                    self._get_bodystructure(message_from_string(_email))))
+            else:
+                message = message_from_string(_email)
+                for section in re.findall(r'BODY\.PEEK\[(\d+)\]', part):
+                    payload = message.get_payload()[int(section) - 1]\
+                        .get_payload()
+                    data.append(('%sBODY[%s] {%s}' % (
+                        prefix, section, len(payload)), payload))
+                    prefix = ' '
+                data.append(')')
+
+        return 'OK', data
+
+    def _get_uids(self):
+        return sorted(self.emails, key=int)
+
+    def _parse_message_set(self, message_set):
+        for message_range in message_set.split(','):
+            start, _, end = message_range.partition(':')
+            for message_id in xrange(int(start), int(end or start) + 1):
+                yield str(message_id)
+
+    def _get_bodystructure(self, message):
+        if message.is_multipart():
+            return '(%s "mixed" ("boundary" "%s") NIL NIL)' % (
+                ''.join(map(self._get_bodystructure, message.get_payload())),
+                message.get_boundary())
+
+        _type, subtype = message.get_content_type().split('/')
+        disposition = 'NIL'
+        if message.get_filename():
+            disposition = '("attachment" ("filename" "%s"))' % \
+                message.get_filename()
+        lines = ' 1' if _type == 'text' else ''
+        return '("%s" "%s" NIL NIL NIL "%s" %s%s NIL %s NIL)' % (
+            _type, subtype,
+            message.get('Content-Transfer-Encoding', '7bit'),
+            len(message.get_payload()), lines, disposition)
+
+
+class BatchingEmailFetcher(EmailFetcher):
+    class OperationSettings(EmailFetcher.OperationSettings):
+        fetch_batch_size = 3
+
+
+@ddt
+class TestEmailFetcherBatching(unittest.TestCase):
+    fetcher = BatchingEmailFetcher
+
+    @data(
+        (['1'], '1'),
+        (['1', '2', '3'], '1:3'),
+        (['5', '1', '2', '3', '7', '8'], '1:3,5,7:8'),
+    )
+    @unpack
+    @helpers.job
+    def test_message_set(self, message_ids, expected, job):
+        self.assertEquals(
+            self.fetcher('source')._get_message_set(message_ids), expected)
+
+    @helpers.job
+    def test_fetches_in_batches(self, job):
+        emails = {
+            str(message_id): make_email(message_id, [
+                ('report-%s.csv' % message_id, 'contents %s' % message_id),
+                ('report-%s.pdf' % message_id, 'ignored'),
+            ])
+            for message_id in xrange(1, 8)
+        }
+        connection = FakeImapConnection(emails)
+        fetcher = self.fetcher('source', '*.csv')
+
+        message_ids = ['1', '2', '3', '4', '5', '6', '7']
+        messages = fetcher._filter_matching_emails(connection, message_ids, {})
+        local_filenames = list(
+            fetcher._fetch_messages_attachments_files(connection, messages))
+
+        contents = []
+        for local_filename in local_filenames:
+            with open(local_filename) as local_file:
+                contents.append(local_file.read())
+            os.remove(local_filename)
+        self.assertEquals(contents, [
+            'contents %s' % message_id for message_id in xrange(1, 8)])
+        self.assertEquals(connection.fetches, [
+            ('1:3', EmailFetcher.EMAIL_PART_HEADERS),
+            ('1:3', EmailFetcher.EMAIL_PART_STRUCTURE),
+            ('1:3', '(BODY.PEEK[2])'),
+            ('4:6', EmailFetcher.EMAIL_PART_HEADERS),
+            ('4:6', EmailFetcher.EMAIL_PART_STRUCTURE),
+            ('4:6', '(BODY.PEEK[2])'),
+            ('7', EmailFetcher.EMAIL_PART_HEADERS),
+            ('7', EmailFetcher.EMAIL_PART_STRUCTURE),
+            ('7', '(BODY.PEEK[2])'),
+        ])
+
+
+class IncrementalEmailFetcher(EmailFetcher):
+    class OperationSettings(EmailFetcher.OperationSettings):
+        incremental = True
+
+
+class ImporterToTestEmailSyncState(EmailCsvDbImporter):
+    uuid = '0b6f1f8e-5d1a-4c33-9a57-3f2e8c4d7a61'
+    email_source = 'source'
+    fetcher = IncrementalEmailFetcher
+    insert_queries = []
+
+    class JobSettings(EmailCsvDbImporter.JobSettings):
+        class JobStateFacilitySettings(JobState.FacilitySettings):
+            directory = None
+
+    def get_email_search_kwargs(self):
+        return {}
+
+    def get_search_kwargs(self):
+        return {}
+
+    def process_data(self, local_filenames):
+        if self.fails:
+            raise ValueError("Import failed")
+        contents = []
+        for local_filename in local_filenames:
+            with open(local_filename) as local_file:
+                contents.append(local_file.read())
+        self.imported.append(contents)
+
+
+class TestEmailFetcherIncremental(unittest.TestCase):
+    fetcher = IncrementalEmailFetcher
+
+    def fetch(self, job, connection, save_sync_state=True):
+        job.email_registry.get_email_server = lambda source: {
+            'server': 'server', 'username': 'username', 'password': 'password'}
+        IMAP4_SSL = fetchers.imaplib.IMAP4_SSL
+        fetchers.imaplib.IMAP4_SSL = lambda server: connection
+        try:
+            fetcher = self.fetcher('source', '*.csv')
+            local_filenames = fetcher.fetch_from_search('INBOX')
+            if save_sync_state:
+                fetcher.save_sync_state()
+        finally:
+            fetchers.imaplib.IMAP4_SSL = IMAP4_SSL
+
+        contents = []
+        for local_filename in local_filenames:
+            with open(local_filename) as local_file:
+                contents.append(local_file.read())
+            os.remove(local_filename)
+
+        return contents
+
+    @helpers.test_job
+    def test_only_new_mail_is_fetched(self, job):
+        job.mock_registry.unregister_mock(EmailFetcher)
+        connection = FakeImapConnection({
+            '10': make_email(10, [('a.csv', 'a')]),
+            '12': make_email(12, [('b.csv', 'b')]),
+        })
+
+        self.assertEquals(self.fetch(job, connection), ['a', 'b'])
+        self.assertEquals(self.fetch(job, connection), [])
+
+        connection.emails['15'] = make_email(15, [('c.csv', 'c')])
+        self.assertEquals(self.fetch(job, connection), ['c'])
+        self.assertEquals(connection.searches, ['()', 'UID 13:* ()',
+                                                'UID 13:* ()'])
+
+    @helpers.test_job
+    def test_mail_is_fetched_again_until_sync_state_is_saved(self, job):
+        job.mock_registry.unregister_mock(EmailFetcher)
+        connection = FakeImapConnection({
+            '10': make_email(10, [('a.csv', 'a')]),
+        })
+
+        self.assertEquals(
+            self.fetch(job, connection, save_sync_state=False), ['a'])
+        self.assertEquals(self.fetch(job, connection), ['a'])
+        self.assertEquals(self.fetch(job, connection), [])
+
+    def test_failed_import_fetches_mail_again(self):
+        connection = FakeImapConnection({
+            '10': make_email(10, [('a.csv', 'a')]),
+            '12': make_email(12, [('b.csv', 'b')]),
+        })
+        directory = tempfile.mkdtemp()
+        ImporterToTestEmailSyncState.JobSettings.JobStateFacilitySettings\
+            .directory = directory
+        importer = ImporterToTestEmailSyncState()
+        importer.imported = []
+        IMAP4_SSL = fetchers.imaplib.IMAP4_SSL
+        fetchers.imaplib.IMAP4_SSL = lambda server: connection
+        get_email_server = EmailRegistry.get_email_server
+        EmailRegistry.get_email_server = lambda self, source: {
+            'server': 'server', 'username': 'username', 'password': 'password'}
+        try:
+            importer.fails = True
+            importer.run_import()
+            importer.fails = False
+            importer.run_import()
+            importer.run_import()
+        finally:
+            fetchers.imaplib.IMAP4_SSL = IMAP4_SSL
+            EmailRegistry.get_email_server = get_email_server
+            shutil.rmtree(directory)
+
+        self.assertEquals(importer.imported, [['a', 'b']])
+        self.assertEquals(connection.searches, ['()', '()', 'UID 13:* ()'])
+
+    @helpers.job
+    def test_needs_a_durable_sync_state(self, job):
+        job.job_state.facility_settings = JobState.FacilitySettings
+        connection = FakeImapConnection({
+            '10': make_email(10, [('a.csv', 'a')]),
+        })
+
+        # Rather than searching all the mail
+        with self.assertRaises(JobStateNotConfigured):
+            self.fetch(job, connection)
+        self.assertEquals(connection.searches, [])
+
+    @helpers.test_job
+    def test_uidvalidity_change_refetches_all(self, job):
+        job.mock_registry.unregister_mock(EmailFetcher)
+        connection = FakeImapConnection({
+            '10': make_email(10, [('a.csv', 'a')]),
+        })
+
+        self.assertEquals(self.fetch(job, connection), ['a'])
+        connection.uidvalidity = '2'
+        self.assertEquals(self.fetch(job, connection), ['a'])
+
+
+class FakeDataConnection(object):
+    def __init__(self, contents):
+        self.contents = contents
+        self.closed = False
+
+    def makefile(self, mode):
+        return StringIO(self.contents)
+
+    def close(self):
+        self.closed = True
+
+
+class StreamingFtp(object):
+    """
+    A fake FTP session, that sends files over a fake data connection
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.transfers = []
+
+    def voidcmd(self, command):
+        pass
+
+    def size(self, filename):
+        if filename not in self.files:
+            raise error_perm('550 No such file')
+        return len(self.files[filename])
+
+    def transfercmd(self, command):
+        self.transfers.append(command)
+        return FakeDataConnection(self.files[command[len('RETR '):]])
+
+    def voidresp(self):
+        return '226 Transfer complete'
+
+
+class TestFtpFetcherStreaming(unittest.TestCase):
+    fetcher = FtpFetcher
+
+    def use_ftp(self, job, ftp):
+        self.checked_in = []
+        job.ftp_registry.checkout_session = lambda alias: ftp
+        job.ftp_registry.checkin_session = \
+            lambda alias, ftp: self.checked_in.append(ftp)
+
+    @helpers.job
+    def test_open_files_that_exist(self, job):
+        ftp = StreamingFtp({'a.csv': 'a,b\n1,2\n'})
+        self.use_ftp(job, ftp)
+
+        results = self.fetcher('source').open_files_that_exist(
+            ['a.csv', 'missing.csv'])
+
+        (stream, exception), (missing, missing_exception) = results
+        self.assertIsNone(exception)
+        self.assertIsInstance(stream, FtpFileStream)
+        self.assertIsNone(missing)
+        self.assertIsInstance(missing_exception, error_perm)
+        # Nothing is transferred until the stream is read
+        self.assertEquals(ftp.transfers, [])
+
+    @helpers.job
+    def test_csv_loader_reads_stream(self, job):
+        ftp = StreamingFtp({'a.csv': 'a,b\n1,2\n3,4\n'})
+        self.use_ftp(job, ftp)
+
+        with LocalFileContextManager(['a.csv'], self.fetcher('source'),
+                                     LocalFileDeleter(),
+                                     streaming=True) as local_files:
+            data = [
+                list(CsvLoader().get_all_data_with_headers(local_file))
+                for local_file in local_files
+            ]
+
+        self.assertEquals(data, [[{'a': '1', 'b': '2'}, {'a': '3', 'b': '4'}]])
+        self.assertEquals(ftp.transfers, ['RETR a.csv'])
+        # One for checking that the files exist, and one for the stream
+        self.assertEquals(self.checked_in, [ftp, ftp])
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from cStringIO import StringIO
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.imap import (
+    parse_fetch_response, get_attachment_parts, decode_to_file,
+    AttachmentPart)
+
+
+@ddt
+class TestParseFetchResponse(unittest.TestCase):
+    def test_many_messages(self):
+        response = parse_fetch_response([
+            '1 (UID 10 BODYSTRUCTURE ("text" "plain" ("charset" "us-ascii") '
+            'NIL NIL "7bit" 4 1 NIL NIL NIL))',
+            '2 (UID 11 BODYSTRUCTURE ("text" "plain" NIL NIL NIL "7bit" 4 1))',
+        ])
+
+        self.assertEquals(response, {
+            '1': {
+                'UID': '10',
+                'BODYSTRUCTURE': ['text', 'plain', ['charset', 'us-ascii'],
+                                  None, None, '7bit', '4', '1', None, None,
+                                  None],
+            },
+            '2': {
+                'UID': '11',
+                'BODYSTRUCTURE': ['text', 'plain', None, None, None, '7bit',
+                                  '4', '1'],
+            },
+        })
+
+    def test_literals(self):
+        response = parse_fetch_response([
+            ('1 (BODY[2] {5}', 'a\r\n)b'),
+            (' BODY[3] {3}', '"c"'),
+            ')',
+            ('2 (BODYSTRUCTURE ("application" "pdf" ("name" {7}', 'a b.pdf'),
+            ') NIL NIL "base64" 10 NIL NIL NIL))',
+        ])
+
+        self.assertEquals(response['1'], {
+            'BODY[2]': 'a\r\n)b',
+            'BODY[3]': '"c"',
+        })
+        self.assertEquals(response['2']['BODYSTRUCTURE'][2], ['name', 'a b.pdf'])
+
+    @data(
+        ('"with \\"quotes\\""', 'with "quotes"'),
+        ('"with \\\\ backslash"', 'with \\ backslash'),
+    )
+    @unpack
+    def test_quoted_strings(self, quoted, expected):
+        response = parse_fetch_response(['1 (X %s)' % quoted])
+
+        self.assertEquals(response['1']['X'], expected)
+
+
+class TestGetAttachmentParts(unittest.TestCase):
+    def test_nested_multipart(self):
+        bodystructure = [
+            [
+                ['text', 'plain', ['charset', 'utf-8'], None, None, '7bit',
+                 '10', '1', None, None, None],
+                ['text', 'html', ['charset', 'utf-8'], None, None, '7bit',
+                 '20', '1', None, None, None],
+                'alternative', ['boundary', 'b1'], None, None,
+            ],
+            ['application', 'octet-stream', ['name', 'a.csv'], None, None,
+             'BASE64', '12', None, ['attachment', ['filename', 'a.csv']], None],
+            ['text', 'csv', ['NAME', 'b.csv'], None, None, 'quoted-printable',
+             '12', '1', None, None, None],
+            'mixed', ['boundary', 'b2'], None, None,
+        ]
+
+        self.assertEquals(list(get_attachment_parts(bodystructure)), [
+            AttachmentPart('2', 'a.csv', 'base64'),
+            AttachmentPart('3', 'b.csv', 'quoted-printable'),
+        ])
+
+    def test_single_part(self):
+        bodystructure = [
+            'application', 'pdf', None, None, None, 'base64', '12', None,
+            ['inline', ['filename', 'a.pdf']], None,
+        ]
+
+        self.assertEquals(list(get_attachment_parts(bodystructure)), [
+            AttachmentPart('1', 'a.pdf', 'base64'),
+        ])
+
+    def test_rfc2231_filenames(self):
+        bodystructure = [
+            ['application', 'pdf', None, None, None, 'base64', '12', None,
+             ['attachment', ['filename*', "utf-8''%E2%82%AC%20a.pdf"]], None],
+            ['text', 'csv', ['name*0*', "iso-8859-1'fr'caf%E9",
+                             'name*1', ' b.csv'],
+             None, None, '7bit', '12', '1', None, None, None],
+            'mixed', ['boundary', 'b1'], None, None,
+        ]
+
+        self.assertEquals(list(get_attachment_parts(bodystructure)), [
+            AttachmentPart('1', '€ a.pdf', 'base64'),
+            AttachmentPart('2', 'café b.csv', '7bit'),
+        ])
+
+
+@ddt
+class TestDecodeToFile(unittest.TestCase):
+    @data(
+        ('base64', 'YSxiCjEs\r\nMgo=\r\n', 'a,b\n1,2\n'),
+        ('quoted-printable', 'a=3Db\r\nc=\r\nd', 'a=b\r\ncd'),
+        ('7bit', 'a,b\r\n', 'a,b\r\n'),
+    )
+    @unpack
+    def test_decode(self, encoding, data, expected):
+        _file = StringIO()
+        decode_to_file(data, encoding, _file)
+
+        self.assertEquals(_file.getvalue(), expected)
@@ -1,10 +1,86 @@
+import os
+import gzip
+import zipfile
+import datetime
+import tempfile
 import unittest
+from xml.sax.saxutils import escape
 from ddt import ddt, data, unpack
 
 from sonny.infrastructure.context import helpers
 from sonny.infrastructure.facilities import *  # noqa
 
-from sonny.infrastructure.operations.loaders import CsvLoader
+from sonny.infrastructure.operations import loaders
+from sonny.infrastructure.operations.loaders import (
+    CsvLoader, ParallelCsvLoader, ExcelLoader, MultiSheetExcelLoader,
+    XlsxStreamingLoader, get_record_ranges)
+from sonny.infrastructure.operations.rows import CompactRow
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+XLSX_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_RELATIONSHIPS = \
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_EPOCH = datetime.datetime(1899, 12, 30)
+
+
+def make_xlsx(filename, sheets, dimension=None):
+    """
+    Write a minimal XLSX workbook, from a list of `(name, rows)`. `None`
+    cells are left empty, and datetimes are styled as dates
+    """
+    dimension = '<dimension ref="%s"/>' % dimension if dimension else ''
+    with zipfile.ZipFile(filename, 'w') as archive:
+        archive.writestr('[Content_Types].xml', (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'content-types"/>'))
+        archive.writestr('_rels/.rels', (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+            '2006/relationships"><Relationship Id="rId1" '
+            'Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+            '</Relationships>' % XLSX_RELATIONSHIPS))
+        archive.writestr('xl/workbook.xml', (
+            '<workbook xmlns="%s" xmlns:r="%s"><sheets>%s</sheets></workbook>'
+            % (XLSX_NAMESPACE, XLSX_RELATIONSHIPS, ''.join(
+                '<sheet name="%s" sheetId="%s" r:id="rId%s"/>'
+                % (escape(name), index, index)
+                for index, (name, _) in enumerate(sheets, 1)))))
+        archive.writestr('xl/_rels/workbook.xml.rels', (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+            '2006/relationships">%s</Relationships>' % ''.join(
+                '<Relationship Id="rId%s" Type="%s/worksheet" '
+                'Target="worksheets/sheet%s.xml"/>'
+                % (index, XLSX_RELATIONSHIPS, index)
+                for index in xrange(1, len(sheets) + 1))))
+        archive.writestr('xl/styles.xml', (
+            '<styleSheet xmlns="%s"><cellXfs count="2">'
+            '<xf numFmtId="0"/><xf numFmtId="14"/></cellXfs></styleSheet>'
+            % XLSX_NAMESPACE))
+        for index, (_, rows) in enumerate(sheets, 1):
+            archive.writestr('xl/worksheets/sheet%s.xml' % index, (
+                '<worksheet xmlns="%s">%s<sheetData>%s</sheetData></worksheet>'
+                % (XLSX_NAMESPACE, dimension, ''.join(
+                    '<row r="%s">%s</row>' % (row_index, ''.join(
+                        _make_xlsx_cell(row_index, column_index, value)
+                        for column_index, value in enumerate(row)
+                        if value is not None))
+                    for row_index, row in enumerate(rows, 1)))))
+
+
+def _make_xlsx_cell(row_index, column_index, value):
+    reference = '%s%s' % (chr(ord('A') + column_index), row_index)
+    if isinstance(value, basestring):
+        return '<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' % (
+            reference, escape(value))
+    if isinstance(value, datetime.datetime):
+        value = (value - XLSX_EPOCH).total_seconds() / 86400
+        return '<c r="%s" s="1"><v>%r</v></c>' % (reference, value)
+
+    return '<c r="%s"><v>%r</v></c>' % (reference, value)
 
 
 @ddt
@@ -34,3 +110,264 @@ class TestCsvLoader(unittest.TestCase):
 
         results = list(self._loader().get_all_data_with_headers_from_file(_file))
         self.assertEqual(results, expected)
+
+    @helpers.job
+    def test_loads_compressed_file(self, job):
+        _, filename = tempfile.mkstemp()
+        with gzip.GzipFile(filename, 'wb') as _file:
+            _file.write("a,b\nc,d\n")
+
+        try:
+            results = list(self._loader().get_all_data_with_headers(filename))
+        finally:
+            os.remove(filename)
+        self.assertEqual(results, [{'a': 'c', 'b': 'd'}])
+
+
+class CompactRowsCsvLoader(CsvLoader):
+    class OperationSettings(CsvLoader.OperationSettings):
+        compact_rows = True
+
+
+@ddt
+class TestCsvLoaderCompactRows(TestCsvLoader):
+    _loader = CompactRowsCsvLoader
+
+    @data(
+        # Ragged rows
+        ("a,b\nc\nd,e,f", [{'a': 'c'}, {'a': 'd', 'b': 'e'}]),
+        # Duplicate headers
+        ("a,a\nc,d", [{'a': 'd'}]),
+    )
+    @unpack
+    @helpers.job
+    def test_falls_back_to_dicts(self, contents, expected, job):
+        _file = contents.split('\n')
+
+        results = list(self._loader().get_all_data_with_headers_from_file(_file))
+        self.assertEqual(results, expected)
+        self.assertFalse(any(isinstance(result, CompactRow)
+                             for result in results))
+
+    @helpers.job
+    def test_loads_compact_rows(self, job):
+        results = list(self._loader().get_all_data_with_headers_from_file(
+            ["a,b", "c,d"]))
+
+        self.assertIsInstance(results[0], CompactRow)
+
+
+class SmallChunksParallelCsvLoader(ParallelCsvLoader):
+    class OperationSettings(ParallelCsvLoader.OperationSettings):
+        processes = 2
+        chunk_bytes = 4
+
+
+class UnorderedParallelCsvLoader(SmallChunksParallelCsvLoader):
+    class OperationSettings(SmallChunksParallelCsvLoader.OperationSettings):
+        ordered = False
+
+
+@ddt
+class TestParallelCsvLoader(unittest.TestCase):
+    def setUp(self):
+        _, self.filename = tempfile.mkstemp()
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _write(self, contents):
+        with open(self.filename, 'wb') as _file:
+            _file.write(contents)
+
+    @data(
+        # Empty file
+        "",
+        # Only headers
+        "a,b\n",
+        # Multiple rows, without a last newline
+        "a,b\nc,d\ne,f\ng,h",
+        # Quoted newlines and escaped quotes
+        'a,b\n"c\nc","d""\n"\n"e"",\nf",g\nh,i\n',
+        # Multi-line headers, and Windows newlines
+        '"a\r\na",b\r\nc,d\r\ne,f\r\n',
+    )
+    @helpers.job
+    def test_loads_as_csv_loader(self, contents, job):
+        self._write(contents)
+
+        results = list(SmallChunksParallelCsvLoader()
+                       .get_all_data_with_headers(self.filename))
+
+        self.assertEqual(
+            results, list(CsvLoader().get_all_data_with_headers(self.filename)))
+
+    @helpers.job
+    def test_loads_unordered(self, job):
+        self._write("a\n" + "".join("%s\n" % index for index in xrange(100)))
+
+        results = list(UnorderedParallelCsvLoader()
+                       .get_all_data_with_headers(self.filename))
+
+        self.assertItemsEqual(
+            results, [{'a': str(index)} for index in xrange(100)])
+
+    def test_record_ranges_end_at_records(self):
+        self._write('a\n"b\nb"\nc\nd')
+
+        ranges = get_record_ranges(self.filename, 1)
+
+        self.assertEqual(ranges, [(0, 2), (2, 8), (8, 10), (10, 11)])
+
+
+@ddt
+class TestExcelLoader(unittest.TestCase):
+    _loader = ExcelLoader
+
+    def setUp(self):
+        _, self.filename = tempfile.mkstemp(suffix='.xlsx')
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    @data(
+        # No margins
+        ([['a', 'b'], ['c', 1.0]], [{'a': 'c', 'b': 1.0}]),
+        # Blank margins, with an empty cell in the data
+        ([[], [None, None, 'a', 'b'], [None, None, None, 2.0],
+          [None, 'c', 'd', 3.0]],
+         [{'a': None, 'b': 2.0, None: None}, {'a': 'd', 'b': 3.0, None: 'c'}]),
+        # Dates
+        ([['a'], [datetime.datetime(2017, 1, 2, 3, 4, 5)]],
+         [{'a': datetime.datetime(2017, 1, 2, 3, 4, 5)}]),
+        # Empty rows between
+        ([['a'], [], ['b']], [{'a': None}, {'a': 'b'}]),
+    )
+    @unpack
+    @helpers.job
+    def test_loader_output(self, rows, expected, job):
+        make_xlsx(self.filename, [('Sheet1', rows)])
+
+        results = list(self._loader().get_all_data_with_headers(self.filename))
+
+        self.assertEqual(self._clean_empty(results), expected)
+
+    def _clean_empty(self, results):
+        # Empty cells' value is an empty string
+        return [
+            {
+                (key if key != '' else None): (value if value != '' else None)
+                for key, value in result.iteritems()
+            }
+            for result in results
+        ]
+
+    @helpers.job
+    def test_keeps_margins(self, job):
+        make_xlsx(self.filename, [('Sheet1', [[], [None, 'a'], [None, 'b']])])
+
+        loader = self._loader(skip_start_empty_rows=False,
+                              skip_start_empty_columns=False)
+        results = list(loader.get_all_data_with_headers(self.filename))
+
+        self.assertEqual(self._clean_empty(results), [
+            {None: 'a'}, {None: 'b'}])
+
+
+@ddt
+class TestMultiSheetExcelLoader(unittest.TestCase):
+    def setUp(self):
+        _, self.filename = tempfile.mkstemp(suffix='.xlsx')
+        make_xlsx(self.filename, [
+            ('North', [['a'], ['b'], ['c']]),
+            ('South', [[None], [None, 'a'], [None, 'd']]),
+        ])
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    @data(
+        # All sheets
+        (None, [('North', 'b'), ('North', 'c'), ('South', 'd')]),
+        # Sheets by name and index, in their order
+        (['South', 0], [('South', 'd'), ('North', 'b'), ('North', 'c')]),
+        # A single sheet
+        ([1], [('South', 'd')]),
+    )
+    @unpack
+    @helpers.job
+    def test_loads_sheets(self, sheets, expected, job):
+        loader = MultiSheetExcelLoader(sheets, processes=2)
+
+        results = list(loader.get_all_data_with_headers(self.filename))
+
+        self.assertEqual(results, [
+            {'a': value, 'sheet_name': sheet_name}
+            for sheet_name, value in expected
+        ])
+
+    @helpers.job
+    def test_streams_xlsx_sheets(self, job):
+        open_workbook = loaders.xlrd.open_workbook
+        loaders.xlrd.open_workbook = None
+        try:
+            loader = MultiSheetExcelLoader(['South'], processes=1)
+            results = list(loader.get_all_data_with_headers(self.filename))
+        finally:
+            loaders.xlrd.open_workbook = open_workbook
+
+        self.assertEqual(results, [{'a': 'd', 'sheet_name': 'South'}])
+
+    @unittest.skipUnless(numpy, "numpy is not installed")
+    @helpers.job
+    def test_loads_record_batches(self, job):
+        loader = MultiSheetExcelLoader(processes=2)
+
+        batches = list(loader.get_record_batches(self.filename, batch_size=1))
+
+        self.assertEqual([
+            record_batch.tuples(['a', 'sheet_name'])
+            for record_batch in batches
+        ], [[('b', 'North')], [('c', 'North')], [('d', 'South')]])
+
+    @helpers.job
+    def test_loads_sheet_by_name(self, job):
+        results = list(ExcelLoader('South').get_all_data_with_headers(
+            self.filename))
+
+        self.assertEqual(results, [{'a': 'd'}])
+
+
+@ddt
+class TestXlsxStreamingLoader(TestExcelLoader):
+    _loader = XlsxStreamingLoader
+
+    @helpers.job
+    def test_keeps_margins(self, job):
+        make_xlsx(self.filename, [('Sheet1', [[], [None, 'a'], [None, 'b']])])
+
+        loader = self._loader(skip_start_empty_rows=False,
+                              skip_start_empty_columns=False)
+        results = list(loader.get_all_data_with_headers(self.filename))
+
+        # The empty header row has no headers, unlike with ExcelLoader
+        self.assertEqual(results, [{}, {}])
+
+    @helpers.job
+    def test_ignores_cells_right_of_headers(self, job):
+        make_xlsx(self.filename, [('Sheet1', [['a'], ['b', 'c']])])
+
+        results = list(self._loader().get_all_data_with_headers(self.filename))
+
+        self.assertEqual(results, [{'a': 'b'}])
+
+    @data('A1:D3', 'B1:D3', None)
+    @helpers.job
+    def test_skips_margins_with_dimension(self, dimension, job):
+        make_xlsx(self.filename, [('Sheet1', [
+            [None, None, 'a'], [None, None, 'b'], [None, 'c', 'd']])],
+            dimension=dimension)
+
+        results = list(self._loader().get_all_data_with_headers(self.filename))
+
+        self.assertEqual(results, [{u'': u'', 'a': 'b'}, {u'': 'c', 'a': 'd'}])
@@ -0,0 +1,48 @@
+import cPickle
+import unittest
+
+from sonny.infrastructure.operations.rows import (
+    make_row_class, as_mapping, CompactRow)
+
+
+class TestCompactRow(unittest.TestCase):
+    def setUp(self):
+        self.row = make_row_class(['a', 'b'])(['1', '2'])
+
+    def test_dict_access(self):
+        self.assertEquals(self.row['a'], '1')
+        self.assertEquals(self.row.get('b'), '2')
+        self.assertEquals(self.row.get('c', 'default'), 'default')
+        self.assertIn('a', self.row)
+        self.assertNotIn('1', self.row)
+        with self.assertRaises(KeyError):
+            self.row['c']
+
+    def test_dict_iteration(self):
+        self.assertEquals(list(self.row), ['a', 'b'])
+        self.assertEquals(self.row.keys(), ['a', 'b'])
+        self.assertEquals(self.row.values(), ['1', '2'])
+        self.assertEquals(list(self.row.iteritems()), [('a', '1'), ('b', '2')])
+        self.assertEquals(dict(self.row), {'a': '1', 'b': '2'})
+
+    def test_equals_dict(self):
+        self.assertEquals(self.row, {'a': '1', 'b': '2'})
+        self.assertNotEqual(self.row, {'a': '1'})
+        self.assertEquals(self.row, make_row_class(['b', 'a'])(['2', '1']))
+
+    def test_classes_are_shared(self):
+        self.assertIs(type(self.row), make_row_class(('a', 'b')))
+
+    def test_pickle(self):
+        rows = [self.row, make_row_class(['a', 'b'])(['3', '4'])]
+
+        unpickled = cPickle.loads(cPickle.dumps(rows, cPickle.HIGHEST_PROTOCOL))
+
+        self.assertEquals(unpickled, rows)
+        self.assertIs(type(unpickled[0]), type(self.row))
+
+    def test_as_mapping(self):
+        mapping = as_mapping(self.row)
+
+        self.assertNotIsInstance(mapping, CompactRow)
+        self.assertEquals(mapping, {'a': '1', 'b': '2'})
@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
 import unittest
 
 from sonny.infrastructure.context import helpers
 from sonny.infrastructure.facilities import *  # noqa
 
-from sonny.infrastructure.operations.savers import PrintSaver
+from sonny.infrastructure.operations.savers import (
+    PrintSaver, NamedPipeContextManager)
 
 
 # TODO: Add test for DbSaver, creating a local DB for testing from config
@@ -18,3 +20,28 @@ class TestPrintSaver(unittest.TestCase):
     def test_print_saver_works(self, job):
         self.saver().save([])
         self.saver().save_no_data()
+
+
+class TestNamedPipeContextManager(unittest.TestCase):
+    def test_lines_are_read_from_pipe(self):
+        with NamedPipeContextManager(['a\n', 'b\n']) as filename:
+            with open(filename, 'rb') as _file:
+                self.assertEquals(_file.read(), 'a\nb\n')
+
+        self.assertFalse(os.path.exists(filename))
+
+    def test_unread_pipe_is_cleaned_up(self):
+        with NamedPipeContextManager(['a\n'] * 100000) as filename:
+            pass
+
+        self.assertFalse(os.path.exists(filename))
+
+    def test_lines_exception_is_raised(self):
+        def lines():
+            yield 'a\n'
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            with NamedPipeContextManager(lines()) as filename:
+                with open(filename, 'rb') as _file:
+                    _file.read()
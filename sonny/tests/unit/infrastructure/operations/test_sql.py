@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.sql import parse_insert_query
+
+
+@ddt
+class TestParseInsertQuery(unittest.TestCase):
+    @data(
+        # Positional
+        ("INSERT INTO t (a, b) VALUES (%s, %s)",
+         ("INSERT INTO t (a, b) VALUES", "(%s, %s)", "", (None, None))),
+        # Named, with a trailing semicolon
+        ("INSERT INTO t (a, b)\nVALUES\n    (%(A)s, %(B)s);\n",
+         ("INSERT INTO t (a, b)\nVALUES", "(%(A)s, %(B)s)", "", ("A", "B"))),
+        # Nested parenthesis and escaped percents
+        ("INSERT IGNORE INTO t VALUES (NULL, STR_TO_DATE(%(d)s, \"%%d)\"))",
+         ("INSERT IGNORE INTO t VALUES",
+          "(NULL, STR_TO_DATE(%(d)s, \"%%d)\"))", "", ("d",))),
+        # With a suffix
+        ("INSERT INTO t (a) values (%s) ON CONFLICT DO NOTHING",
+         ("INSERT INTO t (a) VALUES", "(%s)", "ON CONFLICT DO NOTHING",
+          (None,))),
+        # Not an insert
+        ("DELETE FROM t WHERE a = %s", None),
+        # No placeholders
+        ("INSERT INTO t (a) VALUES (1)", None),
+        # Already multi-row
+        ("INSERT INTO t (a) VALUES (%s), (%s)", None),
+        # Placeholders outside of the row
+        ("INSERT INTO t (a) VALUES (%s) ON DUPLICATE KEY UPDATE a = %s", None),
+        # Mixed placeholders
+        ("INSERT INTO t (a, b) VALUES (%s, %(b)s)", None),
+    )
+    @unpack
+    def test_parse_output(self, query, expected):
+        result = parse_insert_query(query)
+
+        if expected is None:
+            self.assertIsNone(result)
+        else:
+            self.assertEquals(tuple(result), expected)
+
+    @data(
+        ("INSERT INTO t (a, b) VALUES (%s, %s)", ("t", ["a", "b"])),
+        ("INSERT INTO s.t (a,b) VALUES (%(A)s,%(B)s)", ("s.t", ["a", "b"])),
+        # Expressions
+        ("INSERT INTO t (a, b) VALUES (%s, NOW())", None),
+        ("INSERT INTO t (a, b) VALUES (%s, LOWER(%s))", None),
+        # No columns
+        ("INSERT INTO t VALUES (%s, %s)", None),
+        # Modifiers
+        ("INSERT IGNORE INTO t (a) VALUES (%s)", None),
+        # Suffix
+        ("INSERT INTO t (a) VALUES (%s) ON CONFLICT DO NOTHING", None),
+    )
+    @unpack
+    def test_table_and_columns(self, query, expected):
+        result = parse_insert_query(query).table_and_columns()
+
+        self.assertEquals(result, expected)
+
+    @data(
+        ("INSERT INTO t (a) VALUES (%s)", False),
+        ("INSERT INTO t (a) VALUES (%s) ON CONFLICT DO NOTHING", False),
+        ("INSERT INTO t (a) VALUES (%s) ON CONFLICT (a) DO UPDATE "
+         "SET a = EXCLUDED.a", True),
+        ("INSERT INTO t (a) VALUES (%s) ON DUPLICATE KEY UPDATE a = VALUES(a)",
+         True),
+    )
+    @unpack
+    def test_is_upsert(self, query, expected):
+        self.assertEquals(parse_insert_query(query).is_upsert, expected)
+
+    def test_row_values(self):
+        named = parse_insert_query("INSERT INTO t VALUES (%(b)s, %(a)s)")
+        positional = parse_insert_query("INSERT INTO t VALUES (%s, %s)")
+
+        self.assertEquals(named.row_values({'a': 1, 'b': 2, 'c': 3}), (2, 1))
+        self.assertEquals(positional.row_values([1, 2]), (1, 2))
+
+    def test_multirow(self):
+        insert_query = parse_insert_query(
+            "INSERT INTO t (a, b) VALUES (%(a)s, LOWER(%(b)s), '%%')")
+        rows = [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}]
+
+        self.assertEquals(insert_query.multirow(rows), (
+            "INSERT INTO t (a, b) VALUES (%s, LOWER(%s), '%%'), "
+            "(%s, LOWER(%s), '%%')",
+            (1, 2, 3, 4),
+        ))
+
+    def test_positional_query(self):
+        insert_query = parse_insert_query(
+            "INSERT INTO t (a, b) VALUES (%(a)s, %(b)s) ON CONFLICT DO NOTHING")
+
+        self.assertEquals(
+            insert_query.positional_query,
+            "INSERT INTO t (a, b) VALUES (%s, %s) ON CONFLICT DO NOTHING")
@@ -7,6 +7,7 @@ from sonny.infrastructure.context import helpers
 from sonny.infrastructure.facilities import *  # noqa
 
 from sonny.infrastructure.operations import transformers
+from sonny.infrastructure.operations.rows import make_row_class
 
 
 @ddt
@@ -204,3 +205,79 @@ class TestUpdateWithDynamicValues(unittest.TestCase):
 
         result = list(transformer(inputs))
         self.assertEquals(result, expected)
+
+
+def _chain(*_transformers):
+    def do_chain(inputs):
+        for transformer in _transformers:
+            inputs = transformer(inputs)
+        return inputs
+
+    return do_chain
+
+
+@ddt
+class TestPipeline(unittest.TestCase):
+    inputs = [
+        {'a': '1', 'b': '2', 'c': '3'},
+        {'a': '4', 'c': '5'},
+        make_row_class(['a', 'b', 'd'])(['6', '7', '8']),
+    ]
+
+    @data(
+        # No transformers
+        [],
+        # A typical chain
+        [transformers.keep_keys(['a', 'b', 'c']),
+         transformers.cast_dicts_values({'a': int, 'c': None, 'x': int}),
+         transformers.update_with_static_values({'b': 0, 'e': 1})],
+        # Casts of casts, and of static values
+        [transformers.cast_dicts_values({'a': int}),
+         transformers.update_with_static_values({'e': '9'}),
+         transformers.cast_dicts_values({'a': float, 'e': int})],
+        # Keys kept from kept keys and static values
+        [transformers.update_with_static_values({'e': 1, 'f': 2}),
+         transformers.keep_keys(['a', 'b', 'e']),
+         transformers.keep_keys(['a', 'e'])],
+        # Dynamic values see the row before they are set
+        [transformers.keep_keys(['a', 'b']),
+         transformers.update_with_dynamic_values({
+             'a': lambda row: row.get('b'), 'b': lambda row: row['a']}),
+         transformers.cast_dicts_values({'b': int})],
+        # Generic maps and non-row transformers in between
+        [transformers.update_with_static_values({'e': 1}),
+         transformers.generic_map(lambda row: dict(row, f=len(row))),
+         transformers.generator_to_tuples(),
+         transformers.cast_dicts_values({'f': str})],
+    )
+    @helpers.job
+    def test_same_output_as_transformers(self, _transformers, job):
+        result = list(transformers.pipeline(*_transformers)(self.inputs))
+
+        self.assertEquals(result, list(_chain(*_transformers)(self.inputs)))
+
+    @helpers.job
+    def test_dicts_to_tuples(self, job):
+        _transformers = [
+            transformers.keep_keys(['a', 'b', 'c']),
+            transformers.cast_dicts_values({'a': int}),
+            transformers.update_with_static_values({'c': 0}),
+            transformers.dicts_to_tuples(['c', 'a']),
+        ]
+
+        result = list(transformers.pipeline(*_transformers)(self.inputs))
+
+        self.assertEquals(result, [(0, 1), (0, 4), (0, 6)])
+
+    @data(
+        # Missing from the input
+        ([transformers.dicts_to_tuples(['b'])], [{'a': 1}]),
+        # Not kept
+        ([transformers.keep_keys(['a']), transformers.dicts_to_tuples(['b'])],
+         [{'a': 1, 'b': 2}]),
+    )
+    @unpack
+    @helpers.job
+    def test_dicts_to_tuples_of_missing_keys(self, _transformers, inputs, job):
+        with self.assertRaises(KeyError):
+            list(transformers.pipeline(*_transformers)(inputs))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import itertools
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.context import helpers
+from sonny.infrastructure.facilities import *  # noqa
+from sonny.infrastructure.operations.utils import (
+    batch, background_iterator, IterableFile, ReplayableIterable)
+
+
+@ddt
+class TestBatch(unittest.TestCase):
+    @data(
+        # No input
+        ([], 2, []),
+        # Less than a batch
+        ([1], 2, [[1]]),
+        # Exactly a batch
+        ([1, 2], 2, [[1, 2]]),
+        # More than a batch
+        ([1, 2, 3], 2, [[1, 2], [3]]),
+        # Multiple batches
+        (range(7), 3, [[0, 1, 2], [3, 4, 5], [6]]),
+    )
+    @unpack
+    def test_batch_output(self, inputs, batch_size, expected):
+        result = list(batch(inputs, batch_size=batch_size))
+
+        self.assertEquals(result, expected)
+
+    def test_batch_pulls_one_batch_at_a_time(self):
+        inputs = itertools.count()
+        batches = batch(inputs, batch_size=3)
+
+        self.assertEquals(next(batches), [0, 1, 2])
+        self.assertEquals(next(inputs), 3)
+
+
+@ddt
+class TestBackgroundIterator(unittest.TestCase):
+    @data(
+        ([], 1),
+        (range(5), 1),
+        (range(5), 2),
+        (range(10000), 7),
+    )
+    @unpack
+    def test_items_are_in_order(self, inputs, batch_size):
+        result = list(background_iterator(
+            iter(inputs), queue_size=2, batch_size=batch_size))
+
+        self.assertEquals(result, list(inputs))
+
+    def test_exception_is_reraised(self):
+        def inputs():
+            yield 1
+            raise ValueError()
+
+        iterator = background_iterator(inputs(), batch_size=1)
+        self.assertEquals(next(iterator), 1)
+        with self.assertRaises(ValueError):
+            next(iterator)
+
+    @helpers.job
+    def test_steps_run_as_plain_calls(self, job):
+        @helpers.step
+        def double(value):
+            # Long enough for the threads' steps to overlap
+            time.sleep(0.001)
+            return value * 2
+
+        @helpers.step
+        def consume(iterator):
+            return [double(value) for value in iterator]
+
+        # Each thread calls steps, while the other is in a step
+        values = consume(background_iterator(
+            (double(value) for value in xrange(50)), batch_size=1))
+
+        self.assertEquals(values, [value * 4 for value in xrange(50)])
+        self.assertEquals(job._steps, [job.current_step])
+        self.assertEquals(
+            [section.name
+             for section in job.profiler.profiling_section.profiling_sections],
+            ['consume'])
+
+    def test_producer_stops_when_consumer_stops(self):
+        inputs = itertools.count()
+        iterator = background_iterator(inputs, queue_size=1, batch_size=1)
+        self.assertEquals(next(iterator), 0)
+        iterator.close()
+
+        self.assertLess(next(inputs), 10)
+
+
+@ddt
+class TestIterableFile(unittest.TestCase):
+    @data(
+        ([], ''),
+        (['a'], 'a'),
+        (['ab', '', 'cde\n', 'f'], 'abcde\nf'),
+    )
+    @unpack
+    def test_read_all(self, chunks, expected):
+        self.assertEquals(IterableFile(chunks).read(), expected)
+
+    @data(1, 2, 3, 100)
+    def test_read_sizes(self, size):
+        _file = IterableFile(['ab', '', 'cde\n', 'f'])
+        read = list(iter(lambda: _file.read(size), ''))
+
+        self.assertEquals(''.join(read), 'abcde\nf')
+        self.assertTrue(all(len(chunk) <= size for chunk in read))
+
+    def test_readline(self):
+        _file = IterableFile(['a', 'b\nc', 'd\n\n', 'e'])
+        lines = list(iter(_file.readline, ''))
+
+        self.assertEquals(lines, ['ab\n', 'cd\n', '\n', 'e'])
+
+
+@ddt
+class TestReplayableIterable(unittest.TestCase):
+    @data(
+        ([], 1),
+        ([{'a': 1}], 1),
+        ([{'a': i, 'b': str(i)} for i in range(10)], 3),
+    )
+    @unpack
+    def test_can_be_iterated_multiple_times(self, inputs, batch_size):
+        with ReplayableIterable(iter(inputs), batch_size=batch_size) \
+                as replayable:
+            self.assertEquals(list(replayable), inputs)
+            self.assertEquals(list(replayable), inputs)
+
+    def test_file_is_deleted(self):
+        with ReplayableIterable([1, 2]) as replayable:
+            self.assertTrue(os.path.exists(replayable.filename))
+
+        self.assertFalse(os.path.exists(replayable.filename))
@@ -0,0 +1,31 @@
+import datetime
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.xldates import XldateConverter
+
+
+@ddt
+class TestXldateConverter(unittest.TestCase):
+    @data(
+        (0, 42737.12783564815, datetime.datetime(2017, 1, 2, 3, 4, 5)),
+        (1, 41275.0, datetime.datetime(2017, 1, 2)),
+        (0, 61.5, datetime.datetime(1900, 3, 1, 12)),
+    )
+    @unpack
+    def test_converts_like_xlrd(self, datemode, value, expected):
+        self.assertEqual(XldateConverter(datemode)(value), expected)
+
+    def test_remembers_datetimes(self):
+        to_datetime = XldateConverter(0)
+
+        self.assertIs(to_datetime(42737.0), to_datetime(42737.0))
+
+    def test_forgets_datetimes_when_full(self):
+        to_datetime = XldateConverter(0)
+        to_datetime.max_size = 2
+
+        for value in [42737.0, 42738.0, 42739.0]:
+            to_datetime(value)
+
+        self.assertEqual(to_datetime.datetimes.keys(), [42739.0])
@@ -0,0 +1,46 @@
+import os
+import zipfile
+import tempfile
+import unittest
+from ddt import ddt, data, unpack
+
+from sonny.infrastructure.operations.xlsx import (
+    count_sheets, get_column_index, is_date_format_code)
+from sonny.tests.unit.infrastructure.operations.test_loaders import make_xlsx
+
+
+@ddt
+class TestXlsx(unittest.TestCase):
+    @data(
+        ('A1', 0),
+        ('Z10', 25),
+        ('AB3', 27),
+        ('$C$4', 2),
+    )
+    @unpack
+    def test_get_column_index(self, reference, expected):
+        self.assertEqual(get_column_index(reference), expected)
+
+    @data(
+        ('yyyy-mm-dd', True),
+        ('[$-409]h:mm AM/PM', True),
+        ('General', False),
+        ('#,##0.00', False),
+        ('[Red]0.00', False),
+        ('"days"\\ 0', False),
+    )
+    @unpack
+    def test_is_date_format_code(self, format_code, expected):
+        self.assertEqual(is_date_format_code(format_code), expected)
+
+    def test_count_sheets_only_parses_workbook(self):
+        _, filename = tempfile.mkstemp(suffix='.xlsx')
+        try:
+            make_xlsx(filename, [('North', [['a']]), ('South', [['b']])])
+            with zipfile.ZipFile(filename, 'a') as archive:
+                archive.writestr('xl/sharedStrings.xml', 'not XML')
+
+            with zipfile.ZipFile(filename) as archive:
+                self.assertEqual(count_sheets(archive), 2)
+        finally:
+            os.remove(filename)